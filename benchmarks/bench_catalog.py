@@ -0,0 +1,88 @@
+"""Import rate and query latency of the SQLite catalog.
+
+One synthetic snapshot is written as binary snapshot and imported the given
+number of times under different names, as if it were the snapshot of
+several nights. The queries then run over all of them.
+
+About 100 million file rows: --depth 5 --fanout 10 --files 90 --snapshots 10
+(roughly 1.5 GB of memory for the snapshot and 15 GB of database, put it on
+a disk with --dir).
+Usage: python benchmarks/bench_catalog.py [--depth D] [--fanout F]
+       [--files N] [--snapshots S] [--repeat R] [--dir DIR]"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshot_format  # noqa: E402
+from catalog import Catalog  # noqa: E402
+from traverser import is_reserved  # noqa: E402
+from synthetic import make_snapshot, scratch_dir  # noqa: E402
+
+
+def queries(data):
+    """Queries for the snapshot: an exact name, a name prefix, a path range,
+    a regular expression on all names, and filters on the indexed
+    columns."""
+    root = data["root"]
+    name = next(iter(root["__/files"]))
+    folder = next(key for key in root if not is_reserved(key))
+    return [("exact name", "^{}$".format(name.replace(".", r"\."))),
+            ("name prefix", "^" + name[:3]),
+            ("under", "under:" + folder),
+            ("regex", r"q7.*\.dat$"),
+            ("ext size top", "ext:dat size>1000MiB top:10"),
+            ("modified", "modified<2017-08 top:10")]
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--files", type=int, default=90)
+    parser.add_argument("--snapshots", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--dir", help="Directory for the database, by "
+                        "default a temporary one")
+    arguments = parser.parse_args()
+    data = make_snapshot(arguments.depth, arguments.fanout, arguments.files)
+    with scratch_dir() as tmp, contextlib.ExitStack() as stack:
+        filename = os.path.join(tmp, "snapshot.fsb")
+        snapshot_format.write_binary(data, filename)
+        database = os.path.join(arguments.dir or tmp, "catalog.db")
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(database)
+        catalog = Catalog(database)
+        stack.callback(catalog.close)
+        rows = 0
+        start = time.perf_counter()
+        for number in range(arguments.snapshots):
+            night = os.path.join(tmp, "night-{}.fsb".format(number))
+            os.symlink(filename, night)
+            begin = time.perf_counter()
+            files_n = catalog.import_snapshot(night)
+            rows += files_n
+            print("import {:>3} {:10} files {:8.3f} s".format(
+                number, files_n, time.perf_counter() - begin))
+        duration = time.perf_counter() - start
+        print("{} file rows in {:.3f} s, {:.0f} rows/s, database {:.1f} "
+              "MB".format(rows, duration, rows / duration,
+                          os.path.getsize(database) / 1e6))
+        for title, text in queries(data):
+            times = []
+            for _ in range(arguments.repeat):
+                begin = time.perf_counter()
+                found = sum(1 for _ in catalog.query(text))
+                times.append(time.perf_counter() - begin)
+            print("{:<14} {:>9} found  median {:9.4f} s  {!r}".format(
+                title, found, statistics.median(times), text))
+
+
+if __name__ == '__main__':
+    main()
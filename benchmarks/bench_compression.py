@@ -0,0 +1,53 @@
+"""Size, write and load speed of the compression codecs for snapshots.
+
+Usage: python benchmarks/bench_compression.py [--depth D] [--fanout F]
+                                              [--files N] [--fast]"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import file_table  # noqa: E402
+import compression  # noqa: E402
+import folder_structure_backup  # noqa: E402
+from synthetic import make_snapshot, scratch_dir  # noqa: E402
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--fast", action="store_true",
+                        help="Snapshot without file details")
+    arguments = parser.parse_args()
+    data = make_snapshot(arguments.depth, arguments.fanout, arguments.files,
+                         big=not arguments.fast)
+    with scratch_dir() as tmp:
+        plain = None
+        print("{:6} {:>10} {:>7} {:>9} {:>9}".format(
+            "codec", "size", "ratio", "write", "load"))
+        for codec in [None] + sorted(compression.CODECS):
+            extension = compression.CODECS[codec][1] if codec else ""
+            filename = os.path.join(tmp, "snapshot.json" + extension)
+            start = time.perf_counter()
+            folder_structure_backup.save(data, filename)
+            written = time.perf_counter() - start
+            start = time.perf_counter()
+            loaded = folder_structure_backup.load(filename)
+            read = time.perf_counter() - start
+            size = os.path.getsize(filename)
+            plain = plain or size
+            status = "" if json.dumps(loaded, default=file_table.to_json) \
+                == json.dumps(data) else " MISMATCH"
+            print("{:6} {:>10} {:>6.1f}x {:>8.3f}s {:>8.3f}s{}".format(
+                codec or "none", size, plain / size, written, read, status))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Memory and aggregation speed of loaded snapshots: one dictionary per
+file versus the columns of file_table.
+
+Usage: python benchmarks/bench_file_table.py [--depth D] [--fanout F]
+                                             [--files N]"""
+
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import file_table  # noqa: E402
+from traverser import JsonTraverser  # noqa: E402
+from synthetic import make_snapshot  # noqa: E402
+
+
+def measure(load, text):
+    """Load the snapshot, return it with load time and memory held in MiB."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    data = load(text)
+    duration = time.perf_counter() - start
+    held = tracemalloc.get_traced_memory()[0] / 2 ** 20
+    tracemalloc.stop()
+    return data, duration, held
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--files", type=int, default=200)
+    arguments = parser.parse_args()
+    text = json.dumps(make_snapshot(arguments.depth, arguments.fanout,
+                                    arguments.files))
+    print("numpy: {}".format("yes" if file_table.numpy else "no"))
+    results = []
+    for name, load in (
+            ("dicts", json.loads),
+            ("columns", lambda text: json.loads(
+                text, object_pairs_hook=file_table.columnar))):
+        data, duration, held = measure(load, text)
+        traverser = JsonTraverser(data)
+        start = time.perf_counter()
+        totals = traverser.totals(data)
+        aggregate = time.perf_counter() - start
+        results.append(totals)
+        print("{:8} load {:7.3f}s  held {:8.1f} MiB  totals {:7.3f}s".format(
+            name, duration, held, aggregate))
+        del data, traverser
+    print("Totals: {} folders, {} files, {} bytes {}".format(
+        *results[0], "ok" if results[0] == results[1] else "MISMATCH"))
+
+
+if __name__ == '__main__':
+    main()
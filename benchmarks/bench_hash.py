@@ -0,0 +1,69 @@
+"""Throughput of content hashing for different numbers of readers and chunk
+sizes, on a synthetic tree.
+
+Usage: python benchmarks/bench_hash.py [--depth D] [--fanout F] [--files N]
+                                       [--max-size BYTES]"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import content_hash  # noqa: E402
+import folder_structure_backup  # noqa: E402
+from synthetic import make_tree, scratch_dir  # noqa: E402
+
+
+def run(root, structure, readers, chunk_size, previous=None,
+        duplicates=False):
+    """Hash the scanned structure, return the hasher and the duration."""
+    hasher = content_hash.Hasher(readers, chunk_size)
+    start = time.perf_counter()
+    folder_structure_backup.hash_files(structure, root, hasher, previous,
+                                       duplicates)
+    duration = time.perf_counter() - start
+    hasher.close()
+    return hasher, duration
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--fanout", type=int, default=6)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--max-size", type=int, default=1 << 20)
+    parser.add_argument("--readers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--chunks", type=int, nargs="+",
+                        default=[1 << 16, 1 << 20])
+    arguments = parser.parse_args()
+    with scratch_dir() as tmp:
+        root = os.path.join(tmp, "root")
+        folders, files = make_tree(root, arguments.depth, arguments.fanout,
+                                   arguments.files,
+                                   max_size=arguments.max_size)
+        print("Tree: {} folders, {} files".format(folders, files))
+        structure = None
+        for readers in arguments.readers:
+            for chunk_size in arguments.chunks:
+                structure = folder_structure_backup.scan_path(root, "big")
+                hasher, duration = run(root, structure, readers, chunk_size)
+                print("readers={:<2} chunk={:>8} {:8.3f}s {:8.1f} MB/s".format(
+                    readers, chunk_size, duration,
+                    hasher.counts["bytes"] / duration / 1e6))
+        rescan = folder_structure_backup.scan_path(root, "big")
+        hasher, duration = run(root, rescan, arguments.readers[-1],
+                               arguments.chunks[-1], previous=structure)
+        print("reused from previous   {:8.3f}s {} hashes reused".format(
+            duration, hasher.counts["reused"]))
+        rescan = folder_structure_backup.scan_path(root, "big")
+        hasher, duration = run(root, rescan, arguments.readers[-1],
+                               arguments.chunks[-1], duplicates=True)
+        print("size prefilter         {:8.3f}s {} of {} files hashed".format(
+            duration, hasher.counts["hashed"], files))
+
+
+if __name__ == '__main__':
+    main()
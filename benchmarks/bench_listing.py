@@ -0,0 +1,51 @@
+"""Cost of preparing the listing of a huge folder for the navigator.
+
+Before, every entry was prefixed, sorted and inserted into the listbox.
+Now the folder is sorted once and only the rows in view are built.
+The Tk part itself needs a display and is not measured.
+Usage: python benchmarks/bench_listing.py [--entries N] [--rows R]"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from traverser import JsonTraverser  # noqa: E402
+from synthetic import random_name  # noqa: E402
+
+
+def timed(function, *args):
+    """Return the result and the duration of a call."""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=1000000)
+    parser.add_argument("--rows", type=int, default=40)
+    arguments = parser.parse_args()
+    rng = random.Random(0)
+    names = [random_name(rng, 16) for _ in range(arguments.entries)]
+    data = {"spool": {"__/files": names}}
+    _, duration = timed(JsonTraverser(data).down("spool").content_nice)
+    print("prefix and sort everything  {:8.3f} s".format(duration))
+    traverser = JsonTraverser(data).down("spool")
+
+    def first_window():
+        view = traverser.content_nice_view(head=("..",))
+        return [view[index] for index in range(min(arguments.rows,
+                                                   len(view)))]
+    _, duration = timed(first_window)
+    print("enter folder, first time    {:8.3f} s".format(duration))
+    _, duration = timed(first_window)
+    print("enter folder again          {:8.3f} s".format(duration))
+
+
+if __name__ == '__main__':
+    main()
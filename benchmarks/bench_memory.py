@@ -0,0 +1,56 @@
+"""Peak memory of building the snapshot in memory versus streaming it.
+
+Every variant runs in its own interpreter, the peak RSS is reported for
+two tree sizes to show that streaming does not grow with the file count.
+Usage: python benchmarks/bench_memory.py [--files N N ...]"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+from synthetic import make_tree, scratch_dir
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SNIPPET = """
+import sys, resource
+sys.path.insert(0, {repository!r})
+import folder_structure_backup
+folder_structure_backup.iterate_and_save({root!r}, {target!r}, "big",
+                                         stream={stream!r})
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def peak_rss(root, target, stream):
+    """Peak RSS in KiB of a snapshot run in a fresh interpreter."""
+    code = SNIPPET.format(repository=REPOSITORY, root=root, target=target,
+                          stream=stream)
+    output = subprocess.run([sys.executable, "-c", code], check=True,
+                            capture_output=True, text=True).stdout
+    return int(output.split()[-1])
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--files", type=int, nargs="+", default=[50, 500])
+    arguments = parser.parse_args()
+    for files in arguments.files:
+        with scratch_dir() as tmp:
+            root = os.path.join(tmp, "root")
+            folders_n, files_n = make_tree(root, arguments.depth,
+                                           arguments.fanout, files, max_size=0)
+            target = os.path.join(tmp, "snapshot.json")
+            in_memory = peak_rss(root, target, False)
+            streamed = peak_rss(root, target, True)
+            print("{:7} folders {:9} files: in memory {:8} KiB, "
+                  "streamed {:8} KiB".format(folders_n, files_n, in_memory,
+                                             streamed))
+
+
+if __name__ == '__main__':
+    main()
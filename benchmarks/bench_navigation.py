@@ -0,0 +1,68 @@
+"""Navigation cost on a very deep tree: going down to the deepest folder and
+back up again, updating the path after every step like the navigator does.
+
+Usage: python benchmarks/bench_navigation.py [--depth D] [--repeat N]"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from traverser import JsonTraverser  # noqa: E402
+
+
+class DescendingTraverser(JsonTraverser):
+    """up and current_path as they were: starting at the root every time."""
+    def up(self):  # pylint: disable=invalid-name
+        self.position.pop()
+        current = self.data
+        for folder in self.position:
+            current = current[folder]
+        self.current = current
+        return self
+
+    def current_path(self):
+        return os.sep.join([i.replace(os.sep, "") for i in self.position])
+
+
+def deep_tree(depth):
+    """A chain of depth folders with one file each."""
+    data = node = {}
+    for level in range(depth):
+        node["level_{}".format(level)] = child = {"__/files": ["file.txt"]}
+        node = child
+    return data
+
+
+def round_trip(traverser, depth):
+    """Go all the way down and up again."""
+    for level in range(depth):
+        traverser.down("level_{}".format(level))
+        traverser.current_path()
+    for _ in range(depth):
+        traverser.up()
+        traverser.current_path()
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=200)
+    arguments = parser.parse_args()
+    data = deep_tree(arguments.depth)
+    for name, cls in (("descending", DescendingTraverser),
+                      ("stacks", JsonTraverser)):
+        traverser = cls(data)
+        start = time.perf_counter()
+        for _ in range(arguments.repeat):
+            round_trip(traverser, arguments.depth)
+        duration = time.perf_counter() - start
+        steps = arguments.repeat * arguments.depth * 2
+        print("{:11} {:8.3f} us per step".format(name, duration / steps * 1e6))
+
+
+if __name__ == '__main__':
+    main()
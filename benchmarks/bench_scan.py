@@ -0,0 +1,56 @@
+"""Compare the os.walk based iterate_path with the scandir engine.
+
+Usage: python benchmarks/bench_scan.py [--depth D] [--fanout F] [--files N]"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import folder_structure_backup  # noqa: E402
+from synthetic import make_tree, scratch_dir  # noqa: E402
+
+
+def without_folder_times(structure):
+    """Drop the folder modification times iterate_path does not record."""
+    return {key: without_folder_times(value) if key != "__/files" else value
+            for key, value in structure.items() if key != "__/modified"}
+
+
+def timed(function, *args):
+    """Return the result and the duration of a call."""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    arguments = parser.parse_args()
+    with scratch_dir() as tmp:
+        root = os.path.join(tmp, "root")
+        folders, files = make_tree(root, arguments.depth, arguments.fanout,
+                                   arguments.files)
+        print("Tree: {} folders, {} files".format(folders, files))
+        for mode in ("fast", "big"):
+            expected, duration = timed(
+                folder_structure_backup.iterate_path, root, mode)
+            print("{:5} iterate_path        {:8.3f}s".format(mode, duration))
+            for workers in arguments.workers:
+                result, duration = timed(
+                    folder_structure_backup.scan_path, root, mode, workers)
+                result = without_folder_times(result)
+                status = "ok" if result == expected else "MISMATCH"
+                print("{:5} scan_path workers={:<2} {:8.3f}s {}".format(
+                    mode, workers, duration, status))
+
+
+if __name__ == '__main__':
+    main()
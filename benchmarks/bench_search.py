@@ -0,0 +1,63 @@
+"""Search latency with and without the name index.
+
+Usage: python benchmarks/bench_search.py [--depth D] [--fanout F] [--files N]
+       [--query Q ...]"""
+
+import os
+import io
+import sys
+import time
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import file_search  # noqa: E402
+import folder_structure_backup  # noqa: E402
+from search_index import SearchIndex  # noqa: E402
+from traverser import JsonTraverser  # noqa: E402
+from synthetic import make_snapshot, scratch_dir  # noqa: E402
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--query", nargs="+",
+                        default=["abc", r"q7.*\.dat$", "_3$", "x"])
+    arguments = parser.parse_args()
+    data = make_snapshot(arguments.depth, arguments.fanout, arguments.files)
+    with scratch_dir() as tmp:
+        filename = os.path.join(tmp, "snapshot.json")
+        folder_structure_backup.save(data, filename)
+        start = time.perf_counter()
+        index = SearchIndex.build(JsonTraverser(data))
+        print("build index {:10.3f} s for {} names".format(
+            time.perf_counter() - start, len(index.names)))
+        index.save(filename + ".idx", filename)
+        start = time.perf_counter()
+        index = SearchIndex.load(filename + ".idx", filename)
+        print("load index  {:10.3f} ms".format(
+            (time.perf_counter() - start) * 1000))
+        for query in arguments.query:
+            output = io.StringIO()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(output):
+                file_search.search(JsonTraverser(data), query)
+            walked = time.perf_counter() - start
+            start = time.perf_counter()
+            hits = list(index.search(query))
+            indexed = time.perf_counter() - start
+            start = time.perf_counter()
+            list(index.search(query))
+            again = time.perf_counter() - start
+            print("{:14} {:7} hits: traversal {:9.3f} ms, index {:9.3f} ms, "
+                  "repeated {:9.3f} ms".format(query, len(hits), walked * 1000,
+                                               indexed * 1000, again * 1000))
+        del index  # release the mapping before the directory is removed
+
+
+if __name__ == '__main__':
+    main()
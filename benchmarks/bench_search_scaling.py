@@ -0,0 +1,55 @@
+"""Scaling of the parallel index search with the number of processes.
+
+Usage: python benchmarks/bench_search_scaling.py [--jobs 1 2 4 8]
+       [--depth D] [--fanout F] [--files N] [--query Q ...]"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import SearchIndex, ParallelSearch  # noqa: E402
+from traverser import JsonTraverser  # noqa: E402
+from synthetic import make_snapshot, scratch_dir  # noqa: E402
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--query", nargs="+",
+                        default=[r"^[a-f].*[0-4]\.dat$", "x", r"q7.*\.dat$"])
+    arguments = parser.parse_args()
+    data = make_snapshot(arguments.depth, arguments.fanout, arguments.files)
+    with scratch_dir() as tmp:
+        filename = os.path.join(tmp, "snapshot.idx")
+        SearchIndex.build(JsonTraverser(data)).save(filename)
+        del data
+        index = SearchIndex.load(filename)
+        print("{} names, {} CPUs".format(len(index.names), os.cpu_count()))
+        for query in arguments.query:
+            expected = None
+            for jobs in arguments.jobs:
+                searcher = ParallelSearch(index, jobs)
+                list(searcher.search("warm up"))
+                start = time.perf_counter()
+                hits = list(searcher.search(query))
+                duration = time.perf_counter() - start
+                searcher.close()
+                if expected is None:
+                    expected = hits
+                    single = duration
+                status = "ok" if hits == expected else "MISMATCH"
+                print("{:22} jobs={:<2} {:9.3f} ms  speedup {:5.2f}  "
+                      "{}".format(query, jobs, duration * 1000,
+                                  single / duration, status))
+        del index
+
+
+if __name__ == '__main__':
+    main()
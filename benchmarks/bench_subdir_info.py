@@ -0,0 +1,74 @@
+"""Latency of selecting the root folder in the navigator (subdir_info).
+
+Compares walking the subtree on every selection, as done before, with the
+precomputed totals, for both the json and the binary traverser.
+Usage: python benchmarks/bench_subdir_info.py [--depth D] [--fanout F]
+       [--files N]   (defaults: 111111 folders, 5 million files)"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshot_format  # noqa: E402
+from traverser import JsonTraverser, MappedTraverser  # noqa: E402
+from synthetic import make_snapshot, scratch_dir  # noqa: E402
+
+
+def walk_totals(traverser, structure):
+    """Totals the way subdir_info computed them on every call before."""
+    folders_n = files_n = size = 0
+    for _, files in traverser.walk(structure):
+        folders_n += 1
+        files_n += len(files)
+        size += sum([file.get("size", 0) for file in files.values()])
+    return folders_n - 1, files_n, size
+
+
+def timed(function, *args):
+    """Return the result and the duration of a call."""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--files", type=int, default=45)
+    parser.add_argument("--repeat", type=int, default=100)
+    arguments = parser.parse_args()
+    data = make_snapshot(arguments.depth, arguments.fanout, arguments.files)
+    json_traverser = JsonTraverser(data).down("root")
+    expected, duration = timed(walk_totals, json_traverser,
+                               json_traverser.current)
+    print("Tree: {} folders, {} files".format(expected[0] + 1, expected[1]))
+    print("walk per selection        {:10.3f} ms".format(duration * 1000))
+    _, duration = timed(json_traverser.subdir_info, "..", True)
+    print("json: first selection     {:10.3f} ms".format(duration * 1000))
+    start = time.perf_counter()
+    for _ in range(arguments.repeat):
+        json_traverser.subdir_info("..", True)
+    duration = (time.perf_counter() - start) / arguments.repeat
+    print("json: next selections     {:10.3f} ms".format(duration * 1000))
+    assert json_traverser.totals(json_traverser.current) == expected
+    with scratch_dir() as tmp:
+        filename = os.path.join(tmp, "snapshot.fsb")
+        snapshot_format.write_binary(data, filename)
+        del data, json_traverser
+        mapped = MappedTraverser(filename).down("root")
+        start = time.perf_counter()
+        for _ in range(arguments.repeat):
+            mapped.subdir_info("..", True)
+        duration = (time.perf_counter() - start) / arguments.repeat
+        print("binary: every selection   {:10.3f} ms".format(duration * 1000))
+        assert mapped.totals(mapped.current) == expected
+        mapped.snapshot.close()
+
+
+if __name__ == '__main__':
+    main()
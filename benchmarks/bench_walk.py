@@ -0,0 +1,89 @@
+"""Walking a snapshot: the recursive generator used before against the walk
+with an explicit stack, on a wide tree, a bushy one and a deep chain.
+
+The recursive walk stacks a generator frame per level, every folder passes
+through all the frames above it; it fails beyond the recursion limit.
+Usage: python benchmarks/bench_walk.py [--depth D] [--fanout F] [--files N]
+       [--chain LEVELS]"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from traverser import JsonTraverser, is_reserved  # noqa: E402
+from synthetic import make_snapshot  # noqa: E402
+
+
+def recursive_walk(structure):
+    """JsonTraverser.walk as it was before."""
+    try:
+        files = structure.get("__/files", {})
+    except AttributeError:  # root element is list
+        files = {}
+    folders = [key for key in structure if not is_reserved(key)]
+    yield folders, files
+    for folder in folders:
+        yield from recursive_walk(structure[folder])
+
+
+def chain(levels):
+    """A folder in a folder in a folder, levels deep."""
+    top = node = {"__/files": {}}
+    for _ in range(levels):
+        node["sub"] = {"__/files": {}}
+        node = node["sub"]
+    return {"root": top}
+
+
+def count(walk):
+    """Folders and files seen by a walk."""
+    folders_n = files_n = 0
+    for _, files in walk:
+        folders_n += 1
+        files_n += len(files)
+    return folders_n, files_n
+
+
+def compare(title, data):
+    """Time both walks of a snapshot."""
+    traverser = JsonTraverser(data)
+    start = time.perf_counter()
+    try:
+        expected = count(recursive_walk(data))
+        recursive = "{:8.3f} s".format(time.perf_counter() - start)
+    except RecursionError:
+        expected = None
+        recursive = "RecursionError"
+    start = time.perf_counter()
+    result = count(traverser.walk())
+    duration = time.perf_counter() - start
+    assert expected in (None, result)
+    start = time.perf_counter()
+    for _ in traverser.walk(path=""):
+        pass
+    with_paths = time.perf_counter() - start
+    print("{:<8} {:>9} folders  recursive {:>14}  stack {:8.3f} s  "
+          "with paths {:8.3f} s".format(title, result[0], recursive,
+                                        duration, with_paths))
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--files", type=int, default=5)
+    parser.add_argument("--chain", type=int, default=100000)
+    arguments = parser.parse_args()
+    compare("bushy", make_snapshot(arguments.depth, arguments.fanout,
+                                   arguments.files))
+    compare("wide", make_snapshot(1, arguments.fanout ** arguments.depth,
+                                  arguments.files))
+    compare("deep", chain(arguments.chain))
+
+
+if __name__ == '__main__':
+    main()
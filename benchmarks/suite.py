@@ -0,0 +1,317 @@
+"""Benchmark suite of the hot paths, with the results as json.
+
+Every benchmark runs in its own interpreter on the seeded trees of
+synthetic: scanning a tree on tmpfs (iterate_path, scan_path), and writing,
+loading, walking, totalling and searching a snapshot built in memory
+(save, load, walk, subdir_info, search_recursive), and filling the
+navigator's listbox with a huge folder (update_listbox, skipped without a
+display). Each reports the median wall time of --repeat runs, the files or
+folders handled per second, and the peak RSS of its process after the setup
+and at the end.
+
+compare reads two result files and flags every benchmark which got slower
+or needs more memory by more than the threshold; the exit code is 1 then.
+Results are only comparable for the same parameters.
+
+Usage: python benchmarks/suite.py run [--depth D] [--fanout F] [--files N]
+       [--name-length L | --name-length MIN MAX] [--seed S] [--tree-depth D]
+       [--tree-fanout F] [--tree-files N] [--entries N] [--repeat R]
+       [--only NAME ...] [-o RESULTS.json]
+       python benchmarks/suite.py compare OLD.json NEW.json [--threshold T]"""
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+import contextlib
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import file_search  # noqa: E402
+import folder_structure_backup  # noqa: E402
+from traverser import JsonTraverser  # noqa: E402
+from synthetic import make_tree, make_snapshot, tree_size  # noqa: E402
+from synthetic import random_name, scratch_dir  # noqa: E402
+
+VERSION = 1
+SEARCH = r"q7.*\.dat$"
+
+
+class Skipped(Exception):
+    """The benchmark cannot run here."""
+
+
+def peak_rss():
+    """Peak resident memory of this process in KiB, None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def name_length(parameters):
+    """Name length of the parameters for synthetic, a number or a range."""
+    length = parameters["name_length"]
+    return length[0] if len(length) == 1 else tuple(length)
+
+
+def tree(parameters, tmp):
+    """Make the tree on the disk, return its root and number of files."""
+    root = os.path.join(tmp, "tree")
+    _, files_n = make_tree(root, parameters["tree_depth"],
+                           parameters["tree_fanout"], parameters["tree_files"],
+                           name_length(parameters), parameters["seed"],
+                           max_size=0)
+    return root, files_n
+
+
+def snapshot(parameters):
+    """Snapshot dictionary and its number of folders and files."""
+    data = make_snapshot(parameters["depth"], parameters["fanout"],
+                         parameters["files"], name_length(parameters),
+                         parameters["seed"])
+    return (data,) + tree_size(parameters["depth"], parameters["fanout"],
+                               parameters["files"])
+
+
+def setup_iterate_path(parameters, tmp):
+    """os.walk based scan of a tree."""
+    root, files_n = tree(parameters, tmp)
+    return (lambda: folder_structure_backup.iterate_path(root, "big"),
+            files_n, "files")
+
+
+def setup_scan_path(parameters, tmp):
+    """scandir based scan of a tree."""
+    root, files_n = tree(parameters, tmp)
+    return (lambda: folder_structure_backup.scan_path(root, "big"),
+            files_n, "files")
+
+
+def setup_save(parameters, tmp):
+    """Writing a snapshot as json."""
+    data, _, files_n = snapshot(parameters)
+    target = os.path.join(tmp, "snapshot.json")
+    return (lambda: folder_structure_backup.save(data, target), files_n,
+            "files")
+
+
+def setup_load(parameters, tmp):
+    """Parsing a json snapshot into a JsonTraverser."""
+    data, _, files_n = snapshot(parameters)
+    target = os.path.join(tmp, "snapshot.json")
+    folder_structure_backup.save(data, target)
+    del data
+    return lambda: JsonTraverser(jsonfile=target), files_n, "files"
+
+
+def setup_walk(parameters, _):
+    """Walking all folders of a snapshot."""
+    data, folders_n, _ = snapshot(parameters)
+    traverser = JsonTraverser(data)
+
+    def run():
+        for _ in traverser.walk():
+            pass
+    return run, folders_n, "folders"
+
+
+def setup_subdir_info(parameters, _):
+    """The totals of the root folder, on a new traverser every time."""
+    data, folders_n, _ = snapshot(parameters)
+    return (lambda: JsonTraverser(data).subdir_info("root"), folders_n,
+            "folders")
+
+
+def setup_search_recursive(parameters, _):
+    """Searching the names of a snapshot for a regular expression."""
+    data, folders_n, files_n = snapshot(parameters)
+    traverser = JsonTraverser(data)
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            file_search.search_recursive(traverser, SEARCH)
+    return run, folders_n + files_n, "names"
+
+
+def setup_update_listbox(parameters, _):
+    """Showing a folder of many files in the navigator."""
+    # pylint: disable=import-outside-toplevel
+    try:  # Only here, the other benchmarks run without Tk
+        import tkinter
+        import folder_structure_navigator
+    except ImportError as exc:
+        raise Skipped("no tkinter: {}".format(exc)) from exc
+    try:
+        app = folder_structure_navigator.App()
+    except tkinter.TclError as exc:
+        raise Skipped("no display: {}".format(exc)) from exc
+    rng = random.Random(parameters["seed"])
+    data = {"spool": {"__/files": [
+        random_name(rng, name_length(parameters))
+        for _ in range(parameters["entries"])]}}
+
+    def run():
+        app.traverser = JsonTraverser(data).down("spool")
+        app.update_listbox()
+        app.update_idletasks()
+    return run, parameters["entries"], "files"
+
+
+BENCHMARKS = {
+    "iterate_path": setup_iterate_path,
+    "scan_path": setup_scan_path,
+    "save": setup_save,
+    "load": setup_load,
+    "walk": setup_walk,
+    "subdir_info": setup_subdir_info,
+    "search_recursive": setup_search_recursive,
+    "update_listbox": setup_update_listbox,
+}
+
+
+def run_one(name, parameters):
+    """Result of a benchmark in this interpreter."""
+    with scratch_dir() as tmp:
+        try:
+            run, ops, unit = BENCHMARKS[name](parameters, tmp)
+        except Skipped as exc:
+            return {"skipped": str(exc)}
+        setup_rss = peak_rss()
+        times = []
+        for _ in range(parameters["repeat"]):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+    seconds = statistics.median(times)
+    return {"seconds": seconds, "min_seconds": min(times), "ops": ops,
+            "unit": unit, "ops_per_sec": ops / seconds if seconds else None,
+            "setup_rss_kib": setup_rss, "peak_rss_kib": peak_rss()}
+
+
+def run_all(parameters, names):
+    """Results of the benchmarks, each in a fresh interpreter."""
+    results = {}
+    for name in names:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "one", name,
+             json.dumps(parameters)], check=True, capture_output=True,
+            text=True).stdout
+        results[name] = json.loads(output.splitlines()[-1])
+        result = results[name]
+        if "skipped" in result:
+            print("{:<18} skipped, {}".format(name, result["skipped"]),
+                  file=sys.stderr)
+        else:
+            print("{:<18} {:9.3f} s {:14.0f} {}/s  peak {} KiB".format(
+                name, result["seconds"], result["ops_per_sec"] or 0,
+                result["unit"], result["peak_rss_kib"]), file=sys.stderr)
+    return results
+
+
+def compare(old, new, threshold):
+    """Print old and new results side by side, return the regressions as
+    list of (benchmark, what)."""
+    if old["parameters"] != new["parameters"]:
+        print("Warning: the parameters differ, the results are not "
+              "comparable", file=sys.stderr)
+    regressions = []
+    print("{:<18} {:>10} {:>10} {:>8} {:>12} {:>12} {:>8}".format(
+        "benchmark", "old s", "new s", "time", "old KiB", "new KiB",
+        "memory"))
+    for name, before in old["benchmarks"].items():
+        after = new["benchmarks"].get(name)
+        if after is None or "skipped" in before or "skipped" in after:
+            continue
+        time_change = after["seconds"] / before["seconds"] - 1
+        memory_change = 0.0
+        if before["peak_rss_kib"] and after["peak_rss_kib"]:
+            memory_change = after["peak_rss_kib"] / before["peak_rss_kib"] - 1
+        flags = []
+        if time_change > threshold:
+            flags.append("slower")
+            regressions.append((name, "time"))
+        if memory_change > threshold:
+            flags.append("memory")
+            regressions.append((name, "memory"))
+        print("{:<18} {:10.3f} {:10.3f} {:+7.1%} {:>12} {:>12} {:+7.1%}"
+              "  {}".format(name, before["seconds"], after["seconds"],
+                            time_change, before["peak_rss_kib"],
+                            after["peak_rss_kib"], memory_change,
+                            " ".join(flags)).rstrip())
+    return regressions
+
+
+def main():
+    """Run the suite or compare results."""
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("run", help="Run the benchmarks")
+    command.add_argument("--depth", type=int, default=4,
+                         help="Levels of the snapshot")
+    command.add_argument("--fanout", type=int, default=10,
+                         help="Subfolders per folder of the snapshot")
+    command.add_argument("--files", type=int, default=20,
+                         help="Files per folder of the snapshot")
+    command.add_argument("--name-length", type=int, nargs="+", default=[12],
+                         help="Length of names, or shortest and longest")
+    command.add_argument("--seed", type=int, default=0)
+    command.add_argument("--tree-depth", type=int, default=3,
+                         help="Levels of the tree on the disk")
+    command.add_argument("--tree-fanout", type=int, default=6)
+    command.add_argument("--tree-files", type=int, default=20)
+    command.add_argument("--entries", type=int, default=100000,
+                         help="Files in the folder of update_listbox")
+    command.add_argument("--repeat", type=int, default=3)
+    command.add_argument("--only", nargs="+", choices=list(BENCHMARKS),
+                         default=list(BENCHMARKS))
+    command.add_argument("-o", "--output", help="File for the results, "
+                         "default the standard output")
+    command = commands.add_parser("compare", help="Flag regressions between "
+                                  "two result files")
+    command.add_argument("old")
+    command.add_argument("new")
+    command.add_argument("--threshold", type=float, default=0.1,
+                         help="Allowed increase, 0.1 for 10 %%")
+    command = commands.add_parser("one")  # A benchmark, run by run
+    command.add_argument("name", choices=list(BENCHMARKS))
+    command.add_argument("parameters", type=json.loads)
+    arguments = parser.parse_args()
+    if arguments.command == "one":
+        print(json.dumps(run_one(arguments.name, arguments.parameters)))
+    elif arguments.command == "compare":
+        with open(arguments.old) as file:
+            old = json.load(file)
+        with open(arguments.new) as file:
+            new = json.load(file)
+        regressions = compare(old, new, arguments.threshold)
+        sys.exit(1 if regressions else 0)
+    else:
+        if len(arguments.name_length) > 2:
+            parser.error("--name-length takes a length or a range")
+        parameters = {key: value for key, value in vars(arguments).items()
+                      if key not in ("command", "only", "output")}
+        results = {"suite": VERSION, "python": platform.python_version(),
+                   "platform": platform.platform(),
+                   "parameters": parameters,
+                   "benchmarks": run_all(parameters, arguments.only)}
+        if arguments.output:
+            with open(arguments.output, "w") as file:
+                json.dump(results, file, indent=1)
+        else:
+            print(json.dumps(results, indent=1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Deterministic synthetic directory trees for the benchmarks.
+
+The same seed and shape give the same tree, on the disk with make_tree or
+as snapshot dictionary with make_snapshot. Name lengths are a number, or a
+(shortest, longest) range to draw every length from."""
+
+import os
+import random
+import string
+import tempfile
+
+
+def scratch_dir():
+    """Temporary directory, on tmpfs if available."""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    return tempfile.TemporaryDirectory(prefix="fsb-bench-", dir=base)
+
+
+def random_name(rng, length):
+    """Random file name of the given length, or of a length in the range
+    (shortest, longest)."""
+    if not isinstance(length, int):
+        length = rng.randint(*length)
+    return "".join(rng.choice(string.ascii_lowercase + string.digits)
+                   for _ in range(length))
+
+
+def tree_size(depth=3, fanout=6, files=20):
+    """(folders, files) of a tree of make_tree or make_snapshot, without
+    making it."""
+    folders_n = sum(fanout ** level for level in range(depth + 1))
+    return folders_n, folders_n * files
+
+
+def make_tree(root, depth=3, fanout=6, files=20, name_length=12, seed=0,
+              max_size=4096):
+    """Create a tree of folders and files below root.
+
+    Every folder up to depth has fanout subfolders and the given amount of
+    files, filled with up to max_size bytes each. Returns (folders, files)
+    created."""
+    rng = random.Random(seed)
+    folders_n = files_n = 0
+    stack = [(root, 0)]
+    while stack:
+        path, level = stack.pop()
+        os.makedirs(path, exist_ok=True)
+        folders_n += 1
+        for _ in range(files):
+            name = random_name(rng, name_length) + ".dat"
+            with open(os.path.join(path, name), "wb") as file:
+                file.write(b"x" * rng.randrange(max_size + 1))
+            files_n += 1
+        if level < depth:
+            for index in range(fanout):
+                name = "{}_{}".format(random_name(rng, name_length), index)
+                stack.append((os.path.join(path, name), level + 1))
+    return folders_n, files_n
+
+
+def make_snapshot(depth=3, fanout=6, files=20, name_length=12, seed=0,
+                  big=True):
+    """Snapshot dictionary as folder_structure_backup writes it, built in
+    memory without touching the disk. The shape is the one of make_tree.
+
+    To keep huge snapshots affordable, files share their detail dicts from
+    a small pool of random ones."""
+    rng = random.Random(seed)
+    details = [{"size": rng.randrange(1 << 30),
+                "modified": 1.5e9 + rng.random() * 2e8,
+                "created": 1.5e9 + rng.random() * 2e8,
+                "accessed": 1.5e9 + rng.random() * 2e8}
+               for _ in range(1024)]
+    root = {}
+    stack = [(root, 0)]
+    while stack:
+        node, level = stack.pop()
+        names = [random_name(rng, name_length) + ".dat" for _ in range(files)]
+        if big:
+            node["__/files"] = {name: rng.choice(details) for name in names}
+        else:
+            node["__/files"] = names
+        if level < depth:
+            for index in range(fanout):
+                name = "{}_{}".format(random_name(rng, name_length), index)
+                node[name] = {}
+                stack.append((node[name], level + 1))
+    return {"root": root}
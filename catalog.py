@@ -0,0 +1,431 @@
+"""Catalog of many snapshots in one SQLite database.
+
+Finding out which drive or which night had a file means loading snapshot
+after snapshot. The catalog imports them once, after that searches run on
+the database without parsing any json. Every folder is a row with its full
+path, so the folders below a path are a range of the path index; files
+refer to their folder and are indexed by name, extension, size and
+modification time. Names are compared case insensitively, like the search:
+LIKE, which only folds ASCII letters, just narrows down the rows for the
+same regular expressions query.Query uses, and extensions are those of
+query.extension.
+
+Rows are inserted in batches with executemany, all of a snapshot in one
+transaction. The first import runs without indexes, they are built at its
+end; later imports keep them up to date. An import of a snapshot file
+replaces the earlier one, unchanged files are skipped.
+
+Usage: python catalog.py CATALOG import SNAPSHOT [SNAPSHOT ...] [--force]
+       python catalog.py CATALOG list
+       python catalog.py CATALOG remove SNAPSHOT [SNAPSHOT ...]
+       python catalog.py CATALOG search REGEX
+       python catalog.py CATALOG query QUERY    (see the query module)"""
+
+import os
+import re
+import time
+import sqlite3
+import argparse
+import functools
+import itertools
+import collections.abc
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse  # pylint: disable=deprecated-module
+
+import query
+import file_table
+import search_index
+from traverser import open_traverser, sizeof_fmt
+
+BATCH = 10000  # Rows per executemany
+MAGIC = b"SQLite format 3\x00"
+VERSION = 1  # Of the rows, in PRAGMA user_version
+# re.IGNORECASE also matches İ and ı for i, the Kelvin sign for k and ſ for
+# s, which LIKE does not fold; neither does it fold other non-ASCII letters
+NOT_LIKE = re.compile(r"[^\x00-\x7f]|[IKSiks]")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY, filename TEXT UNIQUE, file_size INTEGER,
+    file_modified REAL, imported REAL, first_folder INTEGER,
+    last_folder INTEGER, files INTEGER, size INTEGER);
+CREATE TABLE IF NOT EXISTS folders (
+    id INTEGER PRIMARY KEY, snapshot INTEGER, parent INTEGER,
+    name TEXT COLLATE NOCASE, path TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    folder INTEGER, name TEXT COLLATE NOCASE, ext TEXT, size INTEGER,
+    modified REAL, hash TEXT);
+"""
+INDEXES = """
+CREATE INDEX IF NOT EXISTS folders_path ON folders (path);
+CREATE INDEX IF NOT EXISTS folders_name ON folders (name);
+CREATE INDEX IF NOT EXISTS folders_parent ON folders (parent);
+CREATE INDEX IF NOT EXISTS files_folder ON files (folder);
+CREATE INDEX IF NOT EXISTS files_name ON files (name);
+CREATE INDEX IF NOT EXISTS files_ext ON files (ext);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+CREATE INDEX IF NOT EXISTS files_modified ON files (modified);
+"""
+COLUMNS = {0: "f.size", 1: "f.modified"}  # Query fields in the catalog
+OPERATORS = {function: operator
+             for operator, function in query.COMPARISONS.items()}
+FILE_ROWS = ("SELECT s.filename, fo.path, f.name, f.size FROM files f "
+             "JOIN folders fo ON fo.id = f.folder "
+             "JOIN snapshots s ON s.id = fo.snapshot")
+FOLDER_ROWS = ("SELECT s.filename, fo.path FROM folders fo "
+               "JOIN snapshots s ON s.id = fo.snapshot")
+
+
+def is_catalog(filename):
+    """Is the file a SQLite database?"""
+    try:
+        with open(filename, "rb") as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+@functools.lru_cache(maxsize=64)
+def _compiled(pattern):
+    """Compiled regular expression, case insensitive."""
+    return re.compile(pattern, re.IGNORECASE)
+
+
+def _regexp(pattern, value):
+    """The REGEXP operator of SQLite: does value contain a match?"""
+    return value is not None and _compiled(pattern).search(value) is not None
+
+
+def _ends_with(name, suffix):
+    """Does the lower case name end with suffix, like query.Query does for
+    ext:?"""
+    return name is not None and name.lower().endswith(suffix)
+
+
+def _like_escape(text):
+    """Text as literal in a LIKE pattern with ESCAPE '\\'."""
+    return re.sub(r"([\\%_])", r"\\\1", text)
+
+
+def anchored_prefix(expression):
+    """Plain ASCII text every match of a pattern like ^name starts with, ""
+    if there is none. Only a pattern starting with ^ and literal characters
+    has one; alternatives (|) anywhere at the top level drop it. It ends
+    before the first character LIKE does not fold like the pattern."""
+    items = list(sre_parse.parse(expression))
+    if any(operation is sre_parse.BRANCH for operation, _ in items):
+        return ""
+    if not items or items[0] not in ((sre_parse.AT, sre_parse.AT_BEGINNING),
+                                     (sre_parse.AT,
+                                      sre_parse.AT_BEGINNING_STRING)):
+        return ""
+    prefix = []
+    for operation, argument in items[1:]:
+        # A repeated character is a repeat, not a literal, here
+        if (operation is not sre_parse.LITERAL or
+                NOT_LIKE.match(chr(argument)) or chr(argument) in "%_\\"):
+            break
+        prefix.append(chr(argument))
+    return "".join(prefix)
+
+
+def file_rows(folder, files):
+    """Rows of the files table for the files of a folder."""
+    if isinstance(files, file_table.FileTable):
+        hashes = files.hashes or itertools.repeat(None)
+        for name, size, modified, digest in zip(
+                files.names, files.sizes, files.modified, hashes):
+            yield (folder, name, query.extension(name), size, modified,
+                   digest)
+    elif isinstance(files, collections.abc.Mapping):
+        for name, details in files.items():
+            yield (folder, name, query.extension(name), details.get("size"),
+                   details.get("modified"), details.get("hash"))
+    else:  # Fast mode, names only
+        for name in files:
+            yield folder, name, query.extension(name), None, None, None
+
+
+class Catalog():
+    """SQLite catalog of snapshots, see the module documentation."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.create_function("regexp", 2, _regexp,
+                                        deterministic=True)
+        self.connection.create_function("ends_with", 2, _ends_with,
+                                        deterministic=True)
+        self.connection.create_function("extension", 1, query.extension,
+                                        deterministic=True)
+        self.connection.executescript(SCHEMA)
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version < VERSION:  # Dotfiles had no extension before 1
+            with self.connection:
+                self.connection.execute("UPDATE files SET ext = "
+                                        "extension(name) WHERE name LIKE '.%'")
+                self.connection.execute(
+                    "PRAGMA user_version = {:d}".format(VERSION))
+
+    def close(self):
+        """Close the database."""
+        self.connection.close()
+
+    def snapshots(self):
+        """(filename, imported, files, size) of every snapshot."""
+        return self.connection.execute(
+            "SELECT filename, imported, files, size FROM snapshots "
+            "ORDER BY filename").fetchall()
+
+    def is_current(self, filename):
+        """Is the snapshot file imported and unchanged since?"""
+        stat = os.stat(filename)
+        row = self.connection.execute(
+            "SELECT file_size, file_modified FROM snapshots "
+            "WHERE filename = ?", (os.path.abspath(filename),)).fetchone()
+        return row == (stat.st_size, stat.st_mtime)
+
+    def remove(self, filename):
+        """Remove an imported snapshot file, False if it was not there."""
+        with self.connection:
+            return self._remove(os.path.abspath(filename))
+
+    def _remove(self, filename):
+        """Remove a snapshot inside a transaction."""
+        row = self.connection.execute(
+            "SELECT id, first_folder, last_folder FROM snapshots "
+            "WHERE filename = ?", (filename,)).fetchone()
+        if row is None:
+            return False
+        snapshot, first, last = row
+        self.connection.execute(
+            "DELETE FROM files WHERE folder BETWEEN ? AND ?", (first, last))
+        self.connection.execute(
+            "DELETE FROM folders WHERE id BETWEEN ? AND ?", (first, last))
+        self.connection.execute("DELETE FROM snapshots WHERE id = ?",
+                                (snapshot,))
+        return True
+
+    def import_snapshot(self, filename, batch=BATCH):
+        """Add a snapshot file, json or binary, replacing an earlier import
+        of it. Returns the number of files."""
+        stat = os.stat(filename)
+        filename = os.path.abspath(filename)
+        traverser = open_traverser(filename)
+        connection = self.connection
+        connection.execute("PRAGMA cache_size = -262144")  # 256 MiB
+        indexed = connection.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'index' AND "
+            "name = 'files_name'").fetchone()[0]
+        with connection:
+            self._remove(filename)
+            snapshot = connection.execute(
+                "INSERT INTO snapshots (filename, file_size, file_modified, "
+                "imported) VALUES (?, ?, ?, ?)",
+                (filename, stat.st_size, stat.st_mtime, time.time())
+            ).lastrowid
+            first = next_id = connection.execute(
+                "SELECT coalesce(max(id), 0) + 1 FROM folders").fetchone()[0]
+            pending = {}  # Path of a folder not walked yet: its id
+            folders = []
+            files = []
+            files_n = size = 0
+            for path, subfolders, contents in traverser.walk(path=""):
+                folder = pending.pop(path, None)
+                for name in subfolders:
+                    child = os.path.join(path, name)
+                    pending[child] = next_id
+                    folders.append((next_id, snapshot, folder, name, child))
+                    next_id += 1
+                if folder is not None:
+                    files_n += len(contents)
+                    size += file_table.total_size(contents)
+                    files.extend(file_rows(folder, contents))
+                if len(files) >= batch or len(folders) >= batch:
+                    self._insert(folders, files)
+            self._insert(folders, files)
+            connection.execute(
+                "UPDATE snapshots SET first_folder = ?, last_folder = ?, "
+                "files = ?, size = ? WHERE id = ?",
+                (first, next_id - 1, files_n, size, snapshot))
+        if not indexed:
+            connection.executescript(INDEXES)
+        return files_n
+
+    def _insert(self, folders, files):
+        """Insert and clear batches of rows."""
+        self.connection.executemany(
+            "INSERT INTO folders VALUES (?, ?, ?, ?, ?)", folders)
+        self.connection.executemany(
+            "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)", files)
+        folders.clear()
+        files.clear()
+
+    @staticmethod
+    def _name_terms(expressions, column):
+        """SQL conditions and parameters for regular expressions on names.
+        Literal parts every match contains are looked for with LIKE first,
+        which is much faster than calling back into Python; a literal start
+        of the name uses the index. Only the parts LIKE folds the way the
+        expression does are used."""
+        conditions = []
+        parameters = []
+        for expression in expressions:
+            prefix = anchored_prefix(expression)
+            if prefix:
+                conditions.append("{} LIKE ?".format(column))
+                parameters.append(prefix + "%")
+            for literal in search_index.required_literals(expression):
+                for part in NOT_LIKE.split(literal):
+                    if part:
+                        conditions.append("{} LIKE ? ESCAPE '\\'".format(
+                            column))
+                        parameters.append("%" + _like_escape(part) + "%")
+            conditions.append("{} REGEXP ?".format(column))
+            parameters.append(expression)
+        return conditions, parameters
+
+    def _under(self, parts, inclusive=True):
+        """SQL condition and parameters for folders below a path, or at it
+        if inclusive, below every root folder like in query.Query."""
+        if not parts:
+            return [], []
+        conditions = []
+        parameters = []
+        for (root,) in self.connection.execute(
+                "SELECT DISTINCT name FROM folders WHERE parent IS NULL"):
+            path = os.path.join(root, *parts)
+            prefix = os.path.join(path, "")
+            # Everything starting with prefix sorts before prefix with its
+            # last character incremented
+            end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            if inclusive:
+                conditions.append("fo.path = ?")
+                parameters.append(path)
+            conditions.append("(fo.path >= ? AND fo.path < ?)")
+            parameters.extend((prefix, end))
+        return (["(" + " OR ".join(conditions or ["0"]) + ")"],
+                parameters)
+
+    def search(self, searchstring, files=True, folders=True):
+        """Yield (snapshot file, path) of every file and folder whose name
+        matches the regular expression."""
+        conditions, parameters = self._name_terms([searchstring], "f.name")
+        if files:
+            for filename, path, name, _ in self.connection.execute(
+                    FILE_ROWS + " WHERE " + " AND ".join(conditions),
+                    parameters):
+                yield filename, os.path.join(path, name)
+        conditions, parameters = self._name_terms([searchstring], "fo.name")
+        if folders:
+            yield from self.connection.execute(
+                FOLDER_ROWS + " WHERE " + " AND ".join(conditions),
+                parameters)
+
+    def query(self, text):
+        """Yield (snapshot file, path, size) of the matches of a query (see
+        query.Query) in all snapshots; size is None for folders. Only size
+        and modification time are in the catalog."""
+        compiled = query.Query(text)
+        under, under_parameters = self._under(compiled.under)
+        if compiled.files:
+            conditions, parameters = self._name_terms(compiled.expressions,
+                                                      "f.name")
+            for field, compare, value in compiled.comparisons:
+                if field not in COLUMNS:
+                    raise query.QueryError("The catalog has no {} "
+                                           "times".format(query.FIELDS[field]))
+                conditions.append("{} {} ?".format(COLUMNS[field],
+                                                   OPERATORS[compare]))
+                parameters.append(value)
+            if compiled.extensions is not None:
+                simple = [ext for ext in compiled.extensions
+                          if ext.count(".") == 1]
+                other = [ext for ext in compiled.extensions
+                         if ext.count(".") != 1]
+                alternatives = []
+                if simple:
+                    alternatives.append("f.ext IN ({})".format(
+                        ", ".join("?" * len(simple))))
+                    parameters.extend(simple)
+                for ext in other:
+                    alternatives.append("ends_with(f.name, ?)")
+                    parameters.append(ext)
+                conditions.append("(" + " OR ".join(alternatives) + ")")
+            sql = FILE_ROWS + " WHERE " + " AND ".join(
+                conditions + under or ["1"])
+            if compiled.top is not None:
+                sql += " ORDER BY f.size DESC LIMIT {:d}".format(compiled.top)
+            for filename, path, name, size in self.connection.execute(
+                    sql, parameters + under_parameters):
+                yield filename, os.path.join(path, name), size
+        if compiled.folders:
+            conditions, parameters = self._name_terms(compiled.expressions,
+                                                      "fo.name")
+            under, under_parameters = self._under(compiled.under, False)
+            for filename, path in self.connection.execute(
+                    FOLDER_ROWS + " WHERE " + " AND ".join(
+                        conditions + under or ["1"]),
+                    parameters + under_parameters):
+                yield filename, path, None
+
+
+def main():
+    """Import snapshots into a catalog or search it."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("catalog", help="SQLite database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("import", help="Add or update snapshots")
+    command.add_argument("snapshots", nargs="+")
+    command.add_argument("--force", action="store_true",
+                         help="Import files again even if they did not "
+                         "change")
+    commands.add_parser("list", help="Show the imported snapshots")
+    command = commands.add_parser("remove", help="Remove snapshots")
+    command.add_argument("snapshots", nargs="+")
+    command = commands.add_parser("search", help="Find names by regular "
+                                  "expression")
+    command.add_argument("text")
+    command = commands.add_parser("query", help="Find files by query, like "
+                                  "'size>1GiB ext:iso'")
+    command.add_argument("text")
+    arguments = parser.parse_args()
+    catalog = Catalog(arguments.catalog)
+    try:
+        if arguments.command == "import":
+            for filename in arguments.snapshots:
+                if not arguments.force and catalog.is_current(filename):
+                    print("{}: unchanged".format(filename))
+                    continue
+                start = time.perf_counter()
+                files_n = catalog.import_snapshot(filename)
+                print("{}: {} files in {:.1f} s".format(
+                    filename, files_n, time.perf_counter() - start))
+        elif arguments.command == "list":
+            for filename, imported, files_n, size in catalog.snapshots():
+                print("{}  {:>10} files {:>10}  imported {}".format(
+                    filename, files_n, sizeof_fmt(size or 0),
+                    time.strftime("%Y-%m-%d %H:%M", time.localtime(imported))))
+        elif arguments.command == "remove":
+            for filename in arguments.snapshots:
+                if not catalog.remove(filename):
+                    print("{}: not in the catalog".format(filename))
+        elif arguments.command == "search":
+            for filename, path in catalog.search(arguments.text):
+                print("{}: {}".format(filename, path))
+        else:
+            try:
+                for filename, path, size in catalog.query(arguments.text):
+                    print("{}: {}".format(filename, path) if size is None
+                          else "{:>10}  {}: {}".format(sizeof_fmt(size),
+                                                       filename, path))
+            except query.QueryError as exc:
+                parser.error(str(exc))
+    finally:
+        catalog.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Compressed json snapshots.
+
+Snapshots compress very well, the same keys repeat for every file. Files
+are written with the codec given, or the one their extension names, and
+read with the codec their first bytes show, so every reader takes plain and
+compressed files alike. Compression happens while the file is written."""
+
+import io
+import bz2
+import gzip
+import lzma
+
+# Codec name: module, extension, magic bytes at the start of the file
+CODECS = {
+    "gzip": (gzip, ".gz", b"\x1f\x8b"),
+    "bz2": (bz2, ".bz2", b"BZh"),
+    "xz": (lzma, ".xz", b"\xfd7zXZ\x00"),
+}
+
+
+def codec_of_name(filename):
+    """Codec named by the extension of filename, or None."""
+    for codec, (_, extension, _) in CODECS.items():
+        if filename.endswith(extension):
+            return codec
+    return None
+
+
+def codec_of_file(filename):
+    """Codec the file is compressed with, or None."""
+    with open(filename, "rb") as file:
+        start = file.read(6)
+    for codec, (_, _, magic) in CODECS.items():
+        if start.startswith(magic):
+            return codec
+    return None
+
+
+def open_snapshot(filename, mode="r", codec=None):
+    """Open a json snapshot as text. Writing, the codec defaults to the one
+    of the file name; reading, it is detected."""
+    if codec is None:
+        if "r" in mode:
+            codec = codec_of_file(filename)
+        else:
+            codec = codec_of_name(filename)
+    if codec is None:
+        return open(filename, mode)
+    if codec not in CODECS:
+        raise ValueError("Unknown compression {}".format(codec))
+    if codec == "gzip" and "r" not in mode:
+        # Without a time stamp in the header, the same snapshot is the same
+        # file, also after a resumed scan
+        return io.TextIOWrapper(gzip.GzipFile(filename, mode + "b",
+                                              compresslevel=6, mtime=0))
+    return CODECS[codec][0].open(filename, mode + "t")
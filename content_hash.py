@@ -0,0 +1,164 @@
+"""Content hashes of files, for verifying copies and finding duplicates.
+
+Files are read in chunks on a small pool of reader threads. The pool is
+bounded on purpose: a few readers keep an SSD or a network share busy,
+while a failing disk is not made worse by many concurrent reads. Given an
+io_scheduler.IOScheduler, every open and every chunk waits for its turn
+and is retried like the other accesses of the scanner, and the files of a
+folder are read in the order of their inodes. Hashes are BLAKE2b digests
+of DIGEST_SIZE bytes, written as hex."""
+
+import os
+import time
+import hashlib
+import collections
+import concurrent.futures
+
+import file_table
+
+DIGEST_SIZE = 16
+CHUNK_SIZE = 1 << 20
+
+
+def _call(function, *args):
+    """Call a function right away, without an io_scheduler.IOScheduler."""
+    return function(*args)
+
+
+def _read_chunk(file, buffer, offset):
+    """Read the chunk at offset into buffer, return its length. Seeking
+    first lets a retry read the same chunk again."""
+    file.seek(offset)
+    return file.readinto(buffer)
+
+
+def hash_file(path, chunk_size=CHUNK_SIZE, scheduler=None):
+    """Hex digest of a file and the number of bytes read. The digest is None
+    if the file cannot be read. Every access goes through the scheduler if
+    one is given."""
+    call = _call if scheduler is None else scheduler.call
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    read = 0
+    try:
+        with call(open, path, "rb", 0) as file:
+            while True:
+                length = call(_read_chunk, file, buffer, read)
+                if not length:
+                    break
+                digest.update(view[:length])
+                read += length
+    except OSError:
+        return None, read
+    return digest.hexdigest(), read
+
+
+def unchanged(details, size, modified):
+    """Hash of the previous details of a file, if size and modification
+    time did not change since."""
+    if (isinstance(details, dict) and details.get("size") == size and
+            details.get("modified") == modified):
+        return details.get("hash")
+    return None
+
+
+class Hasher():
+    """Hash the files of FileTables on a pool of reader threads.
+
+    At most a few hundred files per reader are waiting at a time, so that
+    hashing millions of files does not hold millions of futures. Reads go
+    through the scheduler if one is given. counts has the numbers of
+    "hashed", "reused" and "failed" files and the "bytes" read."""
+    def __init__(self, readers=2, chunk_size=CHUNK_SIZE, scheduler=None):
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=readers)
+        self.chunk_size = chunk_size
+        self.scheduler = scheduler
+        self.limit = readers * 256
+        self.pending = collections.deque()
+        self.counts = collections.Counter()
+        self.elapsed = 0.0
+        self._started = None
+
+    def add(self, folder_path, files, rows=None, previous=None, errors=None):
+        """Hash the given rows (default: all) of the FileTable of the folder
+        at folder_path. Hashes of the previous snapshot's files of the
+        folder are reused where size and modification time are the same.
+        Files named in errors could not be read while scanning and are not
+        read again."""
+        if self._started is None:
+            self._started = time.perf_counter()
+        if rows is None:
+            rows = range(len(files))
+        if errors:
+            rows = [row for row in rows if files.names[row] not in errors]
+        if self.scheduler is not None and self.scheduler.order:
+            inodes = self.scheduler.inodes(folder_path)
+            rows = sorted(rows, key=lambda row: inodes.get(files.names[row],
+                                                           0))
+        for row in rows:
+            name = files.names[row]
+            if previous:
+                digest = unchanged(previous.get(name), files.sizes[row],
+                                   files.modified[row])
+                if digest is not None:
+                    files.set_hash(row, digest)
+                    self.counts["reused"] += 1
+                    continue
+            future = self.pool.submit(hash_file, os.path.join(
+                folder_path, name), self.chunk_size, self.scheduler)
+            self.pending.append((files, row, future))
+            if len(self.pending) > self.limit:
+                self._complete()
+
+    def _complete(self):
+        """Wait for the oldest file and store its hash."""
+        files, row, future = self.pending.popleft()
+        digest, read = future.result()
+        self.counts["bytes"] += read
+        if digest is None:
+            self.counts["failed"] += 1
+        else:
+            self.counts["hashed"] += 1
+            files.set_hash(row, digest)
+
+    def wait(self):
+        """Wait until all files added so far are hashed."""
+        while self.pending:
+            self._complete()
+        if self._started is not None:
+            self.elapsed += time.perf_counter() - self._started
+            self._started = None
+
+    def close(self):
+        """Wait for the hashes and stop the readers."""
+        self.wait()
+        self.pool.shutdown()
+
+    def throughput(self):
+        """Megabytes read per second."""
+        if not self.elapsed:
+            return 0.0
+        return self.counts["bytes"] / self.elapsed / 1e6
+
+    def summary(self):
+        """One line about what was hashed."""
+        return ("Hashed {} files, {:.1f} MB at {:.1f} MB/s, reused {}, "
+                "failed {}".format(self.counts["hashed"],
+                                   self.counts["bytes"] / 1e6,
+                                   self.throughput(), self.counts["reused"],
+                                   self.counts["failed"]))
+
+
+def as_table(node):
+    """FileTable of a folder of big mode, converted in place if the files
+    are a dictionary; None if they cannot be."""
+    files = node.get("__/files")
+    if isinstance(files, file_table.FileTable):
+        return files
+    if isinstance(files, dict):
+        table = file_table.FileTable.from_dict(files)
+        if table is not None:
+            node["__/files"] = table
+        return table
+    return None
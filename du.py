@@ -0,0 +1,97 @@
+"""Disk usage of a snapshot, like du.
+
+The size and count of every folder, with everything below it, is computed
+in one pass over the snapshot (binary snapshots have them stored already).
+Shows the subfolders of a folder largest first, or the largest folders at
+any depth. In the interactive mode, folders can be entered and left without
+computing anything again.
+
+Usage: python du.py SNAPSHOT [PATH] [--top K] [--interactive]"""
+
+import os
+import re
+import argparse
+
+from traverser import open_traverser, sizeof_fmt, OutOfStructureException
+
+
+def line(size, folders_n, files_n, path):
+    """One row of the report."""
+    return "{:>10} {:>8} folders {:>9} files  {}".format(
+        sizeof_fmt(size), folders_n, files_n, path)
+
+
+def print_children(traverser):
+    """The current folder and its subfolders, largest first."""
+    folders_n, files_n, size = traverser.totals(traverser.current)
+    print(line(size, folders_n, files_n, traverser.current_path() or "."))
+    for name, (folders_n, files_n, size) in traverser.folders_by_size():
+        print(line(size, folders_n, files_n, "  " + name))
+
+
+def print_largest(traverser, count):
+    """The largest folders at any depth below the current one."""
+    for size, folders_n, files_n, path in traverser.largest_folders(count):
+        print(line(size, folders_n, files_n, os.path.join(*path)))
+
+
+def enter(traverser, path):
+    """Go to a path below the current folder, parts separated by / or \\."""
+    for part in re.split(r"[\\/]", path):
+        if part == "..":
+            traverser.up()
+        elif part:
+            traverser.down(part)
+
+
+def interactive(traverser, count):
+    """Walk around, showing the subfolders of every folder."""
+    print("Enter a folder, .. to go up, 'top' for the largest folders "
+          "below, nothing to quit")
+    try:
+        while True:
+            print_children(traverser)
+            command = input("> ").strip()
+            if not command:
+                return
+            if command == "top":
+                print_largest(traverser, count)
+                continue
+            try:
+                enter(traverser, command)
+            except OutOfStructureException:
+                print("No such folder: {}".format(command))
+    except (KeyboardInterrupt, EOFError):
+        print()
+
+
+def main():
+    """Print the disk usage of a snapshot file."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", help="Snapshot file of big mode, json or "
+                        "binary")
+    parser.add_argument("path", nargs="?", default="",
+                        help="Folder below the root folder of the snapshot")
+    parser.add_argument("-t", "--top", type=int, metavar="K",
+                        help="Show the K largest folders at any depth")
+    parser.add_argument("-i", "--interactive", action="store_true",
+                        help="Enter folders one after the other")
+    arguments = parser.parse_args()
+    traverser = open_traverser(arguments.file)
+    roots = traverser.folders()
+    if len(roots) == 1:  # Paths start below the root folder
+        traverser.down(roots[0])
+    try:
+        enter(traverser, arguments.path)
+    except OutOfStructureException:
+        parser.error("No such folder: {}".format(arguments.path))
+    if arguments.interactive:
+        interactive(traverser, arguments.top or 20)
+    elif arguments.top:
+        print_largest(traverser, arguments.top)
+    else:
+        print_children(traverser)
+
+
+if __name__ == '__main__':
+    main()
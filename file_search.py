@@ -1,13 +1,23 @@
 """Search a file by its name.
 
 Calling this module directly will start an interactive search session, the
-json file is read once and subsequent seaches can be made without reloading."""
+json file is read once and subsequent seaches can be made without reloading.
+The interactive session uses a name index (see search_index), which is saved
+next to the snapshot file and reused as long as the snapshot is unchanged.
+With --query, searches are queries by size, date, extension and path instead
+(see query), like: size>1GiB modified<2019 under:projects ext:iso
+Given a catalog database instead of a snapshot (see catalog), every
+snapshot in it is searched at once."""
 
 import re
 import os
 import argparse
 
-from folder_structure_navigator import JsonTraverser
+import query
+import catalog
+import search_index
+import instrumentation
+from traverser import open_traverser, sizeof_fmt
 
 
 def path_format(hierarchy, file):
@@ -18,19 +28,28 @@ def path_format(hierarchy, file):
 
 
 def search_recursive(traverser, searchstring, files=True, folders=True):
-    """Iterate through object and search for searchstring."""
-    if files:
-        for filename in traverser.files():
-            if re.findall(searchstring, filename, re.IGNORECASE):
-                print(path_format(traverser.position, filename))
-    if folders:
-        for filename in traverser.folders():
-            if re.findall(searchstring, filename, re.IGNORECASE):
-                print(path_format(traverser.position, filename))
-    for folder in traverser.folders():
-        traverser.down(folder)
-        search_recursive(traverser, searchstring, files, folders)
-        traverser.up()
+    """Search for searchstring in the names below the current folder."""
+    search = re.compile(searchstring, re.IGNORECASE).search
+    start = os.path.join(*traverser.position) if traverser.position else ""
+    folders_n = names_n = matches = 0
+    with instrumentation.phase("search"):
+        for path, subfolders, filenames in traverser.walk(traverser.current,
+                                                          start):
+            folders_n += 1
+            names_n += len(filenames) + len(subfolders)
+            if files:
+                for filename in filenames:
+                    if search(filename):
+                        matches += 1
+                        print(os.path.join(path, filename))
+            if folders:
+                for filename in subfolders:
+                    if search(filename):
+                        matches += 1
+                        print(os.path.join(path, filename))
+    instrumentation.add("folders searched", folders_n)
+    instrumentation.add("names searched", names_n)
+    instrumentation.add("matches", matches)
 
 
 def search(traverser, searchstring, files=True, folders=True):
@@ -39,28 +58,171 @@ def search(traverser, searchstring, files=True, folders=True):
 
 
 def search_from_file(path, searchstring, files=True, folders=True):
-    """Seach wrapper that reads from file diretly"""
-    traverser = JsonTraverser(path)
+    """Seach wrapper that reads from file diretly. Uses the saved index of
+    the file if there is an up to date one."""
+    index = search_index.SearchIndex.load(search_index.index_filename(path),
+                                          path)
+    if index is not None:
+        search_indexed(index, searchstring, files, folders)
+        return
+    traverser = open_traverser(path)
     search_recursive(traverser, searchstring, files, folders)
 
 
+def search_indexed(index, searchstring, files=True, folders=True):
+    """Search for a string using a search_index.SearchIndex or
+    search_index.ParallelSearch."""
+    matches = 0
+    with instrumentation.phase("search"):
+        for path in index.search(searchstring, files, folders):
+            matches += 1
+            print(path)
+    instrumentation.add("matches", matches)
+
+
+def search_query(traverser, text):
+    """Print the matches of a query, with their size for top: queries."""
+    compiled = query.Query(text)
+    matches = 0
+    with instrumentation.phase("search"):
+        for path, size in compiled.run(traverser):
+            matches += 1
+            if compiled.top is None:
+                print(path)
+            else:
+                print("{:>10}  {}".format(sizeof_fmt(size or 0), path))
+    instrumentation.add("matches", matches)
+
+
+def search_queries(filename, text=None):
+    """Run one query, or ask for queries until interrupted."""
+    traverser = open_traverser(filename)
+    try:
+        while True:
+            if text is None:
+                line = input("Enter query to search\n")
+            else:
+                line = text
+            try:
+                search_query(traverser, line)
+            except query.QueryError as exc:
+                print(exc)
+            if text is not None:
+                return
+            print("--------")
+    except (KeyboardInterrupt, EOFError):
+        print("Goodbye!")
+
+
+def search_catalog(filename, text=None, queries=False):
+    """Search all snapshots of a catalog.Catalog, once or until
+    interrupted. Results are shown with their snapshot file."""
+    database = catalog.Catalog(filename)
+    matches = 0
+    try:
+        while True:
+            if text is None:
+                line = input("Enter {} to search\n".format(
+                    "query" if queries else "regular expression"))
+            else:
+                line = text
+            with instrumentation.phase("search"):
+                try:
+                    if queries:
+                        for snapshot, path, size in database.query(line):
+                            matches += 1
+                            print("{}: {}".format(snapshot, path)
+                                  if size is None else "{:>10}  {}: {}".format(
+                                      sizeof_fmt(size), snapshot, path))
+                    else:
+                        for snapshot, path in database.search(line):
+                            matches += 1
+                            print("{}: {}".format(snapshot, path))
+                except (query.QueryError, re.error) as exc:
+                    print(exc)
+            if text is not None:
+                return
+            print("--------")
+    except (KeyboardInterrupt, EOFError):
+        print("Goodbye!")
+    finally:
+        database.close()
+        instrumentation.add("matches", matches)
+
+
 def main():
     """Interactive searcher. Load file only once, search many times."""
     parser = argparse.ArgumentParser()
-    parser.add_argument("file", help="Source json file")
+    parser.add_argument("file", help="Source snapshot file: json, "
+                        "compressed json or binary, or a catalog database")
     parser.add_argument("-s", "--search", help="Search string to find")
+    parser.add_argument("-l", "--literal", action="store_true",
+                        help="Search for the text as is, not as regular "
+                        "expression")
+    parser.add_argument("--no-index", action="store_true",
+                        help="Do not build or use a name index")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of processes searching the index")
+    parser.add_argument("-q", "--query", action="store_true",
+                        help="Searches are queries like 'size>1GiB ext:iso "
+                        "under:projects', see the query module")
+    instrumentation.add_arguments(parser)
     arguments = parser.parse_args()
+    with instrumentation.instrumented(arguments):
+        run(arguments)
+
+
+def run(arguments):
+    """Search as main was asked to."""
+
+    def prepare(searchstring):
+        """Escape the search string in literal mode."""
+        return re.escape(searchstring) if arguments.literal else searchstring
+
+    def open_searcher():
+        """Index of the file, searched by several processes if wanted."""
+        index = search_index.open_index(arguments.file)
+        if arguments.jobs <= 1:
+            return index
+        if index.filename is None:
+            print("Index could not be saved, searching with one process")
+            return index
+        return search_index.ParallelSearch(index, arguments.jobs)
+    if catalog.is_catalog(arguments.file):
+        text = arguments.search
+        if text is not None and not arguments.query:
+            text = prepare(text)
+        search_catalog(arguments.file, text, arguments.query)
+        return
     print("Loading file...")
+    if arguments.query:
+        search_queries(arguments.file, arguments.search)
+        return
     if arguments.search:
-        search_from_file(arguments.file, arguments.search)
+        if arguments.no_index:
+            search(open_traverser(arguments.file), prepare(arguments.search))
+        elif arguments.jobs > 1:
+            index = open_searcher()
+            search_indexed(index, prepare(arguments.search))
+            if isinstance(index, search_index.ParallelSearch):
+                index.close()
+        else:
+            search_from_file(arguments.file, prepare(arguments.search))
         return
     try:
-        traverser = JsonTraverser(jsonfile=arguments.file)
+        if arguments.no_index:
+            traverser = open_traverser(arguments.file)
+        else:
+            index = open_searcher()
         while True:
-            searchstring = input("Enter regular expression to search\n")
-            search(traverser, searchstring)
+            searchstring = prepare(
+                input("Enter regular expression to search\n"))
+            if arguments.no_index:
+                search(traverser, searchstring)
+            else:
+                search_indexed(index, searchstring)
             print("--------")
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, EOFError):
         print("Goodbye!")
         return
 
@@ -0,0 +1,182 @@
+"""Columnar file details of a folder.
+
+In big mode every file of a snapshot has a dictionary of size and dates.
+In memory, a dictionary per file costs several hundred bytes. A FileTable
+keeps the files of a folder in parallel columns instead: a list of names,
+compact arrays of sizes and times, and content hashes if there are any. It
+is a read only mapping of name to the same dictionaries, built on access,
+so code written for the dictionaries works unchanged. Sums and date ranges
+work on the columns directly, with numpy if it is installed.
+
+Snapshot files do not change, load_json converts their folders while they
+are parsed; folder_structure_backup builds FileTables while scanning."""
+
+import json
+import array
+import collections.abc
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+KEYS = ("size", "modified", "created", "accessed")
+VECTORIZE = 256  # Fewer files are summed faster without numpy
+
+
+class FileTable(collections.abc.Mapping):
+    """Mapping of file name to {"size", "modified", "created", "accessed"},
+    stored as columns. Files may have a "hash" as well (see content_hash),
+    the column of hashes is None until one is added."""
+    __slots__ = ("names", "sizes", "modified", "created", "accessed",
+                 "hashes", "_index")
+
+    def __init__(self):
+        self.names = []
+        self.sizes = array.array("q")
+        self.modified = array.array("d")
+        self.created = array.array("d")
+        self.accessed = array.array("d")
+        self.hashes = None
+        self._index = None
+
+    @classmethod
+    def from_dict(cls, files):
+        """Table of a dictionary of file details, None if a file has other
+        details than the four known ones and a hash."""
+        table = cls()
+        for name, details in files.items():
+            if not table.add(name, details):
+                return None
+        return table
+
+    def add(self, name, details):
+        """Append a file, False if its details do not fit the columns."""
+        if not isinstance(details, dict):
+            return False
+        digest = details.get("hash")
+        if len(details) != len(KEYS) + (digest is not None) or not (
+                digest is None or isinstance(digest, str)):
+            return False
+        try:
+            size, modified, created, accessed = (details[key] for key in KEYS)
+            self.sizes.append(size)
+        except (KeyError, TypeError, OverflowError):
+            return False
+        try:
+            self.modified.append(modified)
+            self.created.append(created)
+            self.accessed.append(accessed)
+        except TypeError:
+            del self.sizes[len(self.names):]
+            del self.modified[len(self.names):]
+            del self.created[len(self.names):]
+            return False
+        if digest is not None and self.hashes is None:
+            self.hashes = [None] * len(self.names)
+        if self.hashes is not None:
+            self.hashes.append(digest)
+        self.names.append(name)
+        self._index = None
+        return True
+
+    def _position(self, name):
+        """Row of a file name; the lookup table is made on first use."""
+        if self._index is None:
+            self._index = {name: row for row, name in enumerate(self.names)}
+        return self._index[name]
+
+    def set_hash(self, row, digest):
+        """Set the content hash of the file in a row."""
+        if self.hashes is None:
+            self.hashes = [None] * len(self.names)
+        self.hashes[row] = digest
+
+    def row(self, row):
+        """Details of the file in a row."""
+        details = {"size": self.sizes[row], "modified": self.modified[row],
+                   "created": self.created[row],
+                   "accessed": self.accessed[row]}
+        if self.hashes is not None and self.hashes[row] is not None:
+            details["hash"] = self.hashes[row]
+        return details
+
+    def __getitem__(self, name):
+        return self.row(self._position(name))
+
+    def __contains__(self, name):
+        try:
+            self._position(name)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def items(self):
+        return [(name, self.row(row)) for row, name in enumerate(self.names)]
+
+    def values(self):
+        return [self.row(row) for row in range(len(self.names))]
+
+    def to_dict(self):
+        """The files as dictionary of details, as written to json."""
+        return dict(self.items())
+
+    def __repr__(self):
+        return "FileTable({!r})".format(self.to_dict())
+
+    def total_size(self):
+        """Sum of all file sizes."""
+        if numpy is not None and len(self.sizes) >= VECTORIZE:
+            return int(numpy.frombuffer(self.sizes, dtype=numpy.int64).sum())
+        return sum(self.sizes)
+
+    def modified_between(self, start, end):
+        """Names of the files modified from start up to before end."""
+        if numpy is not None and len(self.modified) >= VECTORIZE:
+            column = numpy.frombuffer(self.modified, dtype=numpy.float64)
+            rows = numpy.flatnonzero((column >= start) & (column < end))
+            return [self.names[row] for row in rows.tolist()]
+        return [name for name, modified in zip(self.names, self.modified)
+                if start <= modified < end]
+
+
+def total_size(files):
+    """Sum of the sizes of a folder's files, whichever way they are stored.
+    Fast mode lists have no sizes."""
+    if isinstance(files, FileTable):
+        return files.total_size()
+    if isinstance(files, dict):
+        return sum([file.get("size", 0) or 0 for file in files.values()])
+    return 0
+
+
+def to_json(value):
+    """default for json.dump: write FileTables like dictionaries."""
+    if isinstance(value, FileTable):
+        return value.to_dict()
+    raise TypeError("Object of type {} is not JSON serializable".format(
+        type(value).__name__))
+
+
+def columnar(node):
+    """Hook for json: convert the files of a folder once it is parsed."""
+    node = dict(node)
+    files = node.get("__/files")
+    if isinstance(files, dict):
+        table = FileTable.from_dict(files)
+        if table is not None:
+            node["__/files"] = table
+    return node
+
+
+def load_json(file):
+    """Parse a json snapshot, files of big mode become FileTables. This
+    works for every snapshot written so far; folders whose files do not fit
+    the columns keep their dictionary."""
+    return json.load(file, object_pairs_hook=columnar)
@@ -0,0 +1,168 @@
+"""Find duplicate files in one or more snapshots.
+
+Files are grouped by size: a single pass over the snapshots, opened one
+after the other, sorts the files by size, largest first, and files of the
+same size end up next to each other. If the snapshots have content hashes
+(folder_structure_backup --hash), those groups are split by hash as well;
+otherwise files of the same size are only candidates and are reported as
+such. When there are more files than fit into memory, they are sorted in
+runs which are written to temporary files and merged. Nothing is counted
+or kept per size or per file in memory besides that, so any number of
+files can be handled with bounded memory, at the cost of sorting the
+files of unique sizes too.
+
+Usage: python find_duplicates.py SNAPSHOT [SNAPSHOT ...] [--min-size BYTES]
+       [--size-only] [--format text|jsonl] [--memory RECORDS]"""
+
+import os
+import sys
+import json
+import heapq
+import pickle
+import argparse
+import itertools
+import collections
+import collections.abc
+import tempfile
+
+import file_table
+from traverser import open_traverser, sizeof_fmt
+
+BATCH = 4096  # Records pickled at once in a run file
+
+
+def folders(traverser):
+    """Yield (path, files) of every folder of a traverser."""
+    for path, _, files in traverser.walk(traverser.data, ""):
+        yield path, files
+
+
+def file_details(files):
+    """Yield (name, size, hash or "") of the files of a folder."""
+    if isinstance(files, file_table.FileTable):
+        hashes = files.hashes or itertools.repeat(None)
+        for name, size, digest in zip(files.names, files.sizes, hashes):
+            yield name, size, digest or ""
+    elif isinstance(files, collections.abc.Mapping):
+        for name, details in files.items():
+            yield name, details.get("size", 0) or 0, details.get("hash", "")
+    elif files:
+        raise ValueError("Snapshots of fast mode have no file sizes")
+
+
+def records(traversers, min_size=1, use_hashes=True):
+    """Yield (-size, hash, snapshot number, path) of every file from
+    min_size on. Every traverser is walked once, in order."""
+    for number, traverser in enumerate(traversers):
+        for path, files in folders(traverser):
+            for name, size, digest in file_details(files):
+                if size >= min_size:
+                    yield (-size, digest if use_hashes else "", number,
+                           os.path.join(path, name))
+
+
+def _write_run(records, directory):
+    """Sort records into a temporary file, return its name."""
+    records.sort()
+    handle, filename = tempfile.mkstemp(dir=directory, suffix=".run")
+    with os.fdopen(handle, "wb") as file:
+        for start in range(0, len(records), BATCH):
+            pickle.dump(records[start:start + BATCH], file,
+                        pickle.HIGHEST_PROTOCOL)
+    return filename
+
+
+def _read_run(filename):
+    """Yield the records of a run file."""
+    with open(filename, "rb") as file:
+        while True:
+            try:
+                yield from pickle.load(file)
+            except EOFError:
+                return
+
+
+def sorted_records(records, memory=1000000):
+    """Sort records, holding at most memory of them at a time."""
+    chunk = list(itertools.islice(records, memory))
+    if len(chunk) < memory:
+        chunk.sort()
+        yield from chunk
+        return
+    with tempfile.TemporaryDirectory(prefix="duplicates-") as directory:
+        runs = []
+        while chunk:
+            runs.append(_write_run(chunk, directory))
+            chunk = list(itertools.islice(records, memory))
+        yield from heapq.merge(*[_read_run(run) for run in runs])
+
+
+def duplicates(traversers, min_size=1, use_hashes=True, memory=1000000):
+    """Yield groups of possibly equal files, largest files first, as
+    (size, hash, [(snapshot number, path), ...]). Files are grouped by
+    size and, where known, hash; hash is "" for groups of the same size
+    whose content is not known. traversers is iterated once, a generator
+    opening them keeps only one snapshot open at a time."""
+    ordered = sorted_records(records(traversers, min_size, use_hashes),
+                             memory)
+    for (size, digest), group in itertools.groupby(
+            ordered, key=lambda record: record[:2]):
+        files = [(number, path) for _, _, number, path in group]
+        if len(files) > 1:
+            yield -size, digest, files
+
+
+def reclaimable(size, files):
+    """Bytes freed by keeping only one of the files."""
+    return size * (len(files) - 1)
+
+
+def main():
+    """Print the groups of duplicate files of snapshot files."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("snapshots", nargs="+", help="Snapshot files of big "
+                        "mode, json or binary")
+    parser.add_argument("--min-size", type=int, default=1,
+                        help="Ignore smaller files, by default empty ones")
+    parser.add_argument("--size-only", action="store_true",
+                        help="Group by size only, even if there are hashes")
+    parser.add_argument("--format", choices=["text", "jsonl"],
+                        default="text", help="Readable groups or one json "
+                        "object per group")
+    parser.add_argument("--memory", type=int, default=1000000,
+                        help="Files held in memory at most while sorting")
+    arguments = parser.parse_args()
+    traversers = (open_traverser(name) for name in arguments.snapshots)
+    total = collections.Counter()
+    groups = duplicates(traversers, arguments.min_size,
+                        not arguments.size_only, arguments.memory)
+    try:
+        first = next(groups, None)
+    except ValueError as exc:
+        parser.error(str(exc))
+    for size, digest, files in itertools.chain([first] if first else [],
+                                               groups):
+        freed = reclaimable(size, files)
+        total["groups"] += 1
+        total["files"] += len(files)
+        total["bytes"] += freed
+        if arguments.format == "jsonl":
+            print(json.dumps({
+                "size": size, "hash": digest or None, "reclaimable": freed,
+                "files": [{"snapshot": arguments.snapshots[number],
+                           "path": path} for number, path in files]}))
+            continue
+        print("{} files of {}, {} reclaimable ({})".format(
+            len(files), sizeof_fmt(size), sizeof_fmt(freed),
+            "same content" if digest else "same size"))
+        for number, path in files:
+            if len(arguments.snapshots) > 1:
+                path = "{}: {}".format(arguments.snapshots[number], path)
+            print("    " + path)
+    print("{} groups, {} files, {} reclaimable".format(
+        total["groups"], total["files"], sizeof_fmt(total["bytes"])),
+        file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
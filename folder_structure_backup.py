@@ -2,11 +2,24 @@
 
 import os
 import sys
-# import time
+import time
 import json
 # import pprint
 import pathlib
 import argparse
+import collections
+import collections.abc
+import concurrent.futures
+
+import file_table
+import compression
+import content_hash
+import io_scheduler
+import instrumentation
+import scan_journal
+import snapshot_format
+
+CHECKPOINT = 30.0  # Seconds between the checkpoints of a journal
 
 
 def main2():
@@ -38,6 +51,23 @@ def main2():
                 # sys.exit()
 
 
+def file_entry(stats):
+    """Snapshot entry of a file for the given stat result (None: no access)."""
+    if stats is None:
+        return {"size": 0, "modified": 0, "created": 0, "accessed": 0}
+    if stats.st_size < (1024 ** 4) * 10:
+        size = stats.st_size
+    else:
+        # Larger than 10 TB? sure u did.
+        size = 0
+    return {
+        "size": size,
+        "modified": stats.st_mtime,
+        "created": stats.st_mtime,
+        "accessed": stats.st_atime
+    }
+
+
 def iterate_path(target_path, mode):
     """Walk through the given path and return subfolder / file information."""
     path = target_path
@@ -60,51 +90,554 @@ def iterate_path(target_path, mode):
             for file in files:
                 try:
                     stats = os.stat(pathlib.Path(current) / file)
-                    if stats.st_size < (1024 ** 4) * 10:
-                        size = stats.st_size
-                    else:
-                        # Larger than 10 TB? sure u did.
-                        size = 0
-                    cur_level["__/files"][file] = {
-                        "size": size,
-                        "modified": stats.st_mtime,
-                        "created": stats.st_mtime,
-                        "accessed": stats.st_atime
-                    }
+                    cur_level["__/files"][file] = file_entry(stats)
                 except OSError:  # File cannot be accessed
-                    cur_level["__/files"][file] = {
-                        "size": 0,
-                        "modified": 0,
-                        "created": 0,
-                        "accessed": 0
-                    }
+                    cur_level["__/files"][file] = file_entry(None)
     return output
 
 
-def save(dictionary, output_filename):
-    """Write the given dictionary to a file."""
-    with open(output_filename, "w") as file:
-        json.dump(dictionary, file)
+def _call(function, *args):
+    """Call a function right away, without an io_scheduler.IOScheduler."""
+    return function(*args)
+
+
+def scan_directory(path, mode, previous=None, scheduler=None):
+    """Read a single directory, return its folder names and files.
+
+    The decisions are the same os.walk makes: symlinks to folders are not
+    followed and left out, a folder that cannot be read returns its OSError.
+    In big mode the stat result cached on the DirEntry is used, the files
+    are returned as file_table.FileTable, and the modification time of the
+    folder is returned as well. If it equals the one recorded in the
+    previous snapshot of this folder, the folder's entries cannot have
+    changed and are taken from there without reading anything. Files whose
+    details cannot be read, like broken symlinks, are kept with zeros and
+    returned as errors as well, a mapping of name to the error. Given an
+    io_scheduler.IOScheduler, every access waits for its turn and may be
+    retried, and files are read in the order of their inodes. Returns
+    (folders, files, folder modification time, reused, errors); folders maps
+    the folder names to their inode numbers if the scheduler orders by them,
+    else to 0."""
+    call = _call if scheduler is None else scheduler.call
+    modified = None
+    if mode != "fast":
+        try:
+            modified = call(os.stat, path).st_mtime
+        except OSError:
+            pass
+        if (modified is not None and isinstance(previous, dict)
+                and previous.get("__/modified") == modified
+                and isinstance(previous.get("__/files"),
+                               collections.abc.Mapping)
+                and not previous.get("__/errors")):
+            folders = {key: 0 for key in previous if not key.startswith("__/")}
+            return folders, previous["__/files"], modified, True, {}
+    try:
+        entries = call(io_scheduler.read_directory, path)
+    except OSError as exc:  # Folder cannot be read
+        return exc
+    order = scheduler is not None and scheduler.order
+    folders = {}
+    others = []
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir:
+            try:
+                is_symlink = entry.is_symlink()
+            except OSError:
+                is_symlink = False
+            if not is_symlink:
+                folders[entry.name] = io_scheduler.inode(entry) if order else 0
+        else:
+            others.append(entry)
+    if mode == "fast":
+        return folders, [entry.name for entry in others], modified, False, {}
+    stats = {}
+    errors = {}
+    for entry in others if scheduler is None else scheduler.ordered(others):
+        try:
+            stats[entry.name] = call(entry.stat)
+        except OSError as exc:  # File cannot be accessed
+            errors[entry.name] = io_scheduler.describe(exc)
+    files = file_table.FileTable()
+    for entry in others:
+        files.add(entry.name, file_entry(stats.get(entry.name)))
+    return folders, files, modified, False, errors
+
 
+def read_folder(path, mode, previous=None, scheduler=None, journal=None):
+    """scan_directory, unless the folder is in the scan_journal.Journal of
+    an interrupted scan. Folders read are added to the journal, and counted
+    if instrumentation is on."""
+    start = time.perf_counter()
+    result = None
+    if journal is not None:
+        result = journal.take(path)
+    resumed = result is not None
+    if not resumed:
+        result = scan_directory(path, mode, previous, scheduler)
+        if journal is not None:
+            journal.record(path, result)
+    if instrumentation.STATS is not None:
+        count_folder(instrumentation.STATS, result, mode, resumed,
+                     time.perf_counter() - start)
+    return result
 
-def iterate_and_save(target_path, target_filename, mode="big"):
-    """Combine Generation and saving as easier interface."""
-    dictionary = iterate_path(target_path, mode)
-    save(dictionary, target_filename)
+
+def count_folder(stats, result, mode, resumed, seconds):
+    """Count a folder read by read_folder on an instrumentation.Stats. The
+    time is summed over all readers."""
+    stats.add_time("read folders", seconds)
+    stats.add("folders")
+    if mode != "fast" and not resumed:
+        stats.add("stat calls")  # Of the folder
+    if isinstance(result, OSError):
+        stats.add("errors")
+        return
+    _, files, _, reused, errors = result
+    stats.add("files", len(files))
+    stats.add("errors", len(errors))
+    if resumed:
+        stats.add("resumed folders")
+    elif reused:
+        stats.add("reused folders")
+    elif mode != "fast":
+        stats.add("stat calls", len(files))
+
+
+def finish_errors(node, errors):
+    """Set the errors of a folder, after all its other keys and sorted by
+    name, so that they are written the same way however the folder was
+    read."""
+    node.pop("__/errors", None)
+    if errors:
+        node["__/errors"] = dict(sorted(errors.items()))
+
+
+def previous_root(previous, layers):
+    """Find the part of a previous snapshot matching the scanned root."""
+    if not previous:
+        return None
+    for layer in layers:
+        if layer in previous:
+            previous = previous[layer]
+        elif len(previous) == 1:  # Same drive, mounted somewhere else
+            previous = next(iter(previous.values()))
+        else:
+            return None
+    return previous
+
+
+def child_of(previous, name):
+    """Previous snapshot of a subfolder, if there is one."""
+    if isinstance(previous, dict):
+        return previous.get(name)
+    return None
+
+
+def scan_path(target_path, mode, workers=1, previous=None, counts=None,
+              progress=None, scheduler=None, journal=None):
+    """Walk through the given path and return subfolder / file information.
+
+    Produces the same structure as iterate_path, but every folder is read
+    only once with os.scandir. With more than one worker, folders are read
+    concurrently on a thread pool of that size. Given the dictionary of a
+    previous snapshot, unchanged folders are copied forward from it; the
+    number of "reused" and "rescanned" folders is added to counts. Every
+    folder is counted on progress (see progress.Progress), which may stop
+    the scan by raising Cancelled. Files and folders which cannot be read
+    are listed with their error in "__/errors" of their folder; such files
+    stay in "__/files" with zeros, folders are left out. All
+    accesses go through the scheduler if one is given (see scan_directory),
+    folders are then read in the order of their inodes as well. Given a
+    journal, see read_folder."""
+    output = {}
+    root = output
+    layers = pathlib.Path(target_path).parts[-1:]
+    for layer in layers:
+        root = root.setdefault(layer, {})
+    if counts is None:
+        counts = collections.Counter()
+    order = scheduler is not None and scheduler.order
+    failed = {}  # id of a folder: (folder, errors)
+
+    def expand(job, result):
+        """Fill a scanned folder, return the jobs for its subfolders."""
+        parent, name, node, path, before = job
+        if isinstance(result, OSError):
+            if parent is None:
+                raise OSError("Cannot read {}".format(path)) from result
+            del parent[name]
+            failed.setdefault(id(parent), (parent, {}))[1][name] = (
+                io_scheduler.describe(result))
+            return []
+        folders, files, modified, reused, errors = result
+        counts["reused" if reused else "rescanned"] += 1
+        if progress is not None:
+            progress.add_folder(files)
+        node["__/files"] = files
+        if modified is not None:
+            node["__/modified"] = modified
+        if errors:
+            failed.setdefault(id(node), (node, {}))[1].update(errors)
+        jobs = []
+        for folder in folders:
+            child = node[folder] = {}
+            jobs.append((node, folder, child, os.path.join(path, folder),
+                         child_of(before, folder)))
+        if order:  # The smallest inode is taken from the stack first
+            jobs.sort(key=lambda job: folders[job[1]], reverse=True)
+        return jobs
+
+    def scan(job):
+        """Read the folder of a job."""
+        return read_folder(job[3], mode, job[4], scheduler, journal)
+
+    jobs = [(None, None, root, target_path, previous_root(previous, layers))]
+    if workers <= 1:
+        while jobs:
+            job = jobs.pop()
+            jobs.extend(expand(job, scan(job)))
+    else:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers) as pool:
+            pending = {pool.submit(scan, job): job for job in jobs}
+            while pending:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    job = pending.pop(future)
+                    for child in expand(job, future.result()):
+                        pending[pool.submit(scan, child)] = child
+    for node, errors in failed.values():
+        finish_errors(node, errors)
+    return output
+
+
+def previous_files(before):
+    """Files of the previous snapshot of a folder, if there are details."""
+    if isinstance(before, dict):
+        files = before.get("__/files")
+        if isinstance(files, collections.abc.Mapping):
+            return files
+    return None
+
+
+def hash_files(output, target_path, hasher, previous=None, duplicates=False):
+    """Add content hashes to the files of a structure made by scan_path,
+    using a content_hash.Hasher. Hashes of the previous snapshot are reused
+    for files of the same size and modification time. With duplicates, only
+    files whose size occurs more than once are hashed; the others cannot have
+    a copy in the snapshot."""
+    layers = pathlib.Path(target_path).parts[-1:]
+    root = output
+    for layer in layers:
+        root = root[layer]
+    sizes = None
+    if duplicates:
+        sizes = collections.Counter()
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            table = content_hash.as_table(node)
+            if table is not None:
+                sizes.update(table.sizes)
+            stack.extend(value for key, value in node.items()
+                         if not key.startswith("__/"))
+    stack = [(root, target_path, previous_root(previous, layers))]
+    while stack:
+        node, path, before = stack.pop()
+        table = content_hash.as_table(node)
+        if table is not None:
+            rows = None
+            if sizes is not None:
+                rows = [row for row, size in enumerate(table.sizes)
+                        if size and sizes[size] > 1]
+            hasher.add(path, table, rows, previous_files(before),
+                       node.get("__/errors"))
+        stack.extend((value, os.path.join(path, key), child_of(before, key))
+                     for key, value in node.items()
+                     if not key.startswith("__/"))
+    hasher.wait()
+
+
+def stream_path(target_path, file, mode, workers=1, previous=None,
+                counts=None, progress=None, hasher=None, scheduler=None,
+                journal=None):
+    """Walk through the given path and write the structure to file as json.
+
+    Every folder is written as soon as it is read instead of building the
+    whole dictionary first, so memory use is bound by depth and width of the
+    tree, not by the number of files. The output is the same as saving the
+    result of scan_path. With more than one worker, the subfolders of the
+    current folder are read ahead on a thread pool. Given a Hasher, the files
+    of every folder are hashed before it is written. A scheduler orders the
+    files of a folder, but folders are read in the order they are written.
+    Given a journal, see read_folder."""
+    pool = None
+    if workers > 1:
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    if counts is None:
+        counts = collections.Counter()
+    stack = []
+
+    def open_folder(path, result, before):
+        """Write the files of a folder and remember its subfolders."""
+        folders, files, modified, reused, errors = result
+        counts["reused" if reused else "rescanned"] += 1
+        if progress is not None:
+            progress.add_folder(files)
+        if hasher is not None and isinstance(files, dict):
+            files = file_table.FileTable.from_dict(files) or files
+        if hasher is not None and isinstance(files, file_table.FileTable):
+            hasher.add(path, files, previous=previous_files(before),
+                       errors=errors)
+            hasher.wait()
+        file.write('{"__/files": ' + json.dumps(
+            files, default=file_table.to_json))
+        if modified is not None:
+            file.write(', "__/modified": ' + json.dumps(modified))
+        children = []
+        for folder in reversed(folders):
+            child_path = os.path.join(path, folder)
+            child_before = child_of(before, folder)
+            future = None
+            if pool is not None:
+                future = pool.submit(read_folder, child_path, mode,
+                                     child_before, scheduler, journal)
+            children.append((folder, child_path, child_before, future))
+        stack.append((children, dict(errors)))
+
+    def close_folder(errors):
+        """Write the errors of a folder and end it."""
+        if errors:
+            file.write(', "__/errors": ' + json.dumps(
+                dict(sorted(errors.items()))))
+        file.write("}")
+
+    layers = pathlib.Path(target_path).parts[-1:]
+    try:
+        before = previous_root(previous, layers)
+        result = read_folder(target_path, mode, before, scheduler, journal)
+        if isinstance(result, OSError):
+            raise OSError("Cannot read {}".format(target_path)) from result
+        for layer in layers:
+            file.write("{" + json.dumps(layer) + ": ")
+        open_folder(target_path, result, before)
+        while stack:
+            children, errors = stack[-1]
+            if not children:
+                close_folder(errors)
+                stack.pop()
+                continue
+            name, path, before, future = children.pop()
+            if future is None:
+                result = read_folder(path, mode, before, scheduler, journal)
+            else:
+                result = future.result()
+            if isinstance(result, OSError):  # Leave the folder out
+                errors[name] = io_scheduler.describe(result)
+                continue
+            file.write(", " + json.dumps(name) + ": ")
+            open_folder(path, result, before)
+        file.write("}" * len(layers))
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def save(dictionary, output_filename, codec=None):
+    """Write the given dictionary to a file, compressed with codec or the one
+    the extension names (see compression)."""
+    with compression.open_snapshot(output_filename, "w", codec) as file:
+        json.dump(dictionary, file, default=file_table.to_json)
+
+
+def load(input_filename):
+    """Read a dictionary written by save, or a binary snapshot. The files of
+    big mode json snapshots are loaded as file_table.FileTable."""
+    if snapshot_format.is_binary(input_filename):
+        return snapshot_format.read_dict(input_filename)
+    with compression.open_snapshot(input_filename, "r") as file:
+        return file_table.load_json(file)
+
+
+def iterate_and_save(target_path, target_filename, mode="big", workers=1,
+                     stream=False, previous=None, progress=None, codec=None,
+                     hasher=None, hash_duplicates=False, scheduler=None,
+                     journal=None):
+    """Combine Generation and saving as easier interface.
+
+    A target file name ending with ".fsb" is written in the binary format of
+    snapshot_format, which cannot be streamed or compressed. Json is
+    compressed with codec, or the one the extension names. Given a
+    content_hash.Hasher, files are hashed, see hash_files. Accesses go
+    through the io_scheduler.IOScheduler if given. Folders are added to the
+    scan_journal.Journal if given, which is removed once the snapshot is
+    written. Returns how many folders were "reused" from the previous
+    snapshot and how many were "rescanned"."""
+    counts = collections.Counter()
+    binary = target_filename.endswith(".fsb")
+    if stream and binary:
+        raise ValueError("Binary snapshots cannot be streamed")
+    if codec and binary:
+        raise ValueError("Binary snapshots cannot be compressed")
+    if stream and hash_duplicates:
+        raise ValueError("Duplicates are only known after the whole scan")
+    if stream:
+        with instrumentation.phase("scan and write"), \
+                compression.open_snapshot(target_filename, "w",
+                                          codec) as file:
+            stream_path(target_path, file, mode, workers, previous, counts,
+                        progress, hasher, scheduler, journal)
+    else:
+        with instrumentation.phase("scan"):
+            dictionary = scan_path(target_path, mode, workers, previous,
+                                   counts, progress, scheduler, journal)
+        if hasher is not None:
+            with instrumentation.phase("hash"):
+                hash_files(dictionary, target_path, hasher, previous,
+                           hash_duplicates)
+        with instrumentation.phase("write"):
+            if binary:
+                snapshot_format.write_binary(dictionary, target_filename)
+            else:
+                save(dictionary, target_filename, codec)
+    instrumentation.add("bytes written", os.path.getsize(target_filename))
+    if journal is not None:
+        journal.remove()
+    return counts
 
 
 def main():
     """Output neat json"""
     parser = argparse.ArgumentParser()
     parser.add_argument("-p", "--path", help="Path of root", required=True)
-    parser.add_argument("-f", "--file", help="Target file name.", required=True)
+    parser.add_argument("-f", "--file", help="Target file name. Use the "
+                        "extension .fsb for the binary format, .gz, .bz2 or "
+                        ".xz for compressed json.", required=True)
     parser.add_argument("-m", "--mode", help="Generation mode. 'Fast' does "
                         "not include file size e.g. and will result "
                         "in a smaller file", choices=["fast", "big"],
                         default="big")
+    parser.add_argument("-w", "--workers", help="Number of folders read at "
+                        "the same time. Keep this at 1 for failing drives.",
+                        type=int, default=1)
+    parser.add_argument("-s", "--stream", help="Write every folder as soon "
+                        "as it is read. Keeps memory usage low for huge "
+                        "drives.", action="store_true")
+    parser.add_argument("-i", "--incremental", metavar="PREVIOUS",
+                        help="Previous snapshot of the same path. Folders "
+                        "that did not change since are copied from it "
+                        "instead of accessing every file again.")
+    parser.add_argument("-c", "--compress", choices=sorted(
+        compression.CODECS), help="Compress the json file, by default the "
+                        "extension of the file name decides.")
+    parser.add_argument("--hash", nargs="?", const="all",
+                        choices=["all", "duplicates"], help="Save a content "
+                        "hash of every file, or only of the files whose size "
+                        "occurs more than once. Hashes of unchanged files are "
+                        "taken from --incremental.")
+    parser.add_argument("--readers", type=int, default=2, help="Number of "
+                        "files read at the same time for --hash")
+    parser.add_argument("--max-ops", type=float, metavar="RATE",
+                        help="At most this many file system operations per "
+                        "second, to spare a failing drive")
+    parser.add_argument("--retry-budget", type=float, default=10.0,
+                        metavar="SECONDS", help="How long reading a file or "
+                        "folder is retried after errors which may go away")
+    parser.add_argument("--checkpoint", type=float, nargs="?",
+                        const=CHECKPOINT, metavar="SECONDS", help="Save the "
+                        "folders read so far to FILE.journal this often, "
+                        "every {:g} seconds if not given".format(CHECKPOINT))
+    parser.add_argument("--resume", action="store_true", help="Continue an "
+                        "interrupted scan from its journal, checkpointing "
+                        "as well")
+    parser.add_argument("--restart", action="store_true", help="Start over "
+                        "with checkpoints, replacing the journal of an "
+                        "interrupted scan")
+    instrumentation.add_arguments(parser)
     arguments = parser.parse_args()
-    dictionary = iterate_path(arguments.path, arguments.mode)
-    save(dictionary, arguments.file)
+    if arguments.hash and arguments.mode == "fast":
+        parser.error("--hash needs big mode")
+    if arguments.hash == "duplicates" and arguments.stream:
+        parser.error("--hash duplicates cannot be used with --stream")
+    if arguments.stream and arguments.file.endswith(".fsb"):
+        parser.error("--stream only works for json files")
+    if arguments.compress and arguments.file.endswith(".fsb"):
+        parser.error("--compress only works for json files")
+    if arguments.incremental and arguments.mode == "fast":
+        parser.error("--incremental needs the folder times of big mode")
+    if not os.path.isdir(arguments.path):
+        parser.error("{} is not a folder".format(arguments.path))
+    if arguments.checkpoint is not None and arguments.checkpoint <= 0:
+        parser.error("--checkpoint needs a positive interval")
+    if arguments.resume and arguments.restart:
+        parser.error("--resume and --restart exclude each other")
+    if arguments.checkpoint is None and (arguments.resume or
+                                         arguments.restart):
+        arguments.checkpoint = CHECKPOINT
+    with instrumentation.instrumented(arguments) as stats:
+        run(arguments, parser, stats)
+
+
+def run(arguments, parser, stats=None):
+    """Make the snapshot main was asked for, with stats if collecting."""
+    previous = None
+    if arguments.incremental:
+        with instrumentation.phase("load previous"):
+            previous = load(arguments.incremental)
+    scheduler = io_scheduler.IOScheduler(arguments.max_ops,
+                                         budget=arguments.retry_budget)
+    hasher = None
+    if arguments.hash:
+        hasher = content_hash.Hasher(arguments.readers, scheduler=scheduler)
+    journal = None
+    if arguments.checkpoint is not None:
+        try:
+            journal = scan_journal.Journal(
+                scan_journal.journal_filename(arguments.file), arguments.path,
+                arguments.mode, arguments.checkpoint, arguments.resume,
+                arguments.restart)
+        except ValueError as exc:
+            parser.error(str(exc))
+        if arguments.resume:
+            print("Resuming with {} folders from the journal".format(
+                journal.resumed))
+    try:
+        counts = iterate_and_save(
+            arguments.path, arguments.file, arguments.mode, arguments.workers,
+            arguments.stream, previous, codec=arguments.compress,
+            hasher=hasher, hash_duplicates=arguments.hash == "duplicates",
+            scheduler=scheduler, journal=journal)
+    except BaseException as exc:
+        if journal is not None:
+            if not journal.folders:  # Nothing to continue from
+                journal.remove()
+            else:
+                journal.close()
+                if isinstance(exc, (KeyboardInterrupt, OSError)):
+                    print("Interrupted, continue with --resume",
+                          file=sys.stderr)
+        raise
+    finally:
+        if hasher is not None:
+            hasher.close()
+    if arguments.incremental:
+        print("Reused {} folders, rescanned {} folders".format(
+            counts["reused"], counts["rescanned"]))
+    if hasher is not None:
+        print(hasher.summary())
+    if arguments.max_ops or any(scheduler.counts[key] for key in
+                                ("slow", "retries", "errors")):
+        print(scheduler.summary())
+    if stats is not None:
+        stats.add_time("paced waiting", scheduler.waited)
+        if hasher is not None:
+            stats.add("bytes hashed", hasher.counts["bytes"])
 
 
 if __name__ == '__main__':
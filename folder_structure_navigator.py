@@ -1,9 +1,8 @@
 """Gui"""
 
 import os
-import json
-import time
-import threading
+import re
+import itertools
 import tkinter as tk
 from tkinter import font
 from tkinter import filedialog
@@ -11,9 +10,13 @@ from tkinter import messagebox
 from tkinter.ttk import Progressbar
 # from pprint import pprint
 
+import query
+import catalog
+import progress
+import snapshot_format
 import folder_structure_backup
-from traverser import JsonTraverser
-from traverser import OutOfStructureException
+from traverser import open_traverser, load_progressively, sizeof_fmt
+from traverser import JsonTraverser, OutOfStructureException
 
 
 class App(tk.Tk):
@@ -25,6 +28,7 @@ class App(tk.Tk):
         #     data = json.load(file)
         # self.traverser = JsonTraverser(data)
         self.traverser = None
+        self.loading = None
         default_font = font.nametofont("TkDefaultFont")
         default_font.configure(size=16)
         self.option_add("*Font", default_font)
@@ -34,15 +38,65 @@ class App(tk.Tk):
         # self.update_()
 
     def init_data(self, name):
-        """Load data"""
+        """Load data. Binary snapshots open at once, json is parsed on a
+        thread and can be browsed while the rest of it is still loading."""
         if not name:
             return
-        self.status["text"] = "Parsing file..."
-        self.status.update()
-        with open(name, "r") as file:
-            data = json.load(file)
-        self.traverser = JsonTraverser(data)
+        self.cancel_loading()
+        if snapshot_format.is_binary(name):
+            self.traverser = open_traverser(name)
+            self.update_()
+            return
+        self.traverser = JsonTraverser({})
+        self.loading = progress.Progress()
+        progress.run_in_background(self.loading, load_progressively, name)
         self.update_()
+        self.after(100, self.poll_loading, self.loading)
+
+    def poll_loading(self, loading):
+        """Apply what the loading thread parsed so far and show progress."""
+        if loading is not self.loading:  # Cancelled, or another file opened
+            return
+        changed = current_changed = False
+        position = tuple(self.traverser.position)
+        for message in loading.messages_waiting():
+            if message[0] == "add":
+                _, path, value = message
+                node = self.traverser.data
+                for name in path[:-1]:
+                    node = node[name]
+                node[path[-1]] = value
+                changed = True
+                current_changed = current_changed or path[:-1] == position
+            elif message[0] == "progress":
+                self.status["text"] = "Loading {}\n{}".format(
+                    progress.describe(message[1]),
+                    self.traverser.current_path())
+            else:
+                self.loading = None
+                if message[0] == "error":
+                    messagebox.showerror("Cannot load file", str(message[1]))
+                self.traverser.refresh()
+                self.refresh_listbox()
+                self.update_infobox()
+                self.update_statusbar()
+                return
+        if changed:
+            self.traverser.refresh(totals=False)
+        if current_changed:
+            self.refresh_listbox()
+        self.after(100, self.poll_loading, loading)
+
+    def cancel_loading(self):
+        """Stop loading a file, what was loaded so far stays."""
+        if self.loading is None:
+            return
+        self.loading.cancel()
+        self.loading = None
+        self.traverser.refresh()
+        self.refresh_listbox()
+        self.update_infobox()
+        self.update_statusbar()
 
     def init_listbox(self):
         """start listbox"""
@@ -55,8 +109,7 @@ class App(tk.Tk):
         tk.Grid.columnconfigure(frame, 1, weight=0)
         scrollbar = tk.Scrollbar(frame, orient="vertical")
         scrollbar.grid(row=0, column=1, sticky="news")
-        listbox = tk.Listbox(frame, width=40, yscrollcommand=scrollbar.set)
-        scrollbar.config(command=listbox.yview)
+        listbox = VirtualListbox(frame, scrollbar, width=40)
         listbox.configure(exportselection=False)
         # listbox.config(font=("TkDefaultFont", "19"))
         # default_font = font.nametofont("TkDefaultFont")
@@ -128,6 +181,8 @@ class App(tk.Tk):
             filename = filedialog.askopenfilename(
                 initialdir=os.getcwd(), title="Select Backup file...",
                 filetypes=(("JSON Files", "*.json"),
+                           ("Binary Snapshots", "*.fsb"),
+                           ("Compressed JSON", "*.gz *.bz2 *.xz"),
                            ("Text Files", "*.txt"),
                            ("All Files", "*.*")))
             self.init_data(filename)
@@ -145,6 +200,31 @@ class App(tk.Tk):
                 self.init_data(subwindow.target_file.get())
 
         menu.add_command(label="New Snapshot...", command=show_submenu)
+        menu.add_command(label="Stop loading", command=self.cancel_loading)
+        self.bind("<Escape>", lambda _: self.cancel_loading())
+        self.sort_by_size = tk.BooleanVar(value=False)
+        menu.add_checkbutton(label="Sort by size", variable=self.sort_by_size,
+                             command=self.refresh_listbox)
+
+        def show_largest():
+            if self.traverser is None:
+                return
+            if self.loading is not None:
+                messagebox.showinfo("Largest folders", "Still loading")
+                return
+            LargestFoldersScreen(self)
+
+        menu.add_command(label="Largest folders...", command=show_largest)
+
+        def show_catalog():
+            filename = filedialog.askopenfilename(
+                initialdir=os.getcwd(), title="Select catalog...",
+                filetypes=(("Catalogs", "*.db *.sqlite"),
+                           ("All Files", "*.*")))
+            if filename:
+                CatalogScreen(self, filename)
+
+        menu.add_command(label="Search catalog...", command=show_catalog)
 
     def update_(self):
         """Call all update functions"""
@@ -154,12 +234,21 @@ class App(tk.Tk):
         self.listbox.select_set(0)
         self.listbox.focus_set()
 
+    def content(self):
+        """Listing of the current folder, sorted as chosen. Sizes are only
+        known once the file is loaded."""
+        by_size = self.sort_by_size.get() and self.loading is None
+        return self.traverser.content_nice_view(head=("..",), by_size=by_size)
+
     def update_listbox(self):
         """Clear and refresh listbox"""
-        self.listbox.delete(0, tk.END)
-        self.listbox.insert(tk.END, "..")
-        for item in self.traverser.content_nice():
-            self.listbox.insert(tk.END, item)
+        self.listbox.set_items(self.content())
+
+    def refresh_listbox(self):
+        """Show changed content of the current folder, keeping the
+        selection."""
+        if self.traverser is not None:
+            self.listbox.replace_items(self.content())
 
     def update_statusbar(self):
         """Statusbar update"""
@@ -174,7 +263,9 @@ class App(tk.Tk):
             return
         except IndexError:
             return
-        if self.traverser.is_folder(selection):
+        if self.traverser.is_folder(selection) and self.loading is not None:
+            self.infobox["text"] = "Subfolders:\n...\n\nStill loading"
+        elif self.traverser.is_folder(selection):
             text = "Subfolders:\n{}\n\nSubfiles:\n{}\n\nSize:\n{}".format(
                 *self.traverser.subdir_info(selection, selection == ".."))
             self.infobox["text"] = text
@@ -182,6 +273,9 @@ class App(tk.Tk):
             text = ("Size:\n{}\n\nCreated:\n{}\n\n"
                     "Last Modified:\n{}\n\nLast Accessed:\n{}\n\n").format(
                         *self.traverser.file_info(selection))
+            error = self.traverser.file_error(selection)
+            if error is not None:
+                text = "Could not be read:\n{}\n\n".format(error) + text
             self.infobox["text"] = text
 
     @staticmethod
@@ -217,6 +311,256 @@ class App(tk.Tk):
             pass
 
 
+class VirtualListbox(tk.Listbox):
+    """Listbox for huge folders: only the rows in view are inserted.
+
+    The indices used by get, curselection, selection_set, see and
+    index("@x,y") refer to the whole sequence given to set_items. Scrolling
+    and keyboard navigation move the window of rows which is shown."""
+    def __init__(self, master, scrollbar, **kwargs):
+        super().__init__(master, selectmode=tk.BROWSE, **kwargs)
+        self.items = []
+        self.offset = 0
+        self.selected = None
+        self._row_height = None
+        self.scrollbar = scrollbar
+        scrollbar.config(command=self.yview)
+        self.bind("<Configure>", lambda _: self.render())
+        self.bind("<Up>", lambda _: self.move_selection(-1))
+        self.bind("<Down>", lambda _: self.move_selection(1))
+        self.bind("<Prior>", lambda _: self.move_selection(-self.rows()))
+        self.bind("<Next>", lambda _: self.move_selection(self.rows()))
+        self.bind("<Home>", lambda _: self.move_selection(-len(self.items)))
+        self.bind("<End>", lambda _: self.move_selection(len(self.items)))
+        self.bind("<MouseWheel>",
+                  lambda event: self.scroll(-3 if event.delta > 0 else 3))
+        self.bind("<Button-4>", lambda _: self.scroll(-3))
+        self.bind("<Button-5>", lambda _: self.scroll(3))
+
+    def set_items(self, items):
+        """Show a new sequence, scrolled to the top, nothing selected."""
+        self.items = items
+        self.offset = 0
+        self.selected = None
+        self.render()
+
+    def replace_items(self, items):
+        """Show a changed sequence at the same position and selection."""
+        self.curselection()
+        self.items = items
+        if self.selected is not None and self.selected >= len(items):
+            self.selected = len(items) - 1 if items else None
+        self.render()
+
+    def rows(self):
+        """Number of rows fitting into the widget."""
+        if self._row_height is None:
+            self._row_height = (
+                font.Font(font=self.cget("font")).metrics("linespace") + 1 +
+                2 * int(self.cget("selectborderwidth")))
+        if not self.winfo_ismapped():
+            return int(self.cget("height"))
+        border = int(self.cget("borderwidth")) + int(
+            self.cget("highlightthickness"))
+        return max(1, (self.winfo_height() - 2 * border) // self._row_height)
+
+    def render(self):
+        """Insert the rows in view, starting at offset."""
+        rows = self.rows()
+        self.offset = max(0, min(self.offset, len(self.items) - rows))
+        end = min(len(self.items), self.offset + rows + 1)
+        super().delete(0, tk.END)
+        super().insert(tk.END, *[self.items[index]
+                                 for index in range(self.offset, end)])
+        super().yview_moveto(0)
+        if self.selected is not None and self.offset <= self.selected < end:
+            super().selection_set(self.selected - self.offset)
+            super().activate(self.selected - self.offset)
+        if self.items:
+            self.scrollbar.set(self.offset / len(self.items),
+                               min(1, (self.offset + rows) / len(self.items)))
+        else:
+            self.scrollbar.set(0, 1)
+
+    def yview(self, *args):
+        """Scrollbar command, moves the window of rows shown."""
+        if not args:
+            if not self.items:
+                return 0.0, 1.0
+            return (self.offset / len(self.items),
+                    min(1, (self.offset + self.rows()) / len(self.items)))
+        if args[0] == tk.MOVETO:
+            self.offset = int(float(args[1]) * len(self.items))
+        elif args[0] == tk.SCROLL:
+            amount = int(args[1])
+            if args[2] == tk.PAGES:
+                amount *= self.rows()
+            self.offset += amount
+        self.render()
+        return None
+
+    def scroll(self, rows):
+        """Scroll by some rows."""
+        self.offset += rows
+        self.render()
+        return "break"
+
+    def see(self, index):
+        """Scroll so that the row index is in view."""
+        rows = self.rows()
+        if index < self.offset:
+            self.offset = index
+        elif index >= self.offset + rows:
+            self.offset = index - rows + 1
+        self.render()
+
+    def move_selection(self, rows):
+        """Move the selection by some rows, as the arrow keys do."""
+        if not self.items:
+            return "break"
+        current = self.curselection()
+        index = current[0] + rows if current else 0
+        self.selection_set(max(0, min(len(self.items) - 1, index)))
+        self.event_generate("<<ListboxSelect>>")
+        return "break"
+
+    def curselection(self):
+        """Index of the selected row as tuple, empty if none."""
+        visible = super().curselection()
+        if visible:
+            self.selected = self.offset + visible[0]
+        if self.selected is None:
+            return ()
+        return (self.selected,)
+
+    def selection_set(self, first, last=None):
+        """Select the row first and bring it into view."""
+        self.selected = int(first)
+        self.see(self.selected)
+    select_set = selection_set
+
+    def get(self, first, last=None):
+        """Row first, or a list of the rows first to last."""
+        if last is None:
+            return self.items[first]
+        return [self.items[index] for index in range(first, last + 1)]
+
+    def index(self, index):
+        """Index of the row at "@x,y", or of an index."""
+        if isinstance(index, str) and index.startswith("@"):
+            return self.offset + super().index(index)
+        if index == tk.END:
+            return len(self.items)
+        return int(index)
+
+
+class LargestFoldersScreen(tk.Toplevel):
+    """The largest folders at any depth below the current folder. Choosing
+    one goes there."""
+    def __init__(self, parent, count=100):
+        super().__init__(parent)
+        self.transient(parent)
+        self.title("Largest folders")
+        self.parent = parent
+        self.folders = parent.traverser.largest_folders(count)
+        listbox = tk.Listbox(self, width=80, height=25, exportselection=False)
+        scrollbar = tk.Scrollbar(self, orient="vertical",
+                                 command=listbox.yview)
+        listbox.config(yscrollcommand=scrollbar.set)
+        listbox.insert(tk.END, *["{:>10}  {}".format(
+            sizeof_fmt(size), os.path.join(*path))
+                                 for size, _, _, path in self.folders])
+        listbox.grid(row=0, column=0, sticky="news")
+        scrollbar.grid(row=0, column=1, sticky="news")
+        tk.Grid.rowconfigure(self, 0, weight=1)
+        tk.Grid.columnconfigure(self, 0, weight=1)
+        listbox.bind("<Double-Button-1>", lambda _: self.go_to())
+        listbox.bind("<Return>", lambda _: self.go_to())
+        listbox.focus_set()
+        self.listbox = listbox
+
+    def go_to(self):
+        """Open the chosen folder in the main window."""
+        selection = self.listbox.curselection()
+        if not selection:
+            return
+        for name in self.folders[selection[0]][3]:
+            self.parent.traverser.down(name)
+        self.parent.update_()
+        self.destroy()
+
+
+class CatalogScreen(tk.Toplevel):
+    """Search all snapshots of a catalog (see catalog) with a query. Choosing
+    a result opens its snapshot, binary snapshots at the result's folder."""
+    def __init__(self, parent, filename, limit=1000):
+        super().__init__(parent)
+        self.transient(parent)
+        self.title("Catalog {}".format(os.path.basename(filename)))
+        self.parent = parent
+        self.catalog = catalog.Catalog(filename)
+        self.limit = limit
+        self.results = []
+        self.text = tk.StringVar()
+        entry = tk.Entry(self, textvariable=self.text, width=60)
+        entry.grid(row=0, column=0, sticky="news")
+        entry.bind("<Return>", lambda _: self.search())
+        tk.Button(self, text="Search", command=self.search).grid(
+            row=0, column=1, sticky="news")
+        listbox = tk.Listbox(self, width=100, height=25, exportselection=False)
+        scrollbar = tk.Scrollbar(self, orient="vertical",
+                                 command=listbox.yview)
+        listbox.config(yscrollcommand=scrollbar.set)
+        listbox.grid(row=1, column=0, sticky="news")
+        scrollbar.grid(row=1, column=1, sticky="news")
+        tk.Grid.rowconfigure(self, 1, weight=1)
+        tk.Grid.columnconfigure(self, 0, weight=1)
+        listbox.bind("<Double-Button-1>", lambda _: self.go_to())
+        self.listbox = listbox
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        entry.focus_set()
+
+    def search(self):
+        """Show the first results of the query."""
+        try:
+            self.results = list(itertools.islice(
+                self.catalog.query(self.text.get()), self.limit))
+        except (query.QueryError, re.error) as exc:
+            messagebox.showerror("Invalid query", str(exc), parent=self)
+            return
+        self.listbox.delete(0, tk.END)
+        self.listbox.insert(tk.END, *[
+            "{:>10}  {}: {}".format("" if size is None else sizeof_fmt(size),
+                                    os.path.basename(snapshot), path)
+            for snapshot, path, size in self.results])
+
+    def go_to(self):
+        """Open the snapshot of the chosen result."""
+        selection = self.listbox.curselection()
+        if not selection:
+            return
+        snapshot, path, size = self.results[selection[0]]
+        self.parent.init_data(snapshot)
+        if self.parent.loading is not None:  # Json, shown once loaded
+            self.parent.status["text"] = "Loading, the result is {}".format(
+                path)
+            return
+        parts = path.split(os.sep)
+        if size is not None:  # A file, go to its folder
+            parts.pop()
+        try:
+            for name in parts:
+                self.parent.traverser.down(name)
+        except OutOfStructureException:
+            pass
+        self.parent.update_()
+
+    def close(self):
+        """Close the catalog with the window."""
+        self.catalog.close()
+        self.destroy()
+
+
 class NewSnapshotScreen(tk.Toplevel):
     """Window to select and Path to analyze and start generation."""
     def __init__(self, parent, *args, **kwargs):
@@ -245,12 +589,18 @@ class NewSnapshotScreen(tk.Toplevel):
         tk.Checkbutton(
             self, text="Less detailed, fast mode",
             variable=self.fastmode).grid(row=2, column=0, columnspan=3)
-        tk.Button(
-            self, text="Start backup generation",
-            command=self.generate).grid(row=3, column=0, columnspan=3)
+        self.start_button = tk.Button(
+            self, text="Start backup generation", command=self.generate)
+        self.start_button.grid(row=3, column=0, columnspan=3)
         tk.Grid.columnconfigure(self, 1, weight=1)
-        progress = Progressbar(self, orient=tk.HORIZONTAL, mode='indeterminate')
-        self.progress = progress
+        progressbar = Progressbar(self, orient=tk.HORIZONTAL,
+                                  mode='indeterminate')
+        self.progress = progressbar
+        self.progress_text = tk.Label(self, text="", anchor="w")
+        self.cancel_button = tk.Button(self, text="Cancel",
+                                       command=self.cancel)
+        self.job = None
+        self.protocol("WM_DELETE_WINDOW", self.close)
 
     def select_snap_path(self):
         """Show the Menu for folder selection and save selection."""
@@ -273,6 +623,8 @@ class NewSnapshotScreen(tk.Toplevel):
         target_file = filedialog.asksaveasfilename(
             initialdir=default, title="Output file", defaultextension=".json",
             filetypes=(("JSON File", "*.json"),
+                       ("Binary Snapshot", "*.fsb"),
+                       ("Compressed JSON", "*.json.gz *.json.bz2 *.json.xz"),
                        ("Text File", "*.txt"),
                        ("All Files", "*.*")))
         if target_file:
@@ -287,21 +639,58 @@ class NewSnapshotScreen(tk.Toplevel):
             messagebox.showerror("Invalid Arguments",
                                  "At least one path was not valid.")
             return
-        self.progress.grid(row=100, columnspan=3, sticky="ews")
-        self.update()
-        thread = threading.Thread(
-            target=folder_structure_backup.iterate_and_save,
-            args=(self.target_path.get(), self.target_file.get(),
-                  "big" if not self.fastmode.get() else "fast"))
-        thread.daemon = True
-        thread.start()
-        while thread.is_alive():
-            self.progress.step(amount=2)
-            self.progress.update()
-            self.update()
-            time.sleep(0.1)
+        self.progress.grid(row=100, column=0, columnspan=2, sticky="ews")
+        self.cancel_button.grid(row=100, column=2, sticky="ews")
+        self.progress_text.grid(row=101, columnspan=3, sticky="ews")
+        self.progress_text["text"] = "Starting..."
+        self.start_button["state"] = tk.DISABLED
+        self.job = progress.Progress()
+        progress.run_in_background(
+            self.job, folder_structure_backup.iterate_and_save,
+            self.target_path.get(), self.target_file.get(),
+            "big" if not self.fastmode.get() else "fast")
+        self.after(100, self.poll)
+
+    def poll(self):
+        """Show the progress of the generation, close when it is done."""
+        if self.job is None:
+            return
+        for message in self.job.messages_waiting():
+            if message[0] == "progress":
+                self.progress_text["text"] = progress.describe(message[1])
+            elif message[0] == "done":
+                self.finished = True
+                self.close()
+                return
+            else:
+                if message[0] == "error":
+                    messagebox.showerror("Snapshot failed", str(message[1]),
+                                         parent=self)
+                self.stopped("Cancelled" if message[0] == "cancelled"
+                             else "Failed")
+                return
+        self.progress.step(amount=2)
+        self.after(100, self.poll)
+
+    def stopped(self, text):
+        """Allow to start again after the generation did not finish."""
+        self.job = None
         self.progress.grid_forget()
-        self.finished = True
+        self.cancel_button.grid_forget()
+        self.progress_text["text"] = text
+        self.start_button["state"] = tk.NORMAL
+
+    def cancel(self):
+        """Stop the running generation."""
+        if self.job is not None:
+            self.job.cancel()
+            self.progress_text["text"] = "Cancelling..."
+
+    def close(self):
+        """Close the window, a running generation is cancelled."""
+        if self.job is not None and not self.finished:
+            self.job.cancel()
+        self.job = None
         self.destroy()
         self.quit()
 
@@ -0,0 +1,414 @@
+"""History of a drive as one base snapshot and a delta per run.
+
+Snapshots of the same drive from one day to the next hardly differ. A
+history store keeps a full snapshot, the base, and for every later snapshot
+only what changed against the one before: folders added with their content
+or removed, and per folder the files added, changed or removed and the
+other "__/" entries that differ. The snapshot of any point in time is the
+last base before it with the deltas since applied; it is exactly the
+snapshot that was added, down to the order of the keys. So that this does
+not take ever longer, a new base is written every rebase runs. Asking what
+changed between two dates reads only the deltas, every snapshot after the
+first has one, also when it is a base.
+
+A store is a folder with an index, history.json, and a compressed json file
+per base and per delta.
+
+Usage: python history.py STORE add SNAPSHOT [--time DATE] [--rebase N]
+       python history.py STORE list
+       python history.py STORE restore DATE OUTPUT
+       python history.py STORE changes [--since DATE] [--until DATE]
+                                       [--format text|jsonl]
+       python history.py STORE rebase"""
+
+import os
+import sys
+import json
+import argparse
+import datetime
+import collections.abc
+
+import query
+import compression
+import file_table
+import folder_structure_backup
+from traverser import JsonTraverser, is_reserved
+
+VERSION = 1
+INDEX = "history.json"
+REBASE = 30  # Deltas after a base until the next base
+FILES = "__/files"
+
+
+def _same_files(old, new):
+    """Are the files of two folders the same? Cheap for unchanged tables."""
+    if isinstance(old, file_table.FileTable) and isinstance(
+            new, file_table.FileTable):
+        return (old.names == new.names and old.sizes == new.sizes and
+                old.modified == new.modified and
+                old.created == new.created and
+                old.accessed == new.accessed and old.hashes == new.hashes)
+    if isinstance(old, collections.abc.Mapping) and isinstance(
+            new, collections.abc.Mapping):
+        return list(old.items()) == list(new.items())
+    return old == new
+
+
+def _file_changes(old, new, change):
+    """Add the differences of the files of a folder to a change."""
+    if isinstance(old, collections.abc.Mapping) and isinstance(
+            new, collections.abc.Mapping):
+        old_files = dict(old.items())
+        added = {}
+        changed = {}
+        for name, details in new.items():
+            before = old_files.pop(name, None)
+            if before is None:
+                added[name] = details
+            elif before != details:
+                changed[name] = details
+        removed = list(old_files)
+        if added:
+            change["added"] = added
+        if changed:
+            change["changed"] = changed
+        remaining = [name for name in old if name not in old_files]
+    elif isinstance(old, list) and isinstance(new, list):
+        old_names = set(old)
+        new_names = set(new)
+        added = [name for name in new if name not in old_names]
+        removed = [name for name in old if name not in new_names]
+        if added:
+            change["added"] = added
+        remaining = [name for name in old if name in new_names]
+    else:  # The mode changed, no use comparing
+        change.setdefault("set", {})[FILES] = new
+        return
+    if removed:
+        change["removed"] = removed
+    order = list(new)
+    if remaining + [name for name in order if name not in set(remaining)] \
+            != order:
+        change["file_order"] = order
+
+
+def delta(old, new):
+    """Changes from the snapshot dictionary old to new, a list of dicts with
+    the path of a folder as list of names and "op": "add" a folder with its
+    "tree", "remove" a folder, or "update" a folder."""
+    changes = []
+    stack = [([], old, new)]
+    while stack:
+        path, before, after = stack.pop()
+        change = {}
+        if FILES in before and FILES in after and not _same_files(
+                before[FILES], after[FILES]):
+            _file_changes(before[FILES], after[FILES], change)
+        subfolders = []
+        for key, value in after.items():
+            if key not in before:
+                if is_reserved(key):
+                    change.setdefault("set", {})[key] = value
+                else:
+                    changes.append({"op": "add", "path": path + [key],
+                                    "tree": value})
+            elif is_reserved(key):
+                if key != FILES and before[key] != value:
+                    change.setdefault("set", {})[key] = value
+            else:
+                subfolders.append((path + [key], before[key], value))
+        for key in before:
+            if key not in after:
+                if is_reserved(key):
+                    change.setdefault("unset", []).append(key)
+                else:
+                    changes.append({"op": "remove", "path": path + [key]})
+        # Applied, folders added come after the kept keys, then new "__/"
+        # entries
+        order = [key for key in before if key in after]
+        order.extend(key for key in after
+                     if key not in before and not is_reserved(key))
+        order.extend(key for key in change.get("set", ())
+                     if key not in before)
+        if [key for key in order if key in after] != list(after):
+            change["keys"] = list(after)
+        if change:
+            change["op"] = "update"
+            change["path"] = path
+            changes.append(change)
+        stack.extend(reversed(subfolders))
+    return changes
+
+
+def _reorder(mapping, keys):
+    """Put the keys of a dict in the given order."""
+    ordered = {key: mapping[key] for key in keys}
+    mapping.clear()
+    mapping.update(ordered)
+
+
+def _apply_files(files, change):
+    """Files of a folder with the changes to them."""
+    if isinstance(files, list):
+        removed = set(change.get("removed", ()))
+        files = [name for name in files if name not in removed]
+        files.extend(change.get("added", ()))
+        if "file_order" in change:
+            files = change["file_order"]
+        return files
+    table = isinstance(files, file_table.FileTable)
+    files = dict(files.items())
+    for name in change.get("removed", ()):
+        del files[name]
+    files.update(change.get("changed", {}))
+    files.update(change.get("added", {}))
+    if "file_order" in change:
+        _reorder(files, change["file_order"])
+    if table:
+        return file_table.FileTable.from_dict(files) or files
+    return files
+
+
+def apply(data, changes):
+    """Apply the changes made by delta to a snapshot dictionary, in
+    place."""
+    for change in changes:
+        *parents, name = change["path"] or [None]
+        node = data
+        for part in parents:
+            node = node[part]
+        if change["op"] == "add":
+            node[name] = change["tree"]
+        elif change["op"] == "remove":
+            del node[name]
+        else:
+            if name is not None:
+                node = node[name]
+            if any(key in change for key in ("added", "changed", "removed",
+                                             "file_order")):
+                node[FILES] = _apply_files(node[FILES], change)
+            for key in change.get("unset", ()):
+                del node[key]
+            node.update(change.get("set", {}))
+            if "keys" in change:
+                _reorder(node, change["keys"])
+    return data
+
+
+def _write(data, filename):
+    """Write json compressed as the extension says, atomically."""
+    temporary = filename + ".tmp"
+    with compression.open_snapshot(temporary, "w", compression.codec_of_name(
+            filename)) as file:
+        json.dump(data, file, default=file_table.to_json)
+    os.replace(temporary, filename)
+
+
+def _read(filename):
+    """Read a file written by _write."""
+    with compression.open_snapshot(filename, "r") as file:
+        return file_table.load_json(file)
+
+
+def format_time(timestamp):
+    """Readable UTC time of a timestamp."""
+    return datetime.datetime.fromtimestamp(
+        timestamp, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+class History():
+    """A history store in a folder, see the module documentation. The
+    entries of the index are in order of time, each with "time", the
+    "delta" file (None for the first) and the "base" file or None."""
+    def __init__(self, folder, rebase=REBASE):
+        self.folder = folder
+        self.index_filename = os.path.join(folder, INDEX)
+        if os.path.exists(self.index_filename):
+            with open(self.index_filename) as file:
+                index = json.load(file)
+            if index.get("history") != VERSION:
+                raise ValueError("{} is not a history store".format(folder))
+            self.rebase = index["rebase"]
+            self.entries = index["entries"]
+        else:
+            self.rebase = rebase
+            self.entries = []
+
+    def _save_index(self):
+        """Write the index, atomically."""
+        temporary = self.index_filename + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump({"history": VERSION, "rebase": self.rebase,
+                       "entries": self.entries}, file, indent=1)
+        os.replace(temporary, self.index_filename)
+
+    def _path(self, name):
+        """Path of a file of the store."""
+        return os.path.join(self.folder, name)
+
+    def _position(self, timestamp):
+        """Index of the last entry at or before a time."""
+        position = None
+        for number, entry in enumerate(self.entries):
+            if entry["time"] > timestamp:
+                break
+            position = number
+        if position is None:
+            raise KeyError("The history starts at {}".format(
+                format_time(self.entries[0]["time"])) if self.entries
+                else "The history is empty")
+        return position
+
+    def _data(self, position):
+        """Snapshot dictionary of an entry."""
+        start = position
+        while self.entries[start]["base"] is None:
+            start -= 1
+        data = _read(self._path(self.entries[start]["base"]))
+        for entry in self.entries[start + 1:position + 1]:
+            apply(data, _read(self._path(entry["delta"])))
+        return data
+
+    def data(self, timestamp):
+        """Snapshot dictionary as it was at a time."""
+        return self._data(self._position(timestamp))
+
+    def traverser(self, timestamp):
+        """JsonTraverser of the snapshot as it was at a time."""
+        return JsonTraverser(self.data(timestamp))
+
+    def add(self, data, timestamp):
+        """Add a snapshot dictionary taken at a time after the last one.
+        Returns the number of changes."""
+        if self.entries and timestamp <= self.entries[-1]["time"]:
+            raise ValueError("Snapshots have to be added in order of time, "
+                             "the last one is from {}".format(
+                                 format_time(self.entries[-1]["time"])))
+        os.makedirs(self.folder, exist_ok=True)
+        number = len(self.entries)
+        entry = {"time": timestamp, "delta": None, "base": None}
+        changes = 0
+        if self.entries:
+            changed = delta(self._data(number - 1), data)
+            changes = len(changed)
+            entry["delta"] = "{:06d}.delta.json.gz".format(number)
+            _write(changed, self._path(entry["delta"]))
+        since = 0
+        for previous in reversed(self.entries):
+            if previous["base"] is not None:
+                break
+            since += 1
+        if not self.entries or since + 1 >= self.rebase:
+            entry["base"] = "{:06d}.base.json.gz".format(number)
+            _write(data, self._path(entry["base"]))
+        self.entries.append(entry)
+        self._save_index()
+        return changes
+
+    def rebase_latest(self):
+        """Write a base for the latest snapshot, if it has none."""
+        entry = self.entries[-1]
+        if entry["base"] is None:
+            data = self._data(len(self.entries) - 1)
+            entry["base"] = "{:06d}.base.json.gz".format(
+                len(self.entries) - 1)
+            _write(data, self._path(entry["base"]))
+            self._save_index()
+
+    def changes(self, since=None, until=None):
+        """Yield (time, change, kind, path) for every change after since up
+        to until, reading only the deltas. change is "added", "changed" or
+        "removed", kind "file" or "folder"; a folder added or removed
+        counts once, not with its content."""
+        for entry in self.entries:
+            if entry["delta"] is None or (
+                    since is not None and entry["time"] <= since):
+                continue
+            if until is not None and entry["time"] > until:
+                break
+            for change in _read(self._path(entry["delta"])):
+                path = os.path.join(*change["path"]) if change["path"] \
+                    else ""
+                if change["op"] == "add":
+                    yield entry["time"], "added", "folder", path
+                    continue
+                if change["op"] == "remove":
+                    yield entry["time"], "removed", "folder", path
+                    continue
+                for kind in ("added", "changed", "removed"):
+                    for name in change.get(kind, ()):
+                        yield (entry["time"], kind, "file",
+                               os.path.join(path, name))
+
+
+def parse_time(text):
+    """Timestamp of a date, see query.parse_date."""
+    try:
+        return query.parse_date(text)
+    except query.QueryError as exc:
+        raise argparse.ArgumentTypeError(str(exc)) from exc
+
+
+def main():
+    """Add snapshots to a history store or read it."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("store", help="Folder of the history store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("add", help="Add a snapshot")
+    command.add_argument("snapshot", help="Snapshot file, json or binary")
+    command.add_argument("--time", type=parse_time,
+                         help="When it was taken (UTC), default the "
+                         "modification time of the file")
+    command.add_argument("--rebase", type=int, default=REBASE,
+                         help="Deltas until the next base, for a new store")
+    commands.add_parser("list", help="Show the snapshots in the store")
+    command = commands.add_parser("restore",
+                                  help="Write the snapshot of a time")
+    command.add_argument("time", type=parse_time)
+    command.add_argument("output", help="Snapshot file to write")
+    command = commands.add_parser("changes", help="What changed between "
+                                  "two dates")
+    command.add_argument("--since", type=parse_time)
+    command.add_argument("--until", type=parse_time)
+    command.add_argument("--format", choices=["text", "jsonl"],
+                         default="text")
+    commands.add_parser("rebase", help="Write a base for the latest "
+                        "snapshot")
+    arguments = parser.parse_args()
+    if arguments.command == "add":
+        history = History(arguments.store, arguments.rebase)
+    else:
+        history = History(arguments.store)
+    try:
+        if arguments.command == "add":
+            timestamp = arguments.time
+            if timestamp is None:
+                timestamp = os.stat(arguments.snapshot).st_mtime
+            changes = history.add(
+                folder_structure_backup.load(arguments.snapshot), timestamp)
+            print("Added {} from {}, {} changes".format(
+                arguments.snapshot, format_time(timestamp), changes))
+        elif arguments.command == "list":
+            for entry in history.entries:
+                print("{}  {}".format(format_time(entry["time"]),
+                                      "base" if entry["base"] else "delta"))
+        elif arguments.command == "restore":
+            folder_structure_backup.save(history.data(arguments.time),
+                                         arguments.output)
+        elif arguments.command == "changes":
+            for timestamp, change, kind, path in history.changes(
+                    arguments.since, arguments.until):
+                if arguments.format == "jsonl":
+                    print(json.dumps({"time": timestamp, "change": change,
+                                      "kind": kind, "path": path}))
+                else:
+                    print("{} {:8} {:6} {}".format(format_time(timestamp),
+                                                   change, kind, path))
+        else:
+            history.rebase_latest()
+    except (KeyError, ValueError) as exc:
+        sys.exit(exc.args[0])
+
+
+if __name__ == '__main__':
+    main()
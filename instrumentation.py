@@ -0,0 +1,131 @@
+"""Where the time of a run goes: timers per phase and counters.
+
+Collecting is off unless a program runs with --stats (see add_arguments
+and instrumented). While it is off, STATS is None and the functions here
+return at once; code counting in its inner loops checks STATS itself, once
+per folder rather than once per file. With --profile, the run is profiled
+by cProfile as well."""
+
+import sys
+import json
+import time
+import functools
+import pstats
+import cProfile
+import threading
+import contextlib
+import collections
+
+STATS = None  # The Stats being collected, None while collecting is off
+_OFF = contextlib.nullcontext()
+
+
+class Stats():
+    """Seconds spent per phase and counters, safe to add to from several
+    threads. Phases may be nested, their times then overlap."""
+    def __init__(self):
+        self.times = collections.OrderedDict()
+        self.counts = collections.Counter()
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, name, value=1):
+        """Add to a counter."""
+        with self._lock:
+            self.counts[name] += value
+
+    def add_time(self, name, seconds):
+        """Add to the time of a phase."""
+        with self._lock:
+            self.times[name] = self.times.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the block as the given phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def as_dict(self):
+        """Times and counts, for json."""
+        return {"total": time.perf_counter() - self.started,
+                "phases": dict(self.times), "counts": dict(self.counts)}
+
+    def summary(self):
+        """Readable table of the times and counts."""
+        lines = ["{:<24} {:10.3f} s".format("total",
+                                            time.perf_counter() -
+                                            self.started)]
+        lines.extend("{:<24} {:10.3f} s".format(name, seconds)
+                     for name, seconds in self.times.items())
+        lines.extend("{:<24} {:>10}".format(name, value)
+                     for name, value in sorted(self.counts.items()))
+        return "\n".join(lines)
+
+
+def phase(name):
+    """Time a block as phase of STATS, if collecting."""
+    if STATS is None:
+        return _OFF
+    return STATS.phase(name)
+
+
+def timed(name):
+    """Decorator: time every call of a function as phase, if collecting."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if STATS is None:
+                return function(*args, **kwargs)
+            with STATS.phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def add(name, value=1):
+    """Add to a counter of STATS, if collecting."""
+    if STATS is not None:
+        STATS.add(name, value)
+
+
+def add_arguments(parser):
+    """Add --stats and --profile to an argparse parser."""
+    parser.add_argument("--stats", nargs="?", const="-", metavar="JSON",
+                        help="Print how long the phases took and what was "
+                        "counted, or write it to a json file")
+    parser.add_argument("--profile", nargs="?", const="-", metavar="FILE",
+                        help="Profile with cProfile, print the slowest "
+                        "functions or save the profile for pstats")
+
+
+@contextlib.contextmanager
+def instrumented(arguments):
+    """Collect stats and profile the block as --stats and --profile ask,
+    report when it ends, also by an error or interruption."""
+    global STATS  # pylint: disable=global-statement
+    if arguments.stats:
+        STATS = Stats()
+    profiler = None
+    if arguments.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield STATS
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            if arguments.profile == "-":
+                pstats.Stats(profiler, stream=sys.stderr).sort_stats(
+                    "cumulative").print_stats(25)
+            else:
+                profiler.dump_stats(arguments.profile)
+        if STATS is not None:
+            if arguments.stats == "-":
+                print(STATS.summary(), file=sys.stderr)
+            else:
+                with open(arguments.stats, "w") as file:
+                    json.dump(STATS.as_dict(), file, indent=1)
+            STATS = None
@@ -0,0 +1,140 @@
+"""Gentle access to a failing drive.
+
+Every access of the scanner, reading a folder, the details of a file or its
+content for a hash, can go through an IOScheduler. It starts at most
+max_rate operations per second, and backs off when operations get slow: a
+drive which takes long to answer is probably retrying bad sectors, and more
+requests make it worse. The pause doubles on every slow operation and halves
+on every fast one.
+
+Operations failing with an error that may go away (EIO, EAGAIN, EBUSY,
+ETIMEDOUT, EINTR) are retried after a growing pause until the time budget of
+the operation is used up. Other errors, like a missing permission, are not
+retried. Files of a folder are read in the order of their inode numbers where
+the operating system gives them for free, which is roughly their order on
+the disk."""
+
+import os
+import time
+import errno
+import threading
+import collections
+
+TRANSIENT = {errno.EIO, errno.EAGAIN, errno.EBUSY, errno.ETIMEDOUT,
+             errno.EINTR}
+
+
+def describe(exc):
+    """Short text of an OSError for the snapshot, like "EACCES: Permission
+    denied"."""
+    name = errno.errorcode.get(exc.errno)
+    if name is None:
+        return exc.strerror or str(exc)
+    return "{}: {}".format(name, exc.strerror)
+
+
+def read_directory(path):
+    """All entries of a folder."""
+    with os.scandir(path) as entries:
+        return list(entries)
+
+
+def inode(entry):
+    """Inode number of an os.DirEntry, 0 if unknown."""
+    try:
+        return entry.inode()
+    except OSError:
+        return 0
+
+
+class IOScheduler():
+    """Pace, time and retry file system operations, see the module
+    documentation. Can be shared by several reader threads. counts has the
+    number of "operations", "slow" ones, "retries" and "errors" given up
+    on."""
+    def __init__(self, max_rate=None, slow=0.25, budget=10.0, max_pause=5.0,
+                 retry_pause=0.5, order=None):
+        self.interval = 1 / max_rate if max_rate else 0.0
+        self.slow = slow
+        self.budget = budget
+        self.max_pause = max_pause
+        self.retry_pause = retry_pause
+        # DirEntry.inode needs a system call on Windows
+        self.order = os.name != "nt" if order is None else order
+        self.pause = 0.0
+        self.counts = collections.Counter()
+        self.waited = 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        """Sleep until the next operation may start."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval + self.pause
+            self.waited += start - now
+        if start > now:
+            time.sleep(start - now)
+
+    def _adapt(self, latency):
+        """Back off after a slow operation, speed up after a fast one."""
+        with self._lock:
+            self.counts["operations"] += 1
+            if latency > self.slow:
+                self.counts["slow"] += 1
+                self.pause = min(self.max_pause, max(self.pause * 2, latency))
+                self._next = max(self._next, time.monotonic() + self.pause)
+            elif self.pause:
+                self.pause = self.pause / 2 if self.pause > 0.001 else 0.0
+
+    def call(self, function, *args):
+        """Result of function(*args), called when it is its turn. Raises the
+        OSError of the last try when retrying is of no use."""
+        started = time.monotonic()
+        pause = self.retry_pause
+        while True:
+            self._wait()
+            before = time.monotonic()
+            try:
+                result = function(*args)
+            except OSError as exc:
+                now = time.monotonic()
+                self._adapt(now - before)
+                if (exc.errno not in TRANSIENT or
+                        now + pause - started > self.budget):
+                    with self._lock:
+                        self.counts["errors"] += 1
+                    raise
+                with self._lock:
+                    self.counts["retries"] += 1
+                time.sleep(pause)
+                pause = min(pause * 2, self.max_pause)
+                continue
+            self._adapt(time.monotonic() - before)
+            return result
+
+    def ordered(self, entries):
+        """DirEntries in the order they should be read."""
+        if not self.order:
+            return entries
+        return sorted(entries, key=inode)
+
+    def inodes(self, path):
+        """Name to inode number of the entries of a folder, read once more
+        for ordering; empty if the scheduler does not order or the folder
+        cannot be read."""
+        if not self.order:
+            return {}
+        try:
+            entries = self.call(read_directory, path)
+        except OSError:
+            return {}
+        return {entry.name: inode(entry) for entry in entries}
+
+    def summary(self):
+        """One line about the operations so far."""
+        return ("{} operations, {} slow, {} retries, {} errors, waited "
+                "{:.1f} s".format(self.counts["operations"],
+                                  self.counts["slow"], self.counts["retries"],
+                                  self.counts["errors"], self.waited))
@@ -0,0 +1,103 @@
+"""Progress of long running scans and loads, reported to another thread.
+
+The worker counts what it did on a Progress object, which puts a summary
+into a queue every now and then. The GUI polls that queue and may cancel
+the work, which ends it with Cancelled at the next folder."""
+
+import time
+import queue
+import threading
+
+from file_table import total_size
+from traverser import sizeof_fmt
+
+
+class Cancelled(Exception):
+    """The work was cancelled through Progress.cancel."""
+
+
+class Progress():
+    """Counters of a running job, reported through a queue of messages.
+
+    Messages are tuples, the first element tells what they are:
+    ("progress", summary dict) at most every interval seconds, and when
+    run_in_background ends ("done", result), ("cancelled",) or
+    ("error", exception). Jobs may put their own messages as well."""
+    def __init__(self, interval=0.1):
+        self.messages = queue.Queue()
+        self.interval = interval
+        self.folders = self.files = self.bytes = 0
+        self.fraction = None  # Part of the job done, if known
+        self.started = time.monotonic()
+        self._reported = self.started
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """Ask the job to stop."""
+        self._cancel.set()
+
+    def check(self):
+        """Raise Cancelled if the job should stop."""
+        if self._cancel.is_set():
+            raise Cancelled
+
+    def put(self, *message):
+        """Send a message to the polling thread."""
+        self.messages.put(message)
+
+    def add_folder(self, files):
+        """Count a folder with its files, a list or name to details."""
+        self.folders += 1
+        self.files += len(files)
+        self.bytes += total_size(files)
+        self.check()
+        now = time.monotonic()
+        if now - self._reported >= self.interval:
+            self._reported = now
+            self.put("progress", self.summary())
+
+    def summary(self):
+        """Counters, elapsed time and rate of files per second."""
+        elapsed = time.monotonic() - self.started
+        return {"folders": self.folders, "files": self.files,
+                "bytes": self.bytes, "elapsed": elapsed,
+                "rate": self.files / elapsed if elapsed else 0.0,
+                "fraction": self.fraction}
+
+    def messages_waiting(self, limit=1000):
+        """Take up to limit messages without blocking."""
+        result = []
+        while len(result) < limit:
+            try:
+                result.append(self.messages.get_nowait())
+            except queue.Empty:
+                break
+        return result
+
+
+def describe(summary):
+    """One line of text for a progress summary."""
+    text = "{} folders, {} files, {}, {:.0f} files/s".format(
+        summary["folders"], summary["files"], sizeof_fmt(summary["bytes"]),
+        summary["rate"])
+    if summary["fraction"] is not None:
+        text = "{:.0%}: {}".format(summary["fraction"], text)
+    return text
+
+
+def run_in_background(progress, function, *args, **kwargs):
+    """Call function(*args, progress=progress, **kwargs) on a daemon thread
+    and report its end through the progress messages."""
+    def run():
+        try:
+            result = function(*args, progress=progress, **kwargs)
+        except Cancelled:
+            progress.put("cancelled")
+        except Exception as exc:  # pylint: disable=broad-except
+            progress.put("error", exc)
+        else:
+            progress.put("done", result)
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -0,0 +1,210 @@
+"""Queries over the files of a snapshot.
+
+A query is a list of terms, a file matches if all of them hold:
+
+    size>1GiB  size<=200KB     sizes in B, KB, MB, ... or KiB, MiB, ...
+    modified<2019  accessed>=2020-06-01  created=2021-03-04T12:00
+                               dates (UTC) stand for their first instant
+    ext:iso  ext:jpg,jpeg      extensions, case insensitive
+    under:projects/2019        path below the root folder of the snapshot
+    type:file  type:folder     only files or only folders
+    name:REGEX  REGEX          regular expression on the name
+    top:N                      the N largest files only, largest first
+
+Terms are separated by spaces, quotes group a term with spaces in it;
+backslashes are kept for the regular expressions. Terms are compiled once.
+The checks of a file run from cheap to expensive: extension and size
+before dates, regular expressions last. Folders which are not on the way
+to or below the path of under: are never visited, and top: keeps the N
+largest files on a heap instead of sorting all matches.
+Folders have no size or dates, so a query with such terms only finds files.
+
+Example: size>1GiB modified<2019 under:projects ext:iso"""
+
+import os
+import re
+import heapq
+import shlex
+import calendar
+import datetime
+import itertools
+import collections.abc
+
+import file_table
+
+UNITS = {"": 0, "k": 1, "m": 2, "g": 3, "t": 4, "p": 5}  # Powers of the base
+COMPARISONS = {"<": lambda a, b: a < b, "<=": lambda a, b: a <= b,
+               ">": lambda a, b: a > b, ">=": lambda a, b: a >= b,
+               "=": lambda a, b: a == b}
+FIELDS = ("size", "modified", "created", "accessed")
+DATE_FORMATS = ("%Y", "%Y-%m", "%Y-%m-%d", "%Y-%m-%dT%H:%M",
+                "%Y-%m-%dT%H:%M:%S")
+COMPARISON_TERM = re.compile(r"^(size|modified|created|accessed)"
+                             r"(<=|>=|<|>|=)(.+)$")
+SIZE = re.compile(r"^(\d+(?:\.\d+)?)\s*([kmgtp]?)(i?)b?$", re.IGNORECASE)
+
+
+class QueryError(ValueError):
+    """The query cannot be understood."""
+
+
+def parse_size(text):
+    """Bytes of a size like 1.5GiB or 200KB."""
+    match = SIZE.match(text)
+    if not match:
+        raise QueryError("Not a size: {}".format(text))
+    number, unit, binary = match.groups()
+    return float(number) * (1024 if binary else 1000) ** UNITS[unit.lower()]
+
+
+def parse_date(text):
+    """Timestamp of the first instant of a date like 2019 or 2019-06-01."""
+    for date_format in DATE_FORMATS:
+        try:
+            date = datetime.datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+        return calendar.timegm(date.timetuple())
+    raise QueryError("Not a date: {}".format(text))
+
+
+def extension(name):
+    """Lower case end of a file name from its last dot on, like ".iso" or
+    ".bashrc", "" without a dot; ext: matches files by it."""
+    lowered = name.lower()
+    dot = lowered.rfind(".")
+    return lowered[dot:] if dot >= 0 else ""
+
+
+def details_of(files):
+    """Yield (name, (size, modified, created, accessed)) of the files of a
+    folder; the details are None in fast mode."""
+    if isinstance(files, file_table.FileTable):
+        yield from zip(files.names, zip(files.sizes, files.modified,
+                                        files.created, files.accessed))
+    elif isinstance(files, collections.abc.Mapping):
+        for name, details in files.items():
+            yield name, tuple(details.get(field, 0) or 0 for field in FIELDS)
+    else:
+        yield from zip(files, itertools.repeat(None))
+
+
+class Query():
+    """Compiled query, see the module documentation."""
+    def __init__(self, text):
+        self.text = text
+        self.files = self.folders = True
+        self.top = None
+        self.under = ()
+        self.extensions = None
+        self.comparisons = []  # (field index, compare, value)
+        self.patterns = []
+        self.expressions = []  # The regular expressions of patterns
+        lexer = shlex.shlex(text, posix=True)
+        lexer.whitespace_split = True
+        lexer.escape = ""  # Backslashes belong to the regular expressions
+        try:
+            terms = list(lexer)
+        except ValueError as exc:
+            raise QueryError(str(exc)) from exc
+        for term in terms:
+            self._add(term)
+        if self.comparisons or self.extensions or self.top:
+            self.folders = False
+        # Sizes before dates: they are compared first
+        self.comparisons.sort(key=lambda comparison: comparison[0] != 0)
+
+    def _add(self, term):
+        """Compile a single term."""
+        match = COMPARISON_TERM.match(term)
+        if match:
+            field, operator, value = match.groups()
+            value = (parse_size(value) if field == "size"
+                     else parse_date(value))
+            self.comparisons.append((FIELDS.index(field),
+                                     COMPARISONS[operator], value))
+            return
+        key, _, value = term.partition(":")
+        if key == "ext" and value:
+            self.extensions = tuple(
+                "." + extension.lower().lstrip(".")
+                for extension in value.split(","))
+        elif key == "under":
+            self.under = tuple(part for part in re.split(r"[\\/]", value)
+                               if part)
+        elif key == "type" and value in ("file", "folder"):
+            self.files = value == "file"
+            self.folders = value == "folder"
+        elif key == "top" and value.isdigit():
+            self.top = int(value)
+        elif key == "name" and value:
+            self._add_pattern(value)
+        else:
+            self._add_pattern(term)
+
+    def _add_pattern(self, pattern):
+        """Regular expression every matching name has to contain."""
+        try:
+            self.patterns.append(re.compile(pattern, re.IGNORECASE).search)
+            self.expressions.append(pattern)
+        except re.error as exc:
+            raise QueryError("Invalid expression {}: {}".format(
+                pattern, exc)) from exc
+
+    def matches_file(self, name, details):
+        """Does a file match? details as yielded by details_of."""
+        if self.extensions is not None and not name.lower().endswith(
+                self.extensions):
+            return False
+        if self.comparisons:
+            if details is None:
+                return False
+            for field, compare, value in self.comparisons:
+                if not compare(details[field], value):
+                    return False
+        for search in self.patterns:
+            if not search(name):
+                return False
+        return True
+
+    def matches_folder(self, name):
+        """Does a folder match?"""
+        for search in self.patterns:
+            if not search(name):
+                return False
+        return True
+
+    def _starts(self, traverser):
+        """(path, structure) of the folders given by under:, below every
+        root folder of the snapshot."""
+        for root, structure in traverser.children(traverser.data):
+            for part in self.under:
+                structure = dict(traverser.children(structure)).get(part)
+                if structure is None:
+                    break
+                root = os.path.join(root, part)
+            else:
+                yield root, structure
+
+    def matches(self, traverser):
+        """Yield (path, size) of every match, size is None for folders and
+        files without details. Files of a folder come before its
+        subfolders."""
+        for start, structure in self._starts(traverser):
+            for path, folders, files in traverser.walk(structure, start):
+                if self.files:
+                    for name, details in details_of(files):
+                        if self.matches_file(name, details):
+                            yield (os.path.join(path, name),
+                                   details[0] if details else None)
+                if self.folders:
+                    for name in folders:
+                        if self.matches_folder(name):
+                            yield os.path.join(path, name), None
+
+    def run(self, traverser):
+        """Matches in order, or the top: largest ones, largest first."""
+        if self.top is None:
+            return self.matches(traverser)
+        return iter(heapq.nlargest(self.top, self.matches(traverser),
+                                   key=lambda match: match[1] or 0))
@@ -0,0 +1,159 @@
+"""Journal of a running scan, to resume it after an interruption.
+
+Every folder read by folder_structure_backup is added to the journal as a
+line of json: its path, subfolders, files, modification time and errors. The
+lines are written to the disk every few seconds, so an interruption loses at
+most the folders read since the last checkpoint; a line cut off by a crash
+is dropped when the journal is opened again. A resumed scan takes the
+folders in the journal from there instead of reading them again; only the
+paths and the positions of their lines are kept in memory, a folder is read
+from the journal when it is taken, so resuming a --stream scan does not hold
+the snapshot in memory either. The result of reading a folder is all a scan
+depends on, so the snapshot is the same as if the scan had not been
+interrupted. Content hashes are not part of the journal, they are computed
+again."""
+
+import os
+import json
+import time
+import threading
+
+import file_table
+
+VERSION = 1
+PATH_KEY = '{"path": '  # Every folder line starts with it
+
+
+def journal_filename(snapshot_filename):
+    """Name of the journal of the scan writing a snapshot file."""
+    return snapshot_filename + ".journal"
+
+
+class Journal():
+    """Journal of the scan of target_path in mode, see the module
+    documentation. With resume, the folders of an existing journal are
+    indexed first, they are handed out by take. An existing journal is only
+    replaced with restart, else it is kept and ValueError raised. folders is
+    the number of folders in the journal."""
+    def __init__(self, filename, target_path, mode, interval=30.0,
+                 resume=False, restart=False):
+        self.filename = filename
+        self.interval = interval
+        self.header = {"journal": VERSION, "path": target_path, "mode": mode}
+        self.done = {}  # Path of a folder in the journal: offset of its line
+        self.pending = []
+        self._lock = threading.Lock()
+        self._last = time.monotonic()
+        self.file = None
+        self.reader = None
+        if resume and os.path.exists(filename):
+            self._load()
+            self.file = open(filename, "ab")
+        elif os.path.exists(filename) and not restart:
+            raise ValueError("{} is left from an interrupted scan, continue "
+                             "it with --resume or start over with "
+                             "--restart".format(filename))
+        else:
+            self.file = open(filename, "wb")
+            self.file.write(self._line(self.header))
+            self._sync()
+        self.resumed = self.folders = len(self.done)
+
+    @staticmethod
+    def _line(entry):
+        """Entry as line of the journal."""
+        return (json.dumps(entry, default=file_table.to_json) +
+                "\n").encode("ascii")
+
+    def _load(self):
+        """Index the folders of the journal line by line and cut off an
+        incomplete last line, so that new lines can be appended."""
+        self.reader = open(self.filename, "rb")
+        header = self.reader.readline()
+        try:
+            valid = (header.endswith(b"\n") and
+                     json.loads(header) == self.header)
+        except ValueError:
+            valid = False
+        if not valid:
+            self.reader.close()
+            raise ValueError("{} is not the journal of a scan of {} in {} "
+                             "mode".format(self.filename, self.header["path"],
+                                           self.header["mode"]))
+        decoder = json.JSONDecoder()
+        offset = len(header)
+        for line in self.reader:
+            if not line.endswith(b"\n"):
+                break
+            text = line.decode("ascii")
+            if text.startswith(PATH_KEY):  # Only the path is decoded
+                path = decoder.raw_decode(text, len(PATH_KEY))[0]
+            else:
+                path = json.loads(text)["path"]
+            self.done[path] = offset
+            offset += len(line)
+        if offset < os.path.getsize(self.filename):
+            os.truncate(self.filename, offset)
+
+    def take(self, path):
+        """Result of scan_directory for a folder in the journal, None if it
+        is not there. Every folder is handed out once."""
+        with self._lock:
+            offset = self.done.pop(path, None)
+            if offset is None:
+                return None
+            self.reader.seek(offset)
+            entry = json.loads(self.reader.readline())
+        if "errno" in entry:
+            return OSError(entry["errno"], entry["strerror"])
+        files = entry["files"]
+        if isinstance(files, dict):
+            files = file_table.FileTable.from_dict(files) or files
+        return (entry["folders"], files, entry["modified"], entry["reused"],
+                entry["errors"])
+
+    def record(self, path, result):
+        """Add the result of scan_directory for a folder, write the journal
+        to the disk if the last checkpoint is long enough ago."""
+        if isinstance(result, OSError):
+            entry = {"path": path, "errno": result.errno,
+                     "strerror": result.strerror}
+        else:
+            folders, files, modified, reused, errors = result
+            entry = {"path": path, "folders": folders, "files": files,
+                     "modified": modified, "reused": reused,
+                     "errors": errors}
+        line = self._line(entry)
+        with self._lock:
+            if self.file.closed:  # Readers still running after a failure
+                return
+            self.pending.append(line)
+            self.folders += 1
+            if time.monotonic() - self._last >= self.interval:
+                self._checkpoint()
+
+    def _checkpoint(self):
+        """Write the pending lines to the disk."""
+        self.file.write(b"".join(self.pending))
+        self.pending.clear()
+        self._sync()
+
+    def _sync(self):
+        """Make sure written lines survive a crash."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._last = time.monotonic()
+
+    def close(self):
+        """Write what is pending and close the journal."""
+        with self._lock:
+            if self.file is not None and not self.file.closed:
+                self._checkpoint()
+                self.file.close()
+            if self.reader is not None:
+                self.reader.close()
+
+    def remove(self):
+        """Delete the journal, once the snapshot is complete."""
+        self.close()
+        os.remove(self.filename)
@@ -0,0 +1,378 @@
+"""Name index of a snapshot for fast searches.
+
+The index holds every file and folder name of a snapshot in a flat table,
+each with a pointer to its parent folder, in the order search_recursive of
+file_search visits them. Next to it is a trigram index: for every sequence
+of three (case folded, ASCII) characters, the entries whose name contains
+it. A regular expression is reduced to the literal text every match must
+contain, and only the entries containing all of its trigrams are checked
+with the expression itself. Paths are only built for hits.
+
+The index can be saved next to the snapshot and is memory mapped when it
+is opened again, so loading it takes no time."""
+
+import os
+import re
+import mmap
+import array
+import bisect
+import struct
+import contextlib
+import concurrent.futures
+
+import instrumentation
+from traverser import open_traverser
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse  # pylint: disable=deprecated-module
+
+MAGIC = b"FSIDX001"
+HEADER = struct.Struct("<8sQQQQQQ")
+FILE = 0
+FOLDER = 1
+
+# Characters outside ASCII which match an ASCII letter with re.IGNORECASE
+_FOLD = str.maketrans({"\u0130": "i", "\u0131": "i", "\u017f": "s",
+                       "\u212a": "k"})
+
+
+def fold(text):
+    """Case fold text the way re.IGNORECASE compares ASCII letters."""
+    return text.translate(_FOLD).lower()
+
+
+def trigram_keys(text):
+    """Keys of all trigrams of the folded text consisting of ASCII only."""
+    keys = set()
+    for start in range(len(text) - 2):
+        trigram = text[start:start + 3]
+        if trigram.isascii():
+            keys.add(ord(trigram[0]) << 16 | ord(trigram[1]) << 8 |
+                     ord(trigram[2]))
+    return keys
+
+
+def required_literals(pattern):
+    """Pieces of literal text which every match of pattern contains."""
+    runs = []
+
+    def collect(items):
+        """Collect the literal runs of a parsed sequence."""
+        run = []
+        for operation, argument in items:
+            if operation is sre_parse.LITERAL and argument < 128:
+                run.append(chr(argument))
+                continue
+            runs.append("".join(run))
+            run = []
+            if operation is sre_parse.SUBPATTERN:
+                collect(argument[-1])
+            elif (operation in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+                  and argument[0] >= 1):
+                collect(argument[2])
+        runs.append("".join(run))
+
+    collect(sre_parse.parse(pattern))
+    return [run for run in runs if len(run) >= 3]
+
+
+def index_filename(snapshot_filename):
+    """Where the index of a snapshot is saved."""
+    return snapshot_filename + ".idx"
+
+
+class MappedNames():
+    """Names of a saved index, decoded on access."""
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, entry):
+        return bytes(self.blob[self.offsets[entry]:self.offsets[entry + 1]]
+                     ).decode("utf-8", "surrogatepass")
+
+
+class SearchIndex():
+    """Flat name table with parent pointers and trigram postings."""
+    def __init__(self, names, parents, kinds, postings):
+        self.names = names
+        self.parents = parents
+        self.kinds = kinds
+        self._postings = postings
+        self._all_names = names if isinstance(names, list) else None
+        self.filename = None  # Set for saved indices
+
+    @classmethod
+    def build(cls, traverser):
+        """Index every name below the top level of a traverser."""
+        names = []
+        parents = array.array("i")
+        kinds = bytearray()
+        postings = {}
+
+        def add(name, parent, kind):
+            """Append an entry, return its number."""
+            entry = len(names)
+            names.append(name)
+            parents.append(parent)
+            kinds.append(kind)
+            for key in trigram_keys(fold(name)):
+                try:
+                    postings[key].append(entry)
+                except KeyError:
+                    postings[key] = array.array("I", [entry])
+            return entry
+
+        stack = [(-1, traverser.data)]
+        while stack:
+            parent, structure = stack.pop()
+            for name in traverser.files_of(structure):
+                add(name, parent, FILE)
+            children = [(add(name, parent, FOLDER), child)
+                        for name, child in traverser.children(structure)]
+            stack.extend(reversed(children))
+        return cls(names, parents, kinds, postings)
+
+    def postings(self, key):
+        """Sorted entries containing the trigram with the given key."""
+        if isinstance(self._postings, dict):
+            return self._postings.get(key, ())
+        keys, offsets, entries = self._postings
+        position = bisect.bisect_left(keys, key)
+        if position == len(keys) or keys[position] != key:
+            return ()
+        return entries[offsets[position]:offsets[position + 1]]
+
+    def candidates(self, pattern):
+        """Entries which may match pattern, None if all of them may."""
+        keys = set()
+        for literal in required_literals(pattern):
+            keys |= trigram_keys(fold(literal))
+        if not keys:
+            return None
+        lists = sorted((self.postings(key) for key in keys), key=len)
+        result = lists[0]
+        for other in lists[1:]:
+            if len(other) > 32 * len(result):  # Look the few up
+                kept = []
+                for entry in result:
+                    position = bisect.bisect_left(other, entry)
+                    if position < len(other) and other[position] == entry:
+                        kept.append(entry)
+                result = kept
+            else:
+                result = sorted(set(result).intersection(other))
+        return result
+
+    def name_list(self):
+        """All names as list. Decoded once for saved indices, which is worth
+        it when a search has to look at a large part of them."""
+        if self._all_names is None:
+            self._all_names = [self.names[entry]
+                               for entry in range(len(self.names))]
+        return self._all_names
+
+    def path(self, entry, names=None):
+        """Path of an entry, starting with the name of the root folder."""
+        if names is None:
+            names = self.names
+        parts = []
+        while entry != -1:
+            parts.append(names[entry])
+            entry = self.parents[entry]
+        return os.path.join(*reversed(parts))
+
+    def matching_entries(self, searchstring, files=True, folders=True,
+                         start=0, end=None):
+        """Entries from start to end whose name matches searchstring."""
+        regex = re.compile(searchstring, re.IGNORECASE)
+        wanted = (files, folders)
+        whole = start == 0 and end is None
+        if end is None:
+            end = len(self.names)
+        candidates = self.candidates(searchstring)
+        if candidates is None:  # Nothing to narrow down by, check all names
+            candidates = range(start, end)
+        elif not whole:
+            candidates = candidates[bisect.bisect_left(candidates, start):
+                                    bisect.bisect_left(candidates, end)]
+        names = self.names
+        if whole and len(candidates) > len(self.names) // 16:
+            names = self.name_list()
+        for entry in candidates:
+            if wanted[self.kinds[entry]] and regex.search(names[entry]):
+                yield entry
+
+    def search(self, searchstring, files=True, folders=True):
+        """Paths of all files and folders whose name matches searchstring."""
+        names = self._all_names or self.names
+        for entry in self.matching_entries(searchstring, files, folders):
+            yield self.path(entry, names)
+
+    def save(self, filename, source=None):
+        """Write the index. Given the snapshot file, its size and time are
+        recorded, so that a changed snapshot is detected on load. The index
+        is written to a temporary file first, an interrupted save leaves no
+        partial index behind."""
+        size = mtime = 0
+        if source is not None:
+            stats = os.stat(source)
+            size, mtime = stats.st_size, stats.st_mtime_ns
+        keys = array.array("I", sorted(self._postings))
+        offsets = array.array("Q", [0])
+        for key in keys:
+            offsets.append(offsets[-1] + len(self._postings[key]))
+        name_offsets = array.array("Q", [0])
+        temporary = filename + ".tmp"
+        try:
+            self._write(temporary, keys, offsets, name_offsets, size, mtime)
+            os.replace(temporary, filename)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temporary)
+            raise
+
+    def _write(self, filename, keys, offsets, name_offsets, size, mtime):
+        """Write the sections of the index to a file."""
+        with open(filename, "wb") as file:
+            file.write(HEADER.pack(MAGIC, len(self.names), len(keys),
+                                   offsets[-1], 0, size, mtime))
+            blob = bytearray()
+            for name in self.names:
+                blob.extend(name.encode("utf-8", "surrogatepass"))
+                name_offsets.append(len(blob))
+            for section in (name_offsets, array.array("i", self.parents),
+                            self.kinds, keys, offsets):
+                file.write(section)
+                file.write(bytes(-file.tell() % 8))
+            for key in keys:
+                file.write(self._postings[key])
+            file.write(bytes(-file.tell() % 8))
+            file.write(blob)
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, len(self.names), len(keys),
+                                   offsets[-1], len(blob), size, mtime))
+
+    @classmethod
+    def load(cls, filename, source=None):
+        """Map a saved index. None if it is missing or damaged, or if the
+        snapshot file given as source changed since the index was saved."""
+        try:
+            with open(filename, "rb") as file:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        try:
+            magic, entries, keys_n, postings_n, blob_n, size, mtime = \
+                HEADER.unpack_from(buffer, 0)
+        except struct.error:  # Shorter than the header
+            buffer.close()
+            return None
+        if magic != MAGIC:
+            buffer.close()
+            return None
+        if source is not None:
+            stats = os.stat(source)
+            if (stats.st_size, stats.st_mtime_ns) != (size, mtime):
+                buffer.close()
+                return None
+        layout = []
+        position = HEADER.size  # Sections start at multiples of 8
+        for length, code, itemsize in (
+                (entries + 1, "Q", 8), (entries, "i", 4), (entries, "B", 1),
+                (keys_n, "I", 4), (keys_n + 1, "Q", 8),
+                (postings_n, "I", 4)):
+            layout.append((position, position + length * itemsize, code))
+            position += length * itemsize
+            position += -position % 8
+        if position + blob_n != len(buffer):  # Cut off or not an index
+            buffer.close()
+            return None
+        view = memoryview(buffer)
+        try:
+            sections = [view[start:end].cast(code)
+                        for start, end, code in layout]
+        except TypeError:
+            view.release()
+            buffer.close()
+            return None
+        name_offsets, parents, kinds, keys, offsets, postings = sections
+        names = MappedNames(name_offsets, view[position:])
+        index = cls(names, parents, kinds, (keys, offsets, postings))
+        index.filename = filename
+        return index
+
+
+_WORKER_INDEX = None
+
+
+def _load_worker_index(filename):
+    """Map the saved index once in each worker process."""
+    global _WORKER_INDEX  # pylint: disable=global-statement
+    _WORKER_INDEX = SearchIndex.load(filename)
+
+
+def _matching_entries(searchstring, files, folders, start, end):
+    """Search a part of the index in a worker process."""
+    return list(_WORKER_INDEX.matching_entries(searchstring, files, folders,
+                                               start, end))
+
+
+class ParallelSearch():
+    """Search a saved index on several processes.
+
+    The entries are split in one contiguous part per process. Every process
+    maps the index file itself, so nothing but the search string and the
+    matching entries is sent between processes. Results are merged in the
+    order of the index, the same order as SearchIndex.search."""
+    def __init__(self, index, jobs):
+        if index.filename is None:
+            raise ValueError("Parallel search needs a saved index")
+        self.index = index
+        self.jobs = jobs
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=_load_worker_index,
+            initargs=(index.filename,))
+
+    def search(self, searchstring, files=True, folders=True):
+        """Paths of all files and folders whose name matches searchstring."""
+        size = len(self.index.names)
+        bounds = [size * part // self.jobs for part in range(self.jobs + 1)]
+        futures = [self.pool.submit(_matching_entries, searchstring, files,
+                                    folders, start, end)
+                   for start, end in zip(bounds, bounds[1:])]
+        for future in futures:
+            for entry in future.result():
+                yield self.index.path(entry)
+
+    def close(self):
+        """Stop the worker processes."""
+        self.pool.shutdown()
+
+
+def open_index(snapshot_filename, traverser=None):
+    """Load the saved index of a snapshot, or build and save it.
+
+    If the index cannot be saved next to the snapshot, it is only kept in
+    memory."""
+    filename = index_filename(snapshot_filename)
+    with instrumentation.phase("load index"):
+        index = SearchIndex.load(filename, snapshot_filename)
+    if index is not None:
+        return index
+    if traverser is None:
+        traverser = open_traverser(snapshot_filename)
+    with instrumentation.phase("build index"):
+        index = SearchIndex.build(traverser)
+    try:
+        with instrumentation.phase("save index"):
+            index.save(filename, snapshot_filename)
+        index.filename = filename  # Worker processes can map it now
+    except OSError:
+        pass
+    return index
@@ -0,0 +1,160 @@
+"""Compare two snapshots of a drive.
+
+Reports files and folders which were added, removed, resized or modified
+between an old and a new snapshot; a folder is modified when its
+modification time changed, that is an entry was added, removed or renamed in
+it. Both trees are walked at the same time, the subfolders and files of each
+folder in sorted order, so that they can be matched like in a merge.
+JsonTraverser.walk goes through one snapshot only, so the merge takes the
+folders and files from the traverser accessors walk is built on. This is
+linear in the size of the snapshots, and besides the snapshots themselves
+only the folders of the current path are kept in memory. Changes are
+reported as soon as they are found; together with binary snapshots (see
+snapshot_format), even two huge snapshots can be compared with little
+memory.
+
+Usage: python snapshot_diff.py OLD NEW [--format text|jsonl] [--summary]"""
+
+import os
+import sys
+import json
+import argparse
+import operator
+import collections
+import collections.abc
+
+from traverser import open_traverser, sizeof_fmt
+
+ADDED = "added"
+REMOVED = "removed"
+RESIZED = "resized"
+MODIFIED = "modified"
+
+MISSING = object()
+BY_NAME = operator.itemgetter(0)
+
+
+def _roots(traverser):
+    """Children of the top level; the name of the root folder of a
+    snapshot depends on where the drive was mounted."""
+    return traverser.children(traverser.data)
+
+
+def _merge(old, new):
+    """Pair two lists of (name, value) sorted by name.
+    Yields name, old value, new value; a missing side is MISSING."""
+    old_index = new_index = 0
+    while old_index < len(old) or new_index < len(new):
+        if new_index == len(new) or (old_index < len(old) and
+                                     old[old_index][0] < new[new_index][0]):
+            yield old[old_index][0], old[old_index][1], MISSING
+            old_index += 1
+        elif old_index == len(old) or new[new_index][0] < old[old_index][0]:
+            yield new[new_index][0], MISSING, new[new_index][1]
+            new_index += 1
+        else:
+            yield old[old_index][0], old[old_index][1], new[new_index][1]
+            old_index += 1
+            new_index += 1
+
+
+def _file_items(files):
+    """Sorted (name, details) of a folder's files; details are None in
+    fast mode."""
+    if isinstance(files, collections.abc.Mapping):
+        return sorted(files.items(), key=BY_NAME)
+    return [(name, None) for name in sorted(files)]
+
+
+def _compare_file(old_details, new_details):
+    """Change of a file present in both snapshots, or None."""
+    if old_details is None or new_details is None:  # fast mode
+        return None
+    if old_details.get("size") != new_details.get("size"):
+        return RESIZED
+    if old_details.get("modified") != new_details.get("modified"):
+        return MODIFIED
+    return None
+
+
+def diff(old, new):
+    """Yield (change, kind, path, old details, new details) for every
+    difference between two traversers. kind is "file" or "folder", the
+    details are the file dicts of big mode or None; for a modified folder,
+    they hold its "modified" time."""
+    old_roots, new_roots = _roots(old), _roots(new)
+    if len(old_roots) == 1 and len(new_roots) == 1:
+        stack = [(new_roots[0][0], old_roots[0][1], new_roots[0][1])]
+    else:
+        stack = [("", old.data, new.data)]
+    while stack:
+        path, before, after = stack.pop()
+        if path:
+            old_modified = old.modified_of(before)
+            new_modified = new.modified_of(after)
+            if None not in (old_modified, new_modified) and \
+                    old_modified != new_modified:
+                yield (MODIFIED, "folder", path, {"modified": old_modified},
+                       {"modified": new_modified})
+        for name, old_details, new_details in _merge(
+                _file_items(old.files_of(before)),
+                _file_items(new.files_of(after))):
+            file_path = os.path.join(path, name)
+            if new_details is MISSING:
+                yield REMOVED, "file", file_path, old_details, None
+            elif old_details is MISSING:
+                yield ADDED, "file", file_path, None, new_details
+            else:
+                change = _compare_file(old_details, new_details)
+                if change:
+                    yield change, "file", file_path, old_details, new_details
+        subfolders = []
+        for name, old_child, new_child in _merge(
+                sorted(old.children(before), key=BY_NAME),
+                sorted(new.children(after), key=BY_NAME)):
+            folder_path = os.path.join(path, name)
+            if new_child is MISSING:
+                yield REMOVED, "folder", folder_path, None, None
+            elif old_child is MISSING:
+                yield ADDED, "folder", folder_path, None, None
+            else:
+                subfolders.append((folder_path, old_child, new_child))
+        stack.extend(reversed(subfolders))
+
+
+def format_change(change, kind, path, old_details, new_details):
+    """One readable line for a change."""
+    line = "{:8} {:6} {}".format(change, kind, path)
+    if change == RESIZED:
+        line += "  {} -> {}".format(sizeof_fmt(old_details["size"]),
+                                    sizeof_fmt(new_details["size"]))
+    return line
+
+
+def main():
+    """Print the differences of two snapshot files."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("old", help="Older snapshot, json or binary")
+    parser.add_argument("new", help="Newer snapshot, json or binary")
+    parser.add_argument("--format", choices=["text", "jsonl"],
+                        default="text", help="One readable line or one json "
+                        "object per change")
+    parser.add_argument("--summary", action="store_true",
+                        help="Print the number of changes at the end")
+    arguments = parser.parse_args()
+    counts = collections.Counter()
+    old, new = open_traverser(arguments.old), open_traverser(arguments.new)
+    for change in diff(old, new):
+        counts[change[0], change[1]] += 1
+        if arguments.format == "jsonl":
+            print(json.dumps(dict(zip(
+                ("change", "kind", "path", "old", "new"), change))))
+        else:
+            print(format_change(*change))
+    if arguments.summary:
+        for (change, kind), number in sorted(counts.items()):
+            print("{} {} {}".format(number, kind, change), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+"""Compact binary snapshot format.
+
+A snapshot file as written by folder_structure_backup can be converted to
+this format, which can be opened without parsing: the file is memory mapped
+and only the folder which is looked at gets decoded.
+
+Layout (little endian):
+    header        magic, version, flags, counts and section offsets
+    file records  name, and in big mode size, modified, created, accessed
+    folder table  name, parent, first subfolder, subfolder count, first file,
+                  file count, modification time. Folders are stored breadth
+                  first, so the subfolders of a folder follow each other.
+    totals        per folder: count of all folders and files below it and
+                  their total size
+    string table  offsets into the string blob, one more than strings
+    string blob   utf-8 encoded names, each name is stored once
+    hashes        if flagged: content hash of every file (see content_hash),
+                  zero bytes for files without one
+    errors        if flagged, up to the end of the file: json object of
+                  folder index to the "__/errors" of the folder, the files
+                  and subfolders which could not be read
+
+Calling this module directly converts json to binary or the other way round,
+depending on the type of the source file. Json may be compressed."""
+
+import json
+import math
+import mmap
+import array
+import struct
+import argparse
+import collections
+import collections.abc
+
+import file_table
+import compression
+import content_hash
+
+MAGIC = b"FSNAPBIN"
+VERSION = 3
+BIG = 1  # flag: file records contain size and dates
+HASHES = 2  # flag: there is a section of file hashes
+ERRORS = 4  # flag: there is a section of read errors
+
+HEADER = struct.Struct("<8sIIQQQQQQQQQ")
+FOLDER = struct.Struct("<IIIIQId")
+TOTALS = struct.Struct("<QQQ")
+BIG_FILE = struct.Struct("<IQddd")
+FAST_FILE = struct.Struct("<I")
+OFFSET = struct.Struct("<Q")
+NO_PARENT = 0xFFFFFFFF
+NO_HASH = bytes(content_hash.DIGEST_SIZE)
+
+Folder = collections.namedtuple(
+    "Folder", "name parent first_child children first_file files modified")
+
+
+def is_binary(filename):
+    """Does the file start with the magic of this format?"""
+    with open(filename, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def encode(name):
+    """Names from the file system may contain lone surrogates."""
+    return name.encode("utf-8", "surrogatepass")
+
+
+def decode(raw):
+    """Reverse of encode."""
+    return raw.decode("utf-8", "surrogatepass")
+
+
+def is_big(data):
+    """Are there file details in the structure? Checks the first folder."""
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if "__/files" in node:
+            return isinstance(node["__/files"], collections.abc.Mapping)
+        stack.extend(value for key, value in node.items()
+                     if not key.startswith("__/"))
+    return True
+
+
+def write_binary(data, filename):
+    """Write a structure dictionary as binary snapshot."""
+    big = is_big(data)
+    strings = {}
+    string_offsets = bytearray(OFFSET.pack(0))
+    blob = bytearray()
+    hashes = bytearray()
+    hashed = False
+    errors = {}
+    folders = bytearray()
+    parents = array.array("Q")
+    totals = [array.array("Q"), array.array("Q"), array.array("Q")]
+
+    def string_id(name):
+        """Add a name to the string table once."""
+        try:
+            return strings[name]
+        except KeyError:
+            blob.extend(encode(name))
+            string_offsets.extend(OFFSET.pack(len(blob)))
+            strings[name] = len(strings)
+            return strings[name]
+
+    with open(filename, "wb") as file:
+        file.write(bytes(HEADER.size))
+        files_offset = file.tell()
+        files_n = 0
+        next_index = 1
+        queue = collections.deque([("", data, NO_PARENT)])
+        index = 0
+        while queue:
+            name, node, parent = queue.popleft()
+            subfolders = [key for key in node if not key.startswith("__/")]
+            files = node.get("__/files", {})
+            size = file_table.total_size(files) if big else 0
+            if big:
+                for file_name, details in files.items():
+                    file.write(BIG_FILE.pack(
+                        string_id(file_name), details.get("size", 0) or 0,
+                        details.get("modified", 0) or 0,
+                        details.get("created", 0) or 0,
+                        details.get("accessed", 0) or 0))
+                    digest = details.get("hash")
+                    if digest and len(digest) == 2 * len(NO_HASH):
+                        hashes.extend(bytes.fromhex(digest))
+                        hashed = True
+                    else:
+                        hashes.extend(NO_HASH)
+            else:
+                for file_name in files:
+                    file.write(FAST_FILE.pack(string_id(file_name)))
+            folders.extend(FOLDER.pack(
+                string_id(name), parent, next_index, len(subfolders),
+                files_n, len(files), node.get("__/modified", math.nan)))
+            files_n += len(files)
+            if node.get("__/errors"):
+                errors[index] = node["__/errors"]
+            parents.append(parent if index else 0)
+            totals[0].append(len(subfolders))
+            totals[1].append(len(files))
+            totals[2].append(size)
+            for subfolder in subfolders:
+                queue.append((subfolder, node[subfolder], index))
+            next_index += len(subfolders)
+            index += 1
+        folders_offset = file.tell()
+        file.write(folders)
+        # Breadth first: every folder comes after its parent
+        for child in range(index - 1, 0, -1):
+            for column in totals:
+                column[parents[child]] += column[child]
+        totals_offset = file.tell()
+        for row in zip(*totals):
+            file.write(TOTALS.pack(*row))
+        strings_offset = file.tell()
+        file.write(string_offsets)
+        blob_offset = file.tell()
+        file.write(blob)
+        hashes_offset = file.tell()
+        if hashed:
+            file.write(hashes)
+        if errors:
+            file.write(json.dumps(errors).encode("utf-8", "surrogatepass"))
+        file.seek(0)
+        file.write(HEADER.pack(
+            MAGIC, VERSION, (BIG if big else 0) | (HASHES if hashed else 0) |
+            (ERRORS if errors else 0),
+            index, files_n, len(strings), folders_offset, files_offset,
+            totals_offset, strings_offset, blob_offset, hashes_offset))
+
+
+class BinarySnapshot():
+    """Memory mapped binary snapshot. Folder 0 is the top level."""
+    def __init__(self, filename):
+        with open(filename, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, flags, self.folders_n, self.files_n, self.strings_n,
+         self._folders, self._files, self._totals, self._strings,
+         self._blob, self._hashes) = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            self.buffer.close()
+            raise ValueError("Not a binary snapshot: {}".format(filename))
+        if version != VERSION:
+            self.buffer.close()
+            raise ValueError("Unsupported version {} of {}, convert it again "
+                             "from json".format(version, filename))
+        self.big = bool(flags & BIG)
+        self.hashed = bool(flags & HASHES)
+        self._file = BIG_FILE if self.big else FAST_FILE
+        self._errors = {} if not flags & ERRORS else None
+
+    def close(self):
+        """Release the mapping."""
+        self.buffer.close()
+
+    def string(self, string_id):
+        """Decode a name of the string table."""
+        start, end = struct.unpack_from(
+            "<QQ", self.buffer, self._strings + string_id * OFFSET.size)
+        return decode(self.buffer[self._blob + start:self._blob + end])
+
+    def folder(self, index):
+        """Folder record by index."""
+        return Folder._make(FOLDER.unpack_from(
+            self.buffer, self._folders + index * FOLDER.size))
+
+    def totals(self, index):
+        """Count of all folders and files below a folder and their size."""
+        return TOTALS.unpack_from(self.buffer,
+                                  self._totals + index * TOTALS.size)
+
+    def subfolders(self, index):
+        """Names and indices of the subfolders of a folder."""
+        folder = self.folder(index)
+        result = {}
+        for child in range(folder.first_child,
+                           folder.first_child + folder.children):
+            result[self.string(self.folder(child).name)] = child
+        return result
+
+    def files(self, index):
+        """Files of a folder, a list in fast mode, else name to details.
+        The root holding the top folders has no files of its own, it gets
+        an empty mapping in both modes like when walking json."""
+        folder = self.folder(index)
+        if not index and not folder.files:
+            return {}
+        start = self._files + folder.first_file * self._file.size
+        records = self._file.iter_unpack(self.buffer[
+            start:start + folder.files * self._file.size])
+        if not self.big:
+            return [self.string(record[0]) for record in records]
+        files = {self.string(name): {"size": size, "modified": modified,
+                                     "created": created, "accessed": accessed}
+                 for name, size, modified, created, accessed in records}
+        if self.hashed:
+            start = self._hashes + folder.first_file * len(NO_HASH)
+            for number, details in enumerate(files.values()):
+                digest = self.buffer[start + number * len(NO_HASH):
+                                     start + (number + 1) * len(NO_HASH)]
+                if digest != NO_HASH:
+                    details["hash"] = digest.hex()
+        return files
+
+    def errors(self, index):
+        """Files and subfolders of a folder which could not be read: name
+        to error. The section is decoded on first use."""
+        if self._errors is None:
+            start = self._hashes
+            if self.hashed:
+                start += self.files_n * len(NO_HASH)
+            self._errors = {
+                int(key): value for key, value in json.loads(
+                    self.buffer[start:].decode("utf-8", "surrogatepass"))
+                .items()}
+        return self._errors.get(index, {})
+
+    def to_dict(self):
+        """Decode the whole snapshot into a structure dictionary."""
+        data = {}
+        queue = collections.deque([(0, data)])
+        while queue:
+            index, node = queue.popleft()
+            folder = self.folder(index)
+            if folder.files or index:
+                node["__/files"] = self.files(index)
+            if not math.isnan(folder.modified):
+                node["__/modified"] = folder.modified
+            for name, child in self.subfolders(index).items():
+                node[name] = {}
+                queue.append((child, node[name]))
+            errors = self.errors(index)
+            if errors:  # Last, like folder_structure_backup sets them
+                node["__/errors"] = errors
+        return data
+
+    def write_json(self, file):
+        """Write the snapshot as json, one folder at a time."""
+        stack = []
+
+        def open_folder(index, top):
+            """Write the files of a folder and remember its subfolders."""
+            folder = self.folder(index)
+            file.write("{")
+            written = False
+            if folder.files or not top:
+                file.write('"__/files": ' + json.dumps(self.files(index)))
+                written = True
+            if not math.isnan(folder.modified):
+                file.write((", " if written else "") + '"__/modified": ' +
+                           json.dumps(folder.modified))
+                written = True
+            stack.append([folder.first_child,
+                          folder.first_child + folder.children, written,
+                          index])
+
+        open_folder(0, True)
+        while stack:
+            frame = stack[-1]
+            if frame[0] == frame[1]:
+                errors = self.errors(frame[3])
+                if errors:
+                    file.write((", " if frame[2] else "") +
+                               '"__/errors": ' + json.dumps(errors))
+                file.write("}")
+                stack.pop()
+                continue
+            index = frame[0]
+            frame[0] += 1
+            name = self.string(self.folder(index).name)
+            file.write((", " if frame[2] else "") + json.dumps(name) + ": ")
+            frame[2] = True
+            open_folder(index, False)
+
+
+def read_dict(filename):
+    """Structure dictionary of a binary snapshot file."""
+    snapshot = BinarySnapshot(filename)
+    try:
+        return snapshot.to_dict()
+    finally:
+        snapshot.close()
+
+
+def convert(source, target):
+    """Convert json to binary or binary to json, depending on the source."""
+    if is_binary(source):
+        snapshot = BinarySnapshot(source)
+        try:
+            with compression.open_snapshot(target, "w") as file:
+                snapshot.write_json(file)
+        finally:
+            snapshot.close()
+    else:
+        with compression.open_snapshot(source, "r") as file:
+            data = file_table.load_json(file)
+        write_binary(data, target)
+
+
+def main():
+    """Convert between json and binary snapshots."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="Snapshot to convert, json or binary")
+    parser.add_argument("target", help="Output file name")
+    arguments = parser.parse_args()
+    convert(arguments.source, arguments.target)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Tests of the catalog against the query language."""
+
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import query  # noqa: E402
+from catalog import Catalog  # noqa: E402
+from traverser import JsonTraverser  # noqa: E402
+
+NAMES = ["ıkon.TXT", "İNFO.txt", "Kelvin.dat", "ſub.dat",
+         "Äpfel.DAT", ".bashrc", "a.tar.gz", "B.TAR.GZ", "ä.ÄÖ",
+         "plain.iso", "Kiss.iso"]
+QUERIES = ["kelvin", "^kel", "info", "^ikon", "sub", "^s", "äpfel",
+           "ext:bashrc", "ext:tar.gz", "ext:gz", "ext:äö", "ext:iso",
+           r"^k.*\.iso$", "ext:dat"]
+
+
+class TestSameAsQuery(unittest.TestCase):
+    """The catalog finds what query.Query finds in the snapshot."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.data = {"drive": {"__/files": {
+            name: {"size": 1, "modified": 0, "created": 0, "accessed": 0}
+            for name in NAMES}}}
+        snapshot = os.path.join(tmp.name, "snapshot.json")
+        with open(snapshot, "w") as file:
+            json.dump(self.data, file)
+        self.catalog = Catalog(os.path.join(tmp.name, "catalog.db"))
+        self.addCleanup(self.catalog.close)
+        self.catalog.import_snapshot(snapshot)
+
+    def test_names_and_extensions(self):
+        traverser = JsonTraverser(self.data)
+        for text in QUERIES:
+            with self.subTest(text):
+                expected = sorted(
+                    path for path, _ in query.Query(text).run(traverser))
+                found = sorted(path for _, path, _ in
+                               self.catalog.query(text))
+                self.assertTrue(expected)
+                self.assertEqual(found, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+"""Tests of the query language."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import query  # noqa: E402
+from traverser import JsonTraverser  # noqa: E402
+
+
+def names(text, files):
+    """Paths of the matches of a query in a folder of files."""
+    traverser = JsonTraverser({"root": {"__/files": files}})
+    return sorted(path for path, _ in query.Query(text).run(traverser))
+
+
+class TestBackslashes(unittest.TestCase):
+    """Backslashes reach the regular expressions unchanged."""
+
+    def test_escaped_dot(self):
+        self.assertEqual(query.Query(r"\.iso$").expressions, [r"\.iso$"])
+        self.assertEqual(names(r"\.iso$", ["a.iso", "aXiso"]),
+                         [os.path.join("root", "a.iso")])
+
+    def test_digit_class(self):
+        self.assertEqual(query.Query(r"name:\d+").expressions, [r"\d+"])
+        self.assertEqual(names(r"name:^\d+$", ["123", "d", "dd"]),
+                         [os.path.join("root", "123")])
+        self.assertEqual(names(r"f\d", ["f1", "fd"]),
+                         [os.path.join("root", "f1")])
+
+    def test_quotes_still_group(self):
+        self.assertEqual(query.Query(r'"a \d" ext:txt').expressions,
+                         [r"a \d"])
+        with self.assertRaises(query.QueryError):
+            query.Query('"unclosed')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+"""Tests of files which cannot be read while scanning."""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import query  # noqa: E402
+import verify_backup  # noqa: E402
+import folder_structure_backup  # noqa: E402
+from traverser import JsonTraverser  # noqa: E402
+
+
+class TestBrokenSymlink(unittest.TestCase):
+    """A broken symlink cannot be stat'ed, like a file on a failing
+    drive."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.drive = os.path.join(self.tmp.name, "drive")
+        os.mkdir(self.drive)
+        with open(os.path.join(self.drive, "good.txt"), "w") as file:
+            file.write("good")
+        os.symlink(os.path.join(self.tmp.name, "nowhere"),
+                   os.path.join(self.drive, "broken.txt"))
+        self.data = folder_structure_backup.scan_path(self.drive, "big")
+        self.traverser = JsonTraverser(self.data)
+
+    def test_kept_with_error(self):
+        node = self.data["drive"]
+        self.assertEqual(sorted(node["__/files"]), ["broken.txt", "good.txt"])
+        self.assertEqual(node["__/files"]["broken.txt"]["size"], 0)
+        self.assertIn("broken.txt", node["__/errors"])
+        self.traverser.down("drive")
+        self.assertIsNotNone(self.traverser.file_error("broken.txt"))
+        self.assertIsNone(self.traverser.file_error("good.txt"))
+
+    def test_found_by_queries(self):
+        found = [path for path, _ in
+                 query.Query(r"\.txt$").run(self.traverser)]
+        self.assertIn(os.path.join("drive", "broken.txt"), found)
+
+    def test_verify_checks_presence_only(self):
+        backup = os.path.join(self.tmp.name, "backup")
+        os.mkdir(backup)
+        for name in ("good.txt", "broken.txt"):  # Copied when readable
+            with open(os.path.join(backup, name), "w") as file:
+                file.write("good")
+        os.utime(os.path.join(backup, "good.txt"), (
+            os.path.getatime(os.path.join(self.drive, "good.txt")),
+            os.path.getmtime(os.path.join(self.drive, "good.txt"))))
+        index = verify_backup.build_index(self.traverser)
+        results = list(verify_backup.verify(index, backup, workers=1))
+        self.assertEqual(results, [("", [], 2)])
+        os.remove(os.path.join(backup, "broken.txt"))
+        results = list(verify_backup.verify(index, backup, workers=1))
+        self.assertEqual([problem[:2] for problem in results[0][1]],
+                         [(verify_backup.MISSING, "broken.txt")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,10 +2,20 @@
 
 
 import os
+import re
+import heapq
 import datetime
 import json
+import math
+import itertools
+import collections
 import unicodedata
 
+import file_table
+import compression
+import instrumentation
+import snapshot_format
+
 FOLDER = unicodedata.lookup("FILE FOLDER")
 FILE = unicodedata.lookup("PAGE FACING UP")
 
@@ -19,55 +29,111 @@ def sizeof_fmt(num, suffix='B'):
     return "%.1f%s%s" % (num, 'Yi', suffix)
 
 
+def is_reserved(key):
+    """Keys like "__/files" hold information about a folder, not subfolders.
+
+    A "/" cannot be part of a file name, so these never collide."""
+    return key.startswith("__/")
+
+
 class OutOfStructureException(Exception):
     """Raise this if beyond boundaries of Structure."""
 
 
+class NiceContent():
+    """Sequence of sorted folder and file names with indicator Emoji, the
+    Emoji is only added to the entries which are accessed."""
+    def __init__(self, folders, files, head=()):
+        self.head = list(head)
+        self.folders = folders
+        self.files = files
+
+    def __len__(self):
+        return len(self.head) + len(self.folders) + len(self.files)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        if index < len(self.head):
+            return self.head[index]
+        index -= len(self.head)
+        if index < len(self.folders):
+            return FOLDER + " " + self.folders[index]
+        return FILE + " " + self.files[index - len(self.folders)]
+
+
 class JsonTraverser():
     """Navigate through the object."""
     def __init__(self, data=False, jsonfile=False):
-        if data:
+        if data or isinstance(data, dict):
             self.data = data
         elif jsonfile:
-            with open(jsonfile, "r") as file:
-                self.data = json.load(file)
-        elif not data and not json:
+            with instrumentation.phase("parse json"), \
+                    compression.open_snapshot(jsonfile, "r") as file:
+                self.data = file_table.load_json(file)
+        else:
             raise ValueError("No data given")
+        self._start()
+
+    def _start(self):
+        """Start navigating at the top of self.data."""
         # self.position = list(data.keys())
         self.position = []
         self.current = self.data
         self._base = self.position[:]
+        self._parents = []
+        self._paths = [""]
+        self._totals = None
+        self._sorted = collections.OrderedDict()
         # pprint(self.position)
 
+    def refresh(self, totals=True):
+        """Forget sorted listings, and totals if asked to, after self.data
+        was changed. The position stays the same."""
+        self._sorted.clear()
+        if totals:
+            self._totals = None
+
     def up(self):  # pylint: disable=invalid-name
         """Go to the parent directory."""
-        if not self.position:
-            raise OutOfStructureException
-        self.position.pop()
-        current = self.data
-        for folder in self.position:
-            current = current[folder]
-        self.current = current
+        self._ascend()
         return self
 
     def down(self, name):
         """Go to the specified child directory."""
         name = self.clear_name(name)
         try:
-            self.current = self.current[name]
-            self.position.append(name)
-            return self
+            structure = self.current[name]
         except KeyError as exc:
             raise OutOfStructureException from exc
+        self._descend(name, structure)
+        return self
+
+    def _descend(self, name, structure):
+        """Make structure, the subfolder name of the current folder, the
+        current one. Parents and paths are kept on stacks, so moving around
+        does not depend on the depth."""
+        sanitized = name.replace(os.sep, "")
+        if self.position:
+            sanitized = self._paths[-1] + os.sep + sanitized
+        self._paths.append(sanitized)
+        self._parents.append(self.current)
+        self.position.append(name)
+        self.current = structure
+
+    def _ascend(self):
+        """Make the parent folder the current one."""
+        if not self.position:
+            raise OutOfStructureException
+        self.position.pop()
+        self._paths.pop()
+        self.current = self._parents.pop()
 
     def folders(self):
         """Get the folders in the current folder."""
-        folders = list(self.current.keys())
-        try:
-            folders.remove("__/files")
-        except ValueError:
-            pass  # Root dir
-        return folders
+        return [key for key in self.current if not is_reserved(key)]
 
     def files(self):
         """Get the files in the current folder."""
@@ -79,9 +145,69 @@ class JsonTraverser():
 
     def content_nice(self):
         """Folder content with indictor Emoji."""
+        return list(self.content_nice_view())
+
+    def content_nice_view(self, head=(), by_size=False):
+        """Folder content with indictor Emoji as lazy sequence, after the
+        entries of head."""
+        return NiceContent(*self.sorted_content(by_size), head=head)
 
-        return (sorted([FOLDER + " " + folder for folder in self.folders()]) +
-                sorted([FILE + " " + file for file in self.files()]))
+    def sorted_content(self, by_size=False):
+        """Sorted folder and file names of the current folder, by name or
+        largest first. Every folder is only sorted once, the last few results
+        are kept."""
+        key = self._key(self.current), by_size
+        try:
+            self._sorted.move_to_end(key)
+            return self._sorted[key]
+        except KeyError:
+            if by_size:
+                result = self._sorted_by_size()
+            else:
+                result = sorted(self.folders()), sorted(self.files())
+            self._sorted[key] = result
+            if len(self._sorted) > 32:
+                self._sorted.popitem(last=False)
+            return result
+
+    def _sorted_by_size(self):
+        """Folder and file names of the current folder, largest first."""
+        folders = [name for name, _ in self.folders_by_size()]
+        files = self.files()
+        if isinstance(files, file_table.FileTable):
+            sizes = zip(files.names, files.sizes)
+        elif isinstance(files, dict):
+            sizes = ((name, details.get("size", 0) or 0)
+                     for name, details in files.items())
+        else:
+            sizes = zip(files, itertools.repeat(0))
+        return folders, [name for name, _ in sorted(
+            sizes, key=lambda item: (-item[1], item[0]))]
+
+    def folders_by_size(self):
+        """Subfolders of the current folder with their totals (see totals),
+        largest first."""
+        result = [(name, self.totals(self._subfolder(name)))
+                  for name in self.folders()]
+        result.sort(key=lambda item: (-item[1][2], item[0]))
+        return result
+
+    def largest_folders(self, count):
+        """The count folders below the current one with the largest total
+        size, at any depth, largest first: (size, folders, files, path
+        below the current folder as tuple of names). The totals are
+        computed once, only count folders are kept at a time."""
+        def below():
+            """Totals and paths of all folders below the current one."""
+            stack = [((name,), child)
+                     for name, child in self.children(self.current)]
+            while stack:
+                path, structure = stack.pop()
+                folders_n, files_n, size = self.totals(structure)
+                yield size, folders_n, files_n, path
+                stack.extend((path + (name,), child)
+                             for name, child in self.children(structure))
+        return heapq.nlargest(count, below(), key=lambda item: item[0])
 
     def current_folder_info(self):
         """Return how many folders and how many files in the current folder."""
@@ -90,26 +216,45 @@ class JsonTraverser():
     def current_path(self):
         """Get the path of the current position."""
         # print(self.position)
-        return os.sep.join([i.replace(os.sep, "") for i in self.position])
+        return self._paths[-1]
 
     def subdir_info(self, name, current_directory=False):
         """Count subfolders and files."""
         name = self.clear_name(name)
-        folders_n = files_n = size = 0
         if current_directory:
             structure = self.current
         else:
-            structure = self.current[name]
-        for _, files in self.walk(structure):
-            folders_n += 1
-            files_n += len(files)
-            try:
-                size += sum([file.get("size", 0) for file in files.values()])
-            except AttributeError:
-                pass
-        folders_n -= 1  # remove self
-        size = sizeof_fmt(size)
-        return folders_n, files_n, size
+            structure = self._subfolder(name)
+        folders_n, files_n, size = self.totals(structure)
+        return folders_n, files_n, sizeof_fmt(size)
+
+    def totals(self, structure):
+        """Count of all folders and files below structure and their size.
+
+        Computed for the whole data in one pass on first use."""
+        if self._totals is None:
+            self._totals = self._aggregate()
+        return self._totals[id(structure)]
+
+    def _aggregate(self):
+        """Totals of every folder in one bottom up walk: the totals of the
+        subfolders of a folder are the last ones on the stack then."""
+        totals = {}
+        done = []
+        for folders, files, structure in self._walk(self.data, None, False,
+                                                    nodes=True):
+            count = folders_n = len(folders)
+            files_n = len(files)
+            size = file_table.total_size(files)
+            if count:
+                for sub_folders_n, sub_files_n, sub_size in done[-count:]:
+                    folders_n += sub_folders_n
+                    files_n += sub_files_n
+                    size += sub_size
+                del done[-count:]
+            total = totals[id(structure)] = (folders_n, files_n, size)
+            done.append(total)
+        return totals
 
     def file_info(self, name):
         """Get information about a file."""
@@ -119,7 +264,7 @@ class JsonTraverser():
                 timestamp).strftime('%Y-%m-%d %H:%M:%S')
         name = self.clear_name(name)
         try:
-            file = self.current["__/files"][name]
+            file = self.files()[name]
         except TypeError:
             return None, None, None, None
         size = sizeof_fmt(file.get("size"))
@@ -128,21 +273,86 @@ class JsonTraverser():
         created = timeformat(file.get("created"))
         return (size, created, modified, accessed)
 
-    # @staticmethod
-    def walk(self, structure):
-        """Recursively walk the structure."""
-        try:
-            files = structure.get("__/files", {})
-        except AttributeError:  # root element is list
-            files = {}
-        folders = list(structure.keys())
-        if "__/files" in folders:
-            folders.remove("__/files")
-        yield folders, files
-        if folders is None:
-            folders = []
-        for folder in folders:
-            yield from self.walk(structure[folder])
+    def walk(self, structure=None, path=None, topdown=True, nodes=False):
+        """Walk a structure (default: all data) and everything below it.
+
+        Yields (folders, files) for every folder, or (path, folders, files)
+        like os.walk if a path for the structure is given ("" for paths
+        relative to it); with nodes, the structure of the folder comes last.
+        Top down, folders can be removed from the list to skip them; bottom
+        up, a folder comes after everything below it. The walk keeps an
+        explicit stack, so there is no limit on the depth."""
+        if structure is None:
+            structure = self.data
+        return self._walk(structure, path, topdown, nodes)
+
+    def _walk(self, structure, path, topdown, nodes=False):
+        """walk, yielding the structure of every folder last with nodes.
+
+        Bottom up, the item of a folder waits on the stack of structures
+        until everything below it is done."""
+        listing = self._listing
+        with_path = path is not None
+        structures = [structure]
+        paths = [path]
+        while structures:
+            structure = structures.pop()
+            if with_path:
+                path = paths.pop()
+            if structure.__class__ is tuple:
+                yield structure
+                continue
+            folders, files, lookup = listing(structure)
+            item = (path, folders, files) if with_path else (folders, files)
+            if nodes:
+                item += (structure,)
+            if topdown:
+                yield item
+            else:
+                structures.append(item)
+                paths.append(path)
+            if folders:
+                structures.extend(map(lookup.__getitem__, reversed(folders)))
+                if with_path:
+                    prefix = os.path.join(path, "")
+                    paths.extend([prefix + name for name in reversed(folders)])
+
+    @staticmethod
+    def _listing(structure):
+        """Subfolder names, files and a mapping of name to subfolder."""
+        return ([key for key in structure if not is_reserved(key)],
+                structure.get("__/files", {}), structure)
+
+    def _subfolder(self, name):
+        """Structure of a subfolder of the current folder."""
+        return self.current[name]
+
+    @staticmethod
+    def children(structure):
+        """Names and structures of the subfolders of a structure."""
+        return [(key, value) for key, value in structure.items()
+                if not is_reserved(key)]
+
+    @staticmethod
+    def files_of(structure):
+        """Files of a structure, a list in fast mode, else name to details."""
+        return structure.get("__/files", [])
+
+    @staticmethod
+    def modified_of(structure):
+        """Modification time of a folder, None if it is not recorded."""
+        return structure.get("__/modified")
+
+    @staticmethod
+    def errors_of(structure):
+        """Files and subfolders of a structure which could not be read:
+        name to error."""
+        return structure.get("__/errors", {})
+
+    def file_error(self, name):
+        """Error of reading a file of the current folder, None if it was
+        read."""
+        return self.errors_of(self.current).get(self.clear_name(name))
 
     @staticmethod
     def clear_name(name):
@@ -153,4 +363,183 @@ class JsonTraverser():
 
     def is_folder(self, name):
         """Is given name a folder?"""
-        return self.clear_name(name) in self.folders() or name == ".."
+        return name == ".." or self._has_folder(self.clear_name(name))
+
+    def _has_folder(self, name):
+        """Is name a subfolder of the current folder?"""
+        return name in self.current and not is_reserved(name)
+
+    @staticmethod
+    def _key(structure):
+        """Hashable identity of a structure."""
+        return id(structure)
+
+
+class MappedTraverser(JsonTraverser):
+    """Navigate through a binary snapshot without loading it.
+
+    The structures are folder indices of the snapshot_format file. Only the
+    current folder gets decoded, and only when it is looked at."""
+    def __init__(self, filename):  # pylint: disable=super-init-not-called
+        with instrumentation.phase("open binary"):
+            self.snapshot = snapshot_format.BinarySnapshot(filename)
+        self.data = 0
+        self._start()
+        self._subfolders = self._files = None
+
+    def totals(self, structure):
+        """Count of all folders and files below structure and their size,
+        as stored in the snapshot."""
+        return self.snapshot.totals(structure)
+
+    def up(self):  # pylint: disable=invalid-name
+        """Go to the parent directory."""
+        self._ascend()
+        self._subfolders = self._files = None
+        return self
+
+    def down(self, name):
+        """Go to the specified child directory."""
+        name = self.clear_name(name)
+        try:
+            index = self._subfolder(name)
+        except KeyError as exc:
+            raise OutOfStructureException from exc
+        self._descend(name, index)
+        self._subfolders = self._files = None
+        return self
+
+    def _subfolder(self, name):
+        """Index of a subfolder of the current folder."""
+        if self._subfolders is None:
+            self._subfolders = self.snapshot.subfolders(self.current)
+        return self._subfolders[name]
+
+    def folders(self):
+        """Get the folders in the current folder."""
+        if self._subfolders is None:
+            self._subfolders = self.snapshot.subfolders(self.current)
+        return list(self._subfolders)
+
+    def _has_folder(self, name):
+        """Is name a subfolder of the current folder?"""
+        try:
+            self._subfolder(name)
+        except KeyError:
+            return False
+        return True
+
+    @staticmethod
+    def _key(structure):
+        """Folder indices identify themselves."""
+        return structure
+
+    def files(self):
+        """Get the files in the current folder."""
+        if self._files is None:
+            self._files = self.snapshot.files(self.current)
+        return self._files
+
+    def children(self, structure):
+        """Names and indices of the subfolders of a folder index."""
+        return list(self.snapshot.subfolders(structure).items())
+
+    def files_of(self, structure):
+        """Files of a folder index, a list in fast mode, else name to
+        details."""
+        return self.snapshot.files(structure)
+
+    def modified_of(self, structure):
+        """Modification time of a folder index, None if it is not
+        recorded."""
+        modified = self.snapshot.folder(structure).modified
+        return None if math.isnan(modified) else modified
+
+    def errors_of(self, structure):
+        """Files and subfolders of a folder index which could not be read:
+        name to error."""
+        return self.snapshot.errors(structure)
+
+    def _listing(self, structure):
+        """Subfolder names, files and a mapping of name to subfolder."""
+        subfolders = self.snapshot.subfolders(structure)
+        return list(subfolders), self.snapshot.files(structure), subfolders
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Folders while loading progressively: handed over and changed by messages
+# only, to be handed over when complete, or part of a folder to be handed over
+_SHARED, _PENDING, _INNER = "shared", "pending", "inner"
+
+
+@instrumentation.timed("parse json")
+def load_progressively(filename, progress, depth=2):
+    """Parse a json snapshot, handing it over in pieces while parsing.
+
+    The pieces are sent as ("add", path, value) messages of progress, to be
+    applied in order as data[path[0]]...[path[-1]] = value to an empty
+    dictionary. Folders up to the given depth are sent as soon as their
+    files are read, without their subfolders; folders below are sent once
+    they are complete. So the top levels can be browsed early, and no
+    dictionary is changed by both threads. The files of each folder are
+    decoded by the json module, only the folders are parsed here. Like
+    file_table.load_json, files with details become FileTables."""
+    with compression.open_snapshot(filename, "r") as file:
+        text = file.read()
+    decoder = json.JSONDecoder()
+    scanstring = json.decoder.scanstring
+    position = _WHITESPACE.match(text).end()
+    if text[position:position + 1] != "{":
+        raise ValueError("Not a snapshot: {}".format(filename))
+    # Frames: node, path, state; the top level dictionary is the shared one
+    stack = [({}, (), _SHARED)]
+    position += 1
+    while stack:
+        position = _WHITESPACE.match(text, position).end()
+        char = text[position:position + 1]
+        if char == ",":
+            position += 1
+        elif char == "}":
+            position += 1
+            node, path, state = stack.pop()
+            if state is _PENDING:
+                progress.put("add", path, node)
+            if path:
+                progress.fraction = position / len(text)
+                progress.add_folder(node.get("__/files", []))
+        elif char == '"':
+            key, position = scanstring(text, position + 1)
+            position = _WHITESPACE.match(text, position).end()
+            if text[position:position + 1] != ":":
+                raise ValueError("Expected ':' at {}".format(position))
+            position = _WHITESPACE.match(text, position + 1).end()
+            node, path, state = stack[-1]
+            if is_reserved(key) or text[position:position + 1] != "{":
+                value, position = decoder.raw_decode(text, position)
+                if key == "__/files" and isinstance(value, dict):
+                    value = file_table.FileTable.from_dict(value) or value
+                if state is _SHARED:
+                    progress.put("add", path + (key,), value)
+                else:
+                    node[key] = value
+                continue
+            if state is _PENDING and len(path) <= depth:  # Send it early
+                progress.put("add", path, node)
+                state = _SHARED
+                stack[-1] = node, path, state
+            child = {}
+            if state is _SHARED:
+                stack.append((child, path + (key,), _PENDING))
+            else:
+                node[key] = child
+                stack.append((child, path + (key,), _INNER))
+            position += 1
+        else:
+            raise ValueError("Unexpected {!r} at {}".format(char, position))
+
+
+def open_traverser(filename):
+    """Traverser for a snapshot file, json or binary."""
+    if snapshot_format.is_binary(filename):
+        return MappedTraverser(filename)
+    return JsonTraverser(jsonfile=filename)
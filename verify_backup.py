@@ -0,0 +1,226 @@
+"""Check that a backup has everything a snapshot has.
+
+Compares a snapshot of a drive with the folder it was backed up to and
+reports the files of the snapshot which are missing in the backup or have
+another size or modification time there. The root folder of the snapshot
+is the backup folder itself; a snapshot with several root folders is
+expected to have them side by side in the backup folder.
+
+First, one walk through the snapshot builds an index of every folder path to
+its files. The folders of the index, and only these, are then read with
+os.scandir on a pool of threads, and the entries of each are matched with
+the files of the index by name; nothing is looked up in the tree of the
+snapshot again. Files which could not be read when the snapshot was taken
+are only checked for being there. A folder which is missing in the backup or
+cannot be read is reported once, the folders below it are not read; all
+their files count as missing. Files only in the backup are not reported. In
+fast mode, snapshots have no details, only missing files are found. A
+summary of the problems per top level folder ends the report; the exit code
+is 1 if there was any.
+
+Usage: python verify_backup.py SNAPSHOT BACKUP [--workers N]
+       [--tolerance SECONDS] [--summary-only]"""
+
+import os
+import sys
+import argparse
+import collections
+import concurrent.futures
+
+import instrumentation
+from query import details_of
+from traverser import open_traverser, sizeof_fmt
+
+MISSING = "missing"
+SIZE = "size"
+MODIFIED = "modified"
+FOLDER = "folder"  # A missing or unreadable folder
+PROBLEMS = (MISSING, SIZE, MODIFIED, FOLDER)
+WORKERS = 16  # Enough to keep a disk or a network share busy
+
+
+def build_index(traverser):
+    """List of (folder path relative to the backup, files, errors) of every
+    folder of a snapshot; errors are the files and folders which could not
+    be read, None if there were none."""
+    roots = traverser.children(traverser.data)
+    if len(roots) == 1:
+        walk = traverser.walk(roots[0][1], path="", nodes=True)
+    else:
+        walk = traverser.walk(path="", nodes=True)
+    return [(path, files, traverser.errors_of(structure) or None)
+            for path, _, files, structure in walk]
+
+
+def read_backup_folder(path):
+    """Name to (size, modification time) of the files of a folder; symlinks
+    count as files like when scanning."""
+    found = {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir() and not entry.is_symlink():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                found[entry.name] = None
+                continue
+            found[entry.name] = (stat.st_size, stat.st_mtime)
+    return found
+
+
+def check_folder(backup, path, files, errors, tolerance):
+    """Problems of a folder of the index: list of (problem, name, expected
+    details, found (size, modified)); name is None for the folder. The
+    details of files with errors are not compared. Also returns the number
+    of files checked."""
+    expected = list(details_of(files))
+    try:
+        found = read_backup_folder(os.path.join(backup, path))
+    except OSError as exc:
+        return [(FOLDER, None, len(expected), exc.strerror)], len(expected)
+    problems = []
+    for name, details in expected:
+        if name not in found:
+            problems.append((MISSING, name, details, None))
+            continue
+        actual = found[name]
+        if details is None or actual is None or (errors and name in errors):
+            continue
+        if details[0] != actual[0]:
+            problems.append((SIZE, name, details, actual))
+        elif abs(details[1] - actual[1]) > tolerance:
+            problems.append((MODIFIED, name, details, actual))
+    return problems, len(expected)
+
+
+def verify(index, backup, workers=WORKERS, tolerance=2.0):
+    """Yield (path, problems, files checked) for every folder of the index,
+    in its order, checked concurrently by a pool of threads. Folders below
+    one that could not be read are not read, their problems are None. The
+    index is in the order of a walk, they come right after it."""
+    failed = None  # Prefix of the paths below the last failed folder
+
+    def below_failed(path):
+        """Is the path below a folder that could not be read?"""
+        return failed is not None and path.startswith(failed)
+
+    def outcome(path, problems, checked):
+        """Note a failed folder, return the result."""
+        nonlocal failed
+        if problems and problems[0][0] == FOLDER:
+            failed = os.path.join(path, "")
+        return path, problems, checked
+
+    if workers <= 1:
+        for path, files, errors in index:
+            if below_failed(path):
+                yield path, None, len(files)
+            else:
+                yield outcome(path, *check_folder(backup, path, files,
+                                                  errors, tolerance))
+        return
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        window = collections.deque()
+
+        def take():
+            """Result of the oldest folder in the window."""
+            path, files, future = window.popleft()
+            if below_failed(path):
+                if future is not None:
+                    future.cancel()
+                return path, None, len(files)
+            return outcome(path, *future.result())
+
+        for path, files, errors in index:
+            future = None
+            if not below_failed(path):
+                future = pool.submit(check_folder, backup, path, files,
+                                     errors, tolerance)
+            window.append((path, files, future))
+            if len(window) > workers * 4:  # Keep memory bounded
+                yield take()
+        while window:
+            yield take()
+
+
+def top_folder(path):
+    """First folder of a path, "." for the root."""
+    return path.split(os.sep, 1)[0] if path else "."
+
+
+def format_problem(path, problem, name, details, actual):
+    """One readable line for a problem."""
+    if problem == FOLDER:
+        return "{:8} {}  ({} files, {})".format(problem, path or ".",
+                                               details, actual)
+    line = "{:8} {}".format(problem, os.path.join(path, name))
+    if problem == SIZE:
+        line += "  {} -> {}".format(sizeof_fmt(details[0]),
+                                    sizeof_fmt(actual[0]))
+    elif problem == MODIFIED:
+        line += "  {:+.0f} s".format(actual[1] - details[1])
+    return line
+
+
+def run(arguments):
+    """Verify with parsed arguments, print the report. Returns the total
+    of every problem column."""
+    with instrumentation.phase("index"):
+        index = build_index(open_traverser(arguments.snapshot))
+    summary = collections.defaultdict(collections.Counter)
+    with instrumentation.phase("verify"):
+        for path, problems, checked in verify(
+                index, arguments.backup, arguments.workers,
+                arguments.tolerance):
+            counts = summary[top_folder(path)]
+            counts["files"] += checked
+            if problems is None:  # Below a failed folder
+                counts[MISSING] += checked
+                continue
+            for problem in problems:
+                if problem[0] == FOLDER:  # Its files only count as missing
+                    counts[FOLDER] += 1
+                    counts[MISSING] += problem[2]
+                else:
+                    counts[problem[0]] += 1
+                if not arguments.summary_only:
+                    print(format_problem(path, *problem))
+    instrumentation.add("folders checked", len(index))
+    print("{:<30} {:>10} {:>10} {:>10} {:>10} {:>8}".format(
+        "top level folder", "files", *PROBLEMS))
+    total = collections.Counter()
+    for folder in sorted(summary):
+        total.update(summary[folder])
+        print("{:<30} {:>10} {:>10} {:>10} {:>10} {:>8}".format(
+            folder, summary[folder]["files"],
+            *(summary[folder][problem] for problem in PROBLEMS)))
+    print("{:<30} {:>10} {:>10} {:>10} {:>10} {:>8}".format(
+        "total", total["files"], *(total[problem] for problem in PROBLEMS)))
+    return total
+
+
+def main():
+    """Report what a backup lacks."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("snapshot", help="Snapshot of the drive, json or "
+                        "binary")
+    parser.add_argument("backup", help="Folder the drive was backed up to")
+    parser.add_argument("-w", "--workers", type=int, default=WORKERS,
+                        help="Folders read at the same time")
+    parser.add_argument("--tolerance", type=float, default=2.0,
+                        help="Seconds modification times may differ; FAT "
+                        "file systems store them to two seconds")
+    parser.add_argument("--summary-only", action="store_true",
+                        help="Print only the summary per top level folder")
+    instrumentation.add_arguments(parser)
+    arguments = parser.parse_args()
+    if not os.path.isdir(arguments.backup):
+        parser.error("{} is not a folder".format(arguments.backup))
+    with instrumentation.instrumented(arguments):
+        total = run(arguments)
+    sys.exit(1 if any(total[problem] for problem in PROBLEMS) else 0)
+
+
+if __name__ == '__main__':
+    main()